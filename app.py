@@ -1,16 +1,42 @@
 import streamlit as st
-from openai import OpenAI
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import time
-import random
-import requests
-from PIL import Image
 import base64
+import hashlib
+import json
+import logging
+import os
+import uuid
+import campaign
+import export
+import telemetry
+from campaign import (
+    BRIEF_THEMES, SAMPLE_IMAGES, SONG_GENRES,
+    brief_themes, generate_brief, generate_song, image_task, prefetch_image, render_brief, sample_brief, speculate_image, stream_brief_task,
+    vary_image
+)
+from inventory import stocked
+from campaign_state import CampaignState, memory_report
+from engine import CampaignEngine
+from media_cache import MediaCache
 
-# Configuration
-OPENAI_API_KEY = st.secrets.get("OPENAI_API_KEY", "")
-LEONARDO_API_KEY = st.secrets.get("LEORNADO_API_KEY", "")  # Note: keeping the misspelled key name as it exists in secrets.toml
+# Configuration - generation settings (API keys, Leonardo, caching, HTTP) are read by campaign.py
 APP_MODE = st.secrets.get("APP_MODE", "test")
 S3_BUCKET_URL = st.secrets.get("S3_BUCKET_URL", "https://your-s3-bucket.s3.amazonaws.com")
+STREAM_BRIEFS = st.secrets.get("STREAM_BRIEFS", True)  # Render briefs token-by-token while they are generated
+MEDIA_CACHE_DIR = st.secrets.get("MEDIA_CACHE_DIR", ".cache/media")  # Downloaded images and their display renditions
+IMAGE_DISPLAY_WIDTH = st.secrets.get("IMAGE_DISPLAY_WIDTH", 1024)  # Pixels; covers the centred column on retina screens
+ENGINE_WORKERS = st.secrets.get("ENGINE_WORKERS", 32)  # Threads the background campaign engine may block on API calls
+ENGINE_LANES = st.secrets.get("ENGINE_LANES", {"openai": 32, "leonardo": 32})  # Separate threads per provider, so one provider's queue never holds up another's tasks
+POLL_INTERVAL = st.secrets.get("POLL_INTERVAL", 0.3)  # Seconds between progress refreshes while a task runs
+METRICS_PORT = st.secrets.get("METRICS_PORT", 0)  # Serve Prometheus metrics at :PORT/metrics when set
+EXPORT_PORT = st.secrets.get("EXPORT_PORT", 0)  # Stream campaign ZIP downloads from :PORT/exports/ when set together with EXPORT_URL
+EXPORT_HOST = st.secrets.get("EXPORT_HOST", "127.0.0.1")  # Interface the export server listens on, normally only for the proxy in front of it
+EXPORT_URL = st.secrets.get("EXPORT_URL", "")  # Base URL browsers reach the export server at; download links are per replica, so route /exports/ with session affinity
+LOG_LEVEL = st.secrets.get("LOG_LEVEL", "WARNING")  # DEBUG also logs every timing span as a JSON line
+
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+logger = logging.getLogger("app")
 
 # Configure page
 st.set_page_config(
@@ -116,351 +142,377 @@ if 'current_step' not in st.session_state:
     st.session_state.current_step = 'auth'
 if 'authenticated' not in st.session_state:
     st.session_state.authenticated = False
-if 'team_name' not in st.session_state:
-    st.session_state.team_name = ""
-if 'briefs' not in st.session_state:
-    st.session_state.briefs = []
-if 'selected_brief' not in st.session_state:
-    st.session_state.selected_brief = None
-if 'images' not in st.session_state:
-    st.session_state.images = []
-if 'selected_images' not in st.session_state:
-    st.session_state.selected_images = []
-if 'selected_genre' not in st.session_state:
-    st.session_state.selected_genre = None
-if 'generated_song' not in st.session_state:
-    st.session_state.generated_song = None
-if 'debug_info' not in st.session_state:
-    st.session_state.debug_info = []
-
-# OpenAI client setup
-client = None
-if OPENAI_API_KEY and APP_MODE == "production":
+if 'campaign' not in st.session_state:
+    st.session_state.campaign = CampaignState()
+
+# Everything about the campaign in progress lives on one compact, slotted object
+state = st.session_state.campaign
+
+# OpenAI client, built once per process; it keeps its own connection pool across reruns
+@st.cache_resource
+def get_openai_client():
+    return campaign.create_openai_client(st.secrets)
+
+client = get_openai_client()
+
+# Generation cache, shared by every session in this process
+@st.cache_resource
+def get_generation_cache():
+    return campaign.create_generation_cache(st.secrets)
+
+# Pooled HTTP client for Leonardo and media fetches, shared by every session in this process
+@st.cache_resource
+def get_http_client():
+    return campaign.create_http_client(st.secrets)
+
+# Local media cache, so each remote image is downloaded and resized once per process
+@st.cache_resource
+def get_media_cache():
+    return MediaCache(MEDIA_CACHE_DIR, http=get_http_client())
+
+# Worker processes for branded social renditions, so resampling never blocks a script thread
+@st.cache_resource
+def get_rendition_pool():
+    return campaign.create_rendition_pool(st.secrets)
+
+# Streams campaign bundles straight from the caches to the browser, which st.download_button cannot do
+@st.cache_resource
+def get_export_server():
+    if not (EXPORT_PORT and EXPORT_URL):
+        return None  # Downloads go through st.download_button instead
+    try:
+        return export.ExportServer(host=EXPORT_HOST, port=EXPORT_PORT, public_url=EXPORT_URL).start()
+    except OSError as e:
+        logger.warning("Export server could not listen on port %s, so downloads are built in memory: %s", EXPORT_PORT, e)
+        return None
+
+# Leonardo job tracker, shared by every session in this process
+@st.cache_resource
+def get_leonardo_tracker():
+    return campaign.create_leonardo_tracker(st.secrets, get_http_client())
+
+# Provider rate limits, shared by every session so a busy room queues fairly instead of hitting 429s
+@st.cache_resource
+def get_rate_limiter():
+    return campaign.create_rate_limiter(st.secrets)
+
+# Anthem catalogue, indexed once per process and validated in the background
+@st.cache_resource
+def get_song_library():
+    return campaign.create_song_library(st.secrets, get_http_client())
+
+generation_cache = get_generation_cache()
+song_library = get_song_library()
+
+# Point the generation module at the shared resources once per process rather than on every rerun
+@st.cache_resource
+def configure_campaign():
+    campaign.configure(st.secrets, openai_client=client, cache=generation_cache, tracker=get_leonardo_tracker(), limiter=get_rate_limiter(), songs=song_library)
+    return campaign
+
+configure_campaign()
+
+# Campaigns pre-generated for the watchlisted teams while the providers are idle, served instantly when one is asked for
+@st.cache_resource
+def get_inventory():
+    return campaign.create_inventory(st.secrets)
+
+inventory = get_inventory()
+
+# Campaign state store; replicas pointed at the same store resume each other's campaigns
+@st.cache_resource
+def get_state_store():
+    return campaign.create_state_store(st.secrets)
+
+state_store = get_state_store()
+
+# Background campaign engine, started once per process; pages only add tasks and poll them
+@st.cache_resource
+def get_campaign_engine():
+    return CampaignEngine(max_workers=ENGINE_WORKERS, store=state_store, lanes=ENGINE_LANES).start()
+
+campaign_engine = get_campaign_engine()
+
+def restore_campaign():
+    # A new session (on another replica, or after a restart) resumes the campaign named in its URL
+    campaign_id = st.query_params.get("campaign")
+    if not state_store or not campaign_id:
+        return
     try:
-        #openai.api_key = OPENAI_API_KEY
-        client = OpenAI(api_key=OPENAI_API_KEY)
+        record = state_store.get(f"session:{campaign_id}", "state")
     except Exception as e:
-        print(f"Warning: Failed to initialize OpenAI client: {e}")
-        # App will fall back to test mode if client initialization fails
-
-# Sample data for test mode
-SAMPLE_IMAGES = [
-    "https://images.pexels.com/photos/358042/pexels-photo-358042.jpeg",
-    "https://images.pexels.com/photos/1752757/pexels-photo-1752757.jpeg",
-    "https://images.pexels.com/photos/1884574/pexels-photo-1884574.jpeg",
-    "https://images.pexels.com/photos/262524/pexels-photo-262524.jpeg",
-    "https://images.pexels.com/photos/1884576/pexels-photo-1884576.jpeg"
-]
-
-SONG_GENRES = [
-    {
-        "id": "rock-anthem",
-        "name": "Rock Anthem",
-        "description": "High-energy rock with powerful vocals and driving guitar riffs perfect for victory celebrations",
-        "emoji": "⚡"
-    },
-    {
-        "id": "electronic-hype", 
-        "name": "Electronic Hype",
-        "description": "Modern electronic beats with synthetic energy to pump up crowds and create excitement",
-        "emoji": "🎵"
-    },
-    {
-        "id": "orchestral-epic",
-        "name": "Orchestral Epic", 
-        "description": "Cinematic orchestral composition with dramatic crescendos for triumphant moments",
-        "emoji": "🎼"
-    },
-    {
-        "id": "inspirational-pop",
-        "name": "Inspirational Pop",
-        "description": "Uplifting pop melody with emotional lyrics that resonates with fans of all ages", 
-        "emoji": "❤️"
-    }
-]
-
-# Helper functions
-def generate_brief(team_name, brief_type="brief1"):
-    if APP_MODE == "test":
-        time.sleep(2)  # Simulate API delay
-        
-        if brief_type == "brief1":
-            return f"""# {team_name}
-
-## Core Narrative
-{team_name} represents the pinnacle of athletic excellence, community unity, and unwavering determination. This campaign celebrates not just the team's prowess on the field, but their role as hometown heroes who inspire greatness in every fan.
-
-## Key Themes
-- **Legacy & Tradition:** Honoring decades of championship spirit
-- **Community Pride:** Bringing the city together under one banner
-- **Unstoppable Force:** Showcasing athletic dominance and teamwork
-- **Fan Devotion:** Celebrating the passionate fanbase that fuels victory
-
-## Campaign Vision
-Create an emotional connection that transforms casual viewers into lifelong supporters, emphasizing how {team_name} embodies the fighting spirit of their community."""
-        else:
-            return f"""# {team_name}
-
-## Strategic Narrative
-{team_name} stands as a beacon of excellence, representing more than just athletic achievement – they embody the dreams, aspirations, and collective spirit of an entire community.
-
-## Core Pillars
-- **Innovation & Excellence:** Pushing boundaries in every game
-- **Unity in Diversity:** Bringing together fans from all walks of life
-- **Resilience & Grit:** Overcoming challenges with determination
-- **Championship Mentality:** Setting the standard for success
-
-## Creative Direction
-Develop a campaign that showcases {team_name} as both fierce competitors and community champions, creating an aspirational brand that resonates with fans' personal values and ambitions."""
-    
-    # Production mode - use OpenAI
+        logger.warning("Could not load campaign %s: %s", campaign_id, e)
+        return
+    if record:
+        try:
+            state.restore(record["campaign"])
+        except ValueError as e:
+            logger.warning("Campaign %s cannot be resumed: %s", campaign_id, e)
+            state.reset()
+            return
+        st.session_state.current_step = record["step"]
+
+def persist_campaign():
+    # Saved at the start of every run, which is after any callback or st.rerun() that changed it
+    if not st.session_state.authenticated:
+        return  # The URL keeps the campaign to resume until the passcode has been entered
+    if not state.campaign_id:
+        st.query_params.pop("campaign", None)
+        return
+    if st.query_params.get("campaign") != state.campaign_id:
+        st.query_params["campaign"] = state.campaign_id
+    if not state_store:
+        return
+    record = {"step": st.session_state.current_step, "campaign": state.to_dict()}
+    digest = hashlib.sha256(json.dumps(record, sort_keys=True).encode()).hexdigest()
+    if digest == st.session_state.get("persisted_digest"):
+        return
     try:
-        if brief_type == "brief1":
-            prompt = f"""Create a comprehensive marketing campaign brief for the sports team "{team_name}". 
-
-Format the response in markdown with the following structure:
-# {team_name}
-
-## Core Narrative
-[Write a compelling narrative about the team's identity and values]
-
-## Key Themes
-- **[Theme 1]:** [Description]
-- **[Theme 2]:** [Description]
-- **[Theme 3]:** [Description] 
-- **[Theme 4]:** [Description]
-
-## Campaign Vision
-[Describe the overall vision and goals for the marketing campaign]
-
-Focus on themes like legacy, community, excellence, and passion. Make it inspiring and emotionally engaging."""
-        else:
-            prompt = f"""Create a comprehensive marketing campaign brief for the sports team "{team_name}".
-
-Format the response in markdown with the following structure:
-# {team_name}
-
-## Strategic Narrative
-[Write about the team's role in the community and their broader impact]
-
-## Core Pillars
-- **[Pillar 1]:** [Description]
-- **[Pillar 2]:** [Description]
-- **[Pillar 3]:** [Description]
-- **[Pillar 4]:** [Description]
-
-## Creative Direction
-[Describe the creative approach and messaging strategy]
-
-Focus on themes like innovation, unity, resilience, and championship mentality. Make it aspirational and community-focused."""
-        
-        response = client.chat.completions.create(
-            model="gpt-4.1",
-            messages=[
-                {"role": "system", "content": "You are a professional marketing strategist creating campaign briefs for sports teams. Write compelling, emotionally engaging content in markdown format."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=500,
-            temperature=0.7
-        )
-        
-        return response.choices[0].message.content
+        state_store.put(f"session:{state.campaign_id}", "state", record)
+        st.session_state.persisted_digest = digest
     except Exception as e:
-        st.error(f"Error generating brief: {e}")
-        return generate_brief(team_name, brief_type)  # Fallback to test mode
-
-def generate_images(brief, count=1):  # Changed to generate just 1 image
-    # Clear previous debug info
-    st.session_state.debug_info = []
-    
-    if APP_MODE == "test":
-        st.session_state.debug_info.append("🧪 Running in TEST mode - using sample images")
-        time.sleep(4)  # Simulate API delay
-        random.shuffle(SAMPLE_IMAGES)
-        return SAMPLE_IMAGES[:1]  # Return just 1 image in test mode
-    
-    # Debug: Check configuration
-    st.session_state.debug_info.append(f"📊 APP_MODE = {APP_MODE}")
-    st.session_state.debug_info.append(f"🔑 Leonardo API Key Present: {'Yes' if LEONARDO_API_KEY else 'No'}")
-    st.session_state.debug_info.append(f"📏 Leonardo API Key Length: {len(LEONARDO_API_KEY) if LEONARDO_API_KEY else 0}")
-    
-    print(f"DEBUG: APP_MODE = {APP_MODE}")
-    print(f"DEBUG: LEONARDO_API_KEY present = {'Yes' if LEONARDO_API_KEY else 'No'}")
-    print(f"DEBUG: LEONARDO_API_KEY length = {len(LEONARDO_API_KEY) if LEONARDO_API_KEY else 0}")
-    
-    # Production mode - use GPT-4o-mini for prompt and Leonardo AI for image generation
+        logger.warning("Could not save campaign %s: %s", state.campaign_id, e)
+
+# A campaign URL resumes the campaign, but only behind the passcode
+if st.session_state.authenticated and 'restored' not in st.session_state:
+    st.session_state.restored = True
+    restore_campaign()
+
+# Metrics endpoint, started once per process; gauges read the shared resources at scrape time
+@st.cache_resource
+def get_metrics_server():
+    registry = telemetry.registry
+    registry.gauge("campaign_engine_tasks", "Engine tasks by status", lambda: {(status,): count for status, count in campaign_engine.stats()["tasks"].items()}, ("status",))
+    registry.gauge("rate_limit_waiting", "Calls queued for a provider", lambda: {(key,): limit["waiting"] for key, limit in get_rate_limiter().stats().items()}, ("limiter",))
+    registry.gauge("circuit_breaker_open", "1 while a provider's circuit breaker is rejecting calls", lambda: {(key,): int(breaker["state"] != "closed") for key, breaker in campaign.circuit_breakers.stats().items()}, ("breaker",))
+    registry.gauge("http_requests_in_flight", "Outbound HTTP requests in flight", lambda: get_http_client().stats()["in_flight"])
+    if generation_cache:
+        registry.gauge("generation_cache_lookups", "Generation cache lookups by result", lambda: {("hit",): generation_cache.hits, ("miss",): generation_cache.misses}, ("result",))
+    if song_library:
+        registry.gauge("song_library_tracks", "Anthem tracks by availability", lambda: {(status,): song_library.stats()[status] for status in ("available", "missing")}, ("status",))
+    if inventory:
+        registry.gauge("inventory_campaigns", "Pre-generated campaigns ready to serve", lambda: inventory.stats()["entries"])
+        registry.gauge("inventory_lookups", "Inventory lookups by result", lambda: {("hit",): inventory.hits, ("miss",): inventory.misses}, ("result",))
+    registry.gauge("session_state_sessions", "Sessions holding campaign state", lambda: memory_report()["sessions"])
+    registry.gauge("session_state_bytes", "Campaign state held across all sessions", lambda: memory_report()["total_bytes"])
+    return telemetry.MetricsServer(port=METRICS_PORT).start() if METRICS_PORT else None
+
+get_metrics_server()
+
+def task_tags():
+    # Spans inside engine tasks are tagged with the Streamlit session and team they run for
+    ctx = get_script_run_ctx()
+    return {"session": ctx.session_id if ctx else None, "team": state.team_name}
+
+# Progress bar percentage and status text for each stage the generators report
+IMAGE_STAGES = {
+    "starting": (5, "Preparing your campaign visual..."),
+    "waiting": (5, "High demand right now - you are #{position} in the {provider} queue..."),
+    "summarising": (10, "Turning your brief into an image prompt..."),
+    "queued": (35, "Image prompt ready - Leonardo AI job queued..."),
+    "polling": (40, "Leonardo AI is rendering your visual..."),
+    "fetched": (100, "Campaign visual ready!")
+}
+
+PROVIDER_NAMES = {"openai": "OpenAI", "leonardo": "Leonardo AI"}
+
+SONG_STAGES = {
+    "starting": (5, "Generating your custom victory anthem..."),
+    "selecting": (50, "Selecting the perfect track for your genre..."),
+    "complete": (100, "Victory anthem ready!")
+}
+
+RENDITION_STAGES = {
+    "starting": (5, "Branding your visual for social..."),
+    "rendering": (20, "Rendering social formats...")
+}
+
+def show_image(url, caption):
+    # Serve a cached, display-sized rendition instead of making every browser pull the full-size original
     try:
-        team_name = brief.split('\n')[0].replace('# ', '')
-        
-        # First, use GPT-4o-mini to summarize the brief into a single concise image prompt
-        st.session_state.debug_info.append("🤖 Generating image prompt with GPT-4o-mini...")
-        summary_response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are an expert at creating concise, visual image prompts for marketing campaigns. Convert the campaign brief into one powerful, detailed image prompt that captures the essence of the campaign."},
-                {"role": "user", "content": f"Convert this campaign brief into ONE powerful image prompt for a marketing visual:\n\n{brief}\n\nThe prompt should be 1-2 sentences, highly visual and descriptive, perfect for generating a stunning marketing campaign image."}
-            ],
-            max_tokens=150,
-            temperature=0.7
-        )
-        
-        # Get the prompt from the response
-        prompt = summary_response.choices[0].message.content.strip()
-        st.session_state.debug_info.append(f"✅ Generated prompt: {prompt}")
-        
-        # If the prompt is empty or too short, use a fallback
-        if not prompt or len(prompt) < 20:
-            prompt = f"Professional sports marketing poster featuring {team_name}, dynamic action shot with team colors, championship trophy, energetic crowd in background, high-quality stadium lighting, inspirational and powerful composition"
-            st.session_state.debug_info.append("⚠️ Using fallback prompt")
-        
-        # Add marketing campaign prefix to the prompt
-        prompt = f"Create a marketing campaign for {prompt}"
-        st.session_state.debug_info.append(f"🎯 Final prompt: {prompt}")
-        
-        # Use Leonardo AI for image generation
-        leonardo_url = "https://cloud.leonardo.ai/api/rest/v1/generations"
-        headers = {
-            "accept": "application/json",
-            "authorization": f"Bearer {LEONARDO_API_KEY}",
-            "content-type": "application/json"
-        }
-        
-        data = {
-            "modelId": "de7d3faf-762f-48e0-b3b7-9d0ac3a3fcf3",
-            "contrast": 3.5,
-            "prompt": prompt,
-            "num_images": 1,
-            "width": 1792,
-            "height": 1024,
-            "alchemy": True,
-            "styleUUID": "111dc692-d470-4eec-b791-3475abac4c46",
-            "enhancePrompt": False
-        }
-        
-        # Make the API request to Leonardo AI
-        st.session_state.debug_info.append("🎨 Sending request to Leonardo AI...")
-        print(f"DEBUG: Making Leonardo AI request to {leonardo_url}")
-        print(f"DEBUG: Request data = {data}")
-        response = requests.post(leonardo_url, headers=headers, json=data)
-        
-        st.session_state.debug_info.append(f"📡 Leonardo AI Response Status: {response.status_code}")
-        print(f"DEBUG: Leonardo AI response status = {response.status_code}")
-        print(f"DEBUG: Leonardo AI response = {response.text[:500]}...")
-        
-        if response.status_code == 200:
-            response_data = response.json()
-            generation_id = response_data.get("sdGenerationJob", {}).get("generationId")
-            
-            if generation_id:
-                st.session_state.debug_info.append(f"🔗 Generation ID: {generation_id}")
-                # Poll for completion - try multiple times with longer waits
-                max_attempts = 6
-                for attempt in range(max_attempts):
-                    time.sleep(5)  # Wait 5 seconds between checks
-                    st.session_state.debug_info.append(f"⏳ Polling attempt {attempt + 1}/{max_attempts}")
-                    
-                    # Get the generated image
-                    get_url = f"https://cloud.leonardo.ai/api/rest/v1/generations/{generation_id}"
-                    get_response = requests.get(get_url, headers=headers)
-                    
-                    st.session_state.debug_info.append(f"📥 Poll Status: {get_response.status_code}")
-                    if get_response.status_code == 200:
-                        generation_data = get_response.json()
-                        
-                        # Check multiple possible response structures
-                        generated_images = None
-                        if "generations_by_pk" in generation_data:
-                            generated_images = generation_data["generations_by_pk"].get("generated_images", [])
-                        elif "generated_images" in generation_data:
-                            generated_images = generation_data["generated_images"]
-                        elif "images" in generation_data:
-                            generated_images = generation_data["images"]
-                        
-                        if generated_images and len(generated_images) > 0:
-                            st.session_state.debug_info.append(f"🖼️ Found {len(generated_images)} generated images")
-                            print(f"DEBUG: Found {len(generated_images)} generated images")
-                            print(f"DEBUG: First image object: {generated_images[0]}")
-                            
-                            # Try different possible URL fields
-                            image_url = None
-                            first_image = generated_images[0]
-                            
-                            if "url" in first_image:
-                                image_url = first_image["url"]
-                                st.session_state.debug_info.append(f"✅ Found URL in 'url' field")
-                                print(f"DEBUG: Found URL in 'url' field: {image_url}")
-                            elif "image_url" in first_image:
-                                image_url = first_image["image_url"]
-                                st.session_state.debug_info.append(f"✅ Found URL in 'image_url' field")
-                                print(f"DEBUG: Found URL in 'image_url' field: {image_url}")
-                            elif "imageUrl" in first_image:
-                                image_url = first_image["imageUrl"]
-                                st.session_state.debug_info.append(f"✅ Found URL in 'imageUrl' field")
-                                print(f"DEBUG: Found URL in 'imageUrl' field: {image_url}")
-                            else:
-                                available_keys = list(first_image.keys())
-                                st.session_state.debug_info.append(f"❌ No URL found. Available keys: {available_keys}")
-                                print(f"DEBUG: No URL found in image object. Available keys: {available_keys}")
-                            
-                            if image_url:
-                                st.session_state.debug_info.append(f"🎉 SUCCESS! Returning Leonardo AI image")
-                                st.session_state.debug_info.append(f"📎 Image URL: {image_url}")
-                                st.session_state.debug_info.append(f"🔍 URL Type: {type(image_url)}")
-                                st.session_state.debug_info.append(f"📏 URL Length: {len(str(image_url))}")
-                                print(f"DEBUG: Successfully returning Leonardo AI image: {image_url}")
-                                return [image_url]
-                            else:
-                                st.session_state.debug_info.append("❌ No valid image URL found")
-                                print("DEBUG: No valid image URL found")
-                        else:
-                            st.session_state.debug_info.append("❌ No generated images found in response")
-                            print("DEBUG: No generated images found in response")
-                    
-                    # If this is the last attempt, break
-                    if attempt == max_attempts - 1:
-                        st.session_state.debug_info.append("⏰ Reached maximum polling attempts")
-                        break
-            else:
-                st.session_state.debug_info.append("❌ No generation ID received from Leonardo AI")
-        else:
-            st.session_state.debug_info.append(f"❌ Leonardo AI API Error: {response.text}")
-        
-        # If Leonardo AI fails, return a sample image
-        st.session_state.debug_info.append("🔄 Leonardo AI failed - using sample image as fallback")
-        print("DEBUG: Leonardo AI failed - using sample image")
-        return [SAMPLE_IMAGES[0]]
-        
+        image = get_media_cache().rendition(url, IMAGE_DISPLAY_WIDTH)
     except Exception as e:
-        # Fallback to test mode
-        st.session_state.debug_info.append(f"💥 Exception occurred: {str(e)}")
-        print(f"DEBUG: Exception occurred: {e}")
-        random.shuffle(SAMPLE_IMAGES)
-        return [SAMPLE_IMAGES[0]]
-
-def generate_song(genre):
-    if APP_MODE == "test":
-        time.sleep(6)  # Simulate generation delay
-        return {
-            "url": "https://example.com/generated-song.mp3",
-            "title": f"{genre['name']} Anthem"
+        logger.warning("Media cache unavailable for %s: %s", url, e)
+        image = url
+    st.image(image, caption=caption, use_column_width=True)
+
+def stage_progress(task, stages):
+    # Progress bar percentage and status text for the stage a running task last reported
+    stage = task["stage"] if task and task["stage"] in stages else "starting"
+    percent, text = stages[stage]
+    if stage == "polling":
+        percent = min(95, percent + 8 * task["info"].get("attempt", 0))
+    if stage == "waiting":
+        text = queue_text(task)
+    if stage == "rendering":
+        percent = percent + 80 * task["info"]["done"] // task["info"]["total"]
+        text = f"Rendered {task['info']['done']} of {task['info']['total']} social formats..."
+    return percent, text
+
+def queue_text(task):
+    provider = PROVIDER_NAMES.get(task["info"].get("provider"), "provider")
+    return IMAGE_STAGES["waiting"][1].format(position=task["info"].get("position", 1), provider=provider)
+
+@st.fragment(run_every=POLL_INTERVAL)
+def brief_progress():
+    # Polls the engine without holding the script thread; streamed text is painted as it arrives
+    brief_types = list(BRIEF_THEMES)
+    tasks = [campaign_engine.task(state.campaign_id, brief_type) for brief_type in brief_types]
+    finished = [task for task in tasks if task and task["finished"]]
+    
+    waiting = [task for task in tasks if task and task["stage"] == "waiting"]
+    
+    st.progress(int(len(finished) * 100 / len(brief_types)))
+    if waiting:
+        st.text(queue_text(waiting[0]))
+    else:
+        st.text(f"Received {len(finished)} of {len(brief_types)} campaign strategies..." if finished else "OpenAI is crafting personalized campaign strategies...")
+    
+    if STREAM_BRIEFS:
+        for i, (col, brief_type, task) in enumerate(zip(st.columns(len(brief_types)), brief_types, tasks)):
+            with col:
+                st.markdown(f"### ✨ OpenAI Strategy {i+1}")
+                st.markdown(render_brief(task["result"], brief_type) if task and task["status"] == "done" else (task or {}).get("info", {}).get("partial", ""))
+    
+    if len(finished) == len(brief_types):
+        state.briefs = {
+            brief_type: task["result"] if task["status"] == "done" else sample_brief(state.team_name, brief_type)
+            for brief_type, task in zip(brief_types, tasks)
         }
-    
-    # Production mode - select from S3
-    song_library = {
-        'rock-anthem': [f"{S3_BUCKET_URL}/rock-anthem-{i}.mp3" for i in range(1, 11)],
-        'electronic-hype': [f"{S3_BUCKET_URL}/electronic-hype-{i}.mp3" for i in range(1, 11)],
-        'orchestral-epic': [f"{S3_BUCKET_URL}/orchestral-epic-{i}.mp3" for i in range(1, 11)],
-        'inspirational-pop': [f"{S3_BUCKET_URL}/inspirational-pop-{i}.mp3" for i in range(1, 11)]
-    }
-    
-    time.sleep(6)  # Simulate generation delay for dramatic effect
-    genre_songs = song_library.get(genre['id'], [])
-    selected_song = random.choice(genre_songs) if genre_songs else f"{S3_BUCKET_URL}/rock-anthem-1.mp3"
-    
-    return {
-        "url": selected_song,
-        "title": f"{genre['name']} Victory Anthem"
-    }
+        st.session_state.current_step = "brief_selection"
+        st.rerun()
+
+@st.fragment(run_every=POLL_INTERVAL)
+def task_progress(task_name, stages, on_complete, ready=None):
+    # Repaints progress from the engine task's real status, then hands the task to on_complete once it
+    # finishes, or as soon as ready(task) says enough of it has arrived
+    task = campaign_engine.task(state.campaign_id, task_name)
+    percent, text = stage_progress(task, stages)
+    st.progress(percent)
+    st.text(text)
+    
+    if task is None or task["finished"] or (ready and ready(task)):
+        on_complete(task)
+        st.rerun()
+
+# Button callbacks run before the rerun the click triggers, so moving to the next page
+# costs that one rerun instead of a rerun plus an st.rerun() to redraw the new page
+def go_to(step):
+    st.session_state.current_step = step
+
+def select_brief(brief_type):
+    state.selected_brief = brief_type
+    st.session_state.current_step = "generating_images"
+
+def select_genre(genre):
+    state.genre_id = genre["id"]
+    st.session_state.current_step = "generating_song"
+
+def select_image(url):
+    state.selected_image = url
+
+def start_image_task():
+    task_name = f"{state.selected_brief}-image"
+    prefetch_task = f"{state.selected_brief}-image-prompt"
+    deps = [prefetch_task] if campaign_engine.task(state.campaign_id, prefetch_task) else []
+    campaign_engine.add_task(state.campaign_id, task_name, image_task, deps=deps, tags=task_tags(), lane="leonardo", brief=state.brief)
+    return task_name
+
+def regenerate_image():
+    # One new Leonardo job for the selected variant's slot, reusing the prompt the first run summarised,
+    # so a regenerate costs a single image job and no LLM call
+    state.regenerating = state.images.index(state.selected_image) if state.selected_image in state.images else 0
+    campaign_engine.add_task(
+        state.campaign_id, f"{state.selected_brief}-image-regenerate", vary_image,
+        replace=True, tags=task_tags(), lane="leonardo", prompt=state.image_prompt, brief=state.brief
+    )
+
+def ready_images(task):
+    # The variants that have landed so far, while the rest are still rendering
+    images = task["info"].get("images") if task else None
+    if images:
+        state.images = tuple(images)
+        if state.selected_image not in state.images:
+            state.selected_image = state.images[0]
+    return bool(images)
+
+def store_images(task):
+    if task and task["status"] == "done":
+        images = task["result"]["images"]
+        debug_info = task["result"]["debug_info"]
+    else:
+        images = [SAMPLE_IMAGES[0]]
+        telemetry.fallback("image", task["error"] if task else "task missing")
+        debug_info = [f"💥 Image task {task['status'] if task else 'missing'}: {task and task['error']}", "🔄 Leonardo AI failed - using sample image as fallback"]
+    state.debug.clear()
+    state.log(*debug_info)
+    state.images = tuple(images)
+    # Keep the variant the user already picked, else select the first
+    if state.selected_image not in state.images:
+        state.selected_image = state.images[0] if state.images else None
+    state.images_pending = False
+    # What "Regenerate Image" needs to skip straight to Leonardo
+    result = task["result"] if task and task["status"] == "done" else {}
+    state.image_prompt = result.get("prompt")
+    state.image_seeds = result.get("seeds", {})
+
+def store_regenerated(task):
+    # The new visual takes the regenerated variant's place and is selected; on failure the old one stays
+    slot, state.regenerating = state.regenerating, None
+    if not (task and task["status"] == "done"):
+        state.log(f"💥 Regenerate {task['status'] if task else 'missing'}: {task and task['error']} - keeping the current visual")
+        return
+    url = task["result"]["images"][0]
+    images = list(state.images)
+    if slot is not None and slot < len(images):
+        images[slot] = url
+    else:
+        images.append(url)
+    state.images = tuple(images)
+    state.image_seeds = {image: seed for image, seed in state.image_seeds.items() if image in state.images}
+    state.image_seeds.update(task["result"]["seeds"])
+    state.image_prompt = task["result"]["prompt"] or state.image_prompt
+    state.selected_image = url
+    state.log(*task["result"]["debug_info"])
+
+def start_renditions(replace=False):
+    # Idempotent like every engine task, so the genre page can start it and the final page pick it up
+    if state.selected_image:
+        campaign_engine.add_task(state.campaign_id, "renditions", get_rendition_pool().render_url, get_media_cache(),
+                                 state.selected_image, state.team_name, replace=replace, tags=task_tags())
+
+def prefetch_images(brief_type):
+    # Once a brief is ready its image prompt is summarised (and, with SPECULATIVE_IMAGES, its first job rendered)
+    # while the user is still reading, so picking it starts straight on the images
+    if APP_MODE != "test" and client is not None:
+        campaign_engine.add_task(state.campaign_id, f"{brief_type}-image-prompt", prefetch_image, deps=[brief_type], tags=task_tags(), lane="openai")
+        if campaign.SPECULATIVE_IMAGES:
+            # Tracked like any other task, so starting over or leaving the campaign cancels a job not yet started
+            campaign_engine.add_task(state.campaign_id, f"{brief_type}-image-speculative", speculate_image, deps=[f"{brief_type}-image-prompt"],
+                                     tags=task_tags(), lane="leonardo")
+
+def serve_stocked(entry):
+    # A campaign from the inventory: its briefs are shown at once as finished engine tasks, and the
+    # images of whichever brief is picked are prefetched and rendered as for any live campaign
+    state.briefs = dict(entry["briefs"])
+    for brief_type, brief in entry["briefs"].items():
+        campaign_engine.add_task(state.campaign_id, brief_type, stocked, brief, tags=task_tags())
+        prefetch_images(brief_type)
+    st.session_state.current_step = "brief_selection"
+
+def new_campaign():
+    # Reset campaign data (diagnostics included) but keep authentication
+    campaign_engine.discard(state.campaign_id)
+    if state_store:
+        try:
+            state_store.delete(f"session:{state.campaign_id}")
+        except Exception as e:
+            logger.warning("Could not delete campaign %s: %s", state.campaign_id, e)
+    state.reset()
+
+    # Ensure we stay authenticated and go to team input page
+    st.session_state.authenticated = True
+    st.session_state.current_step = "input"
 
 # Authentication Page
 def auth_page():
@@ -502,8 +554,13 @@ def team_input_page():
         submit = st.form_submit_button("Generate Campaign", use_container_width=True)
         
         if submit and team_name.strip():
-            st.session_state.team_name = team_name.strip()
-            st.session_state.current_step = "generating_briefs"
+            state.team_name = team_name.strip()
+            state.campaign_id = uuid.uuid4().hex
+            warm = inventory.take(state.team_name) if inventory else None
+            if warm:
+                serve_stocked(warm)
+            else:
+                st.session_state.current_step = "generating_briefs"
             st.rerun()
 
 # Brief Generation Page
@@ -511,27 +568,16 @@ def brief_generation_page():
     st.markdown('<div class="main-header">📄 Generating Campaign Briefs...</div>', unsafe_allow_html=True)
     st.markdown('<div class="powered-by">Powered by OpenAI</div>', unsafe_allow_html=True)
     
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    status_text.text("OpenAI is crafting personalized campaign strategies...")
-    
-    # Generate both briefs
-    briefs = []
-    for i, brief_type in enumerate(["brief1", "brief2"]):
-        progress_bar.progress((i + 1) * 50)
-        brief_content = generate_brief(st.session_state.team_name, brief_type)
-        briefs.append({
-            "id": f"openai-brief-{i+1}",
-            "content": brief_content,
-            "source": "openai",
-            "themes": ["Innovation", "Unity", "Resilience", "Championship"] if i == 1 else ["Legacy", "Community", "Excellence", "Passion"]
-        })
+    # Briefs run concurrently on the engine; each finished brief immediately starts its image-prompt prefetch
+    campaign_id = state.campaign_id
+    for brief_type in BRIEF_THEMES:
+        if STREAM_BRIEFS:
+            campaign_engine.add_task(campaign_id, brief_type, stream_brief_task, state.team_name, brief_type, tags=task_tags(), lane="openai")
+        else:
+            campaign_engine.add_task(campaign_id, brief_type, generate_brief, state.team_name, brief_type, tags=task_tags(), lane="openai")
+        prefetch_images(brief_type)
     
-    st.session_state.briefs = briefs
-    st.session_state.current_step = "brief_selection"
-    time.sleep(1)
-    st.rerun()
+    brief_progress()
 
 # Brief Selection Page
 def brief_selection_page():
@@ -540,154 +586,214 @@ def brief_selection_page():
     
     col1, col2 = st.columns(2)
     
-    for i, brief in enumerate(st.session_state.briefs):
+    for i, (brief_type, content) in enumerate(state.briefs.items()):
         with col1 if i == 0 else col2:
             st.markdown(f"### ✨ OpenAI Strategy {i+1}")
-            st.markdown(brief["content"])
+            st.markdown(render_brief(content, brief_type))
             
-            if st.button(f"Select Brief {i+1}", key=f"brief_{i}", use_container_width=True):
-                st.session_state.selected_brief = brief
-                st.session_state.current_step = "generating_images"
-                st.rerun()
+            st.button(f"Select Brief {i+1}", key=f"brief_{i}", use_container_width=True, on_click=select_brief, args=(brief_type,))
 
 # Image Generation Page
 def image_generation_page():
     st.markdown('<div class="main-header">🎨 Generating Campaign Image...</div>', unsafe_allow_html=True)
     st.markdown('<div class="powered-by">Powered by Leonardo AI</div>', unsafe_allow_html=True)
     
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    status_text.text(f"Creating stunning visual for {st.session_state.team_name} using Leonardo AI...")
-    
-    # Generate images
-    for i in range(100):
-        progress_bar.progress(i + 1)
-        time.sleep(0.30)  # 30 second total delay to match Leonardo AI generation time
-    
-    images = generate_images(st.session_state.selected_brief["content"], 1)
-    st.session_state.images = [{"id": f"image-{i}", "url": url, "prompt": f"Campaign visual {i+1}"} for i, url in enumerate(images)]
-    st.session_state.current_step = "image_selection"
-    st.rerun()
+    # Generate images on the engine - progress follows the real job status
+    # The selection page opens with the first variant; the rest join its grid as they land
+    task_name = start_image_task()
+
+    def on_complete(task):
+        if task and not task["finished"]:
+            state.images_pending = True
+        else:
+            store_images(task)
+        st.session_state.current_step = "image_selection"
+
+    task_progress(task_name, IMAGE_STAGES, on_complete, ready=ready_images)
 
 # Image Selection Page  
 def image_selection_page():
     st.markdown('<div class="main-header">🎨 Your Campaign Visual</div>', unsafe_allow_html=True)
     st.markdown('<div class="powered-by">Powered by Leonardo AI</div>', unsafe_allow_html=True)
-    st.markdown(f'<div class="sub-header">AI-generated marketing visual for <strong>{st.session_state.team_name}</strong></div>', unsafe_allow_html=True)
+    st.markdown(f'<div class="sub-header">AI-generated marketing visual for <strong>{state.team_name}</strong></div>', unsafe_allow_html=True)
     
     # Show debug info if available
-    if st.session_state.debug_info:
+    if state.debug:
         with st.expander("🔧 Generation Debug Info", expanded=False):
-            for info in st.session_state.debug_info:
+            for info in state.debug:
                 st.write(info)
             
             # Check if this was a fallback to sample image
-            if any("sample image as fallback" in info for info in st.session_state.debug_info):
+            if any("sample image as fallback" in info for info in state.debug):
                 st.error("⚠️ Leonardo AI generation failed - showing sample image instead")
-            elif any("TEST mode" in info for info in st.session_state.debug_info):
+            elif any("TEST mode" in info for info in state.debug):
                 st.info("ℹ️ Running in test mode - using sample images")
+            
+            if generation_cache:
+                stats = generation_cache.stats()
+                st.caption(f"🗄️ Generation cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries ({stats['bytes'] / 1024:.0f} KB)")
+            
+            http_stats = get_http_client().stats()
+            st.caption(f"🌐 HTTP pool: {http_stats['requests']} requests, {http_stats['errors']} errors, {http_stats['in_flight']} in flight")
+            for pool in http_stats["pools"]:
+                st.caption(f"↳ {pool['host']}: {pool['connections_opened']} connections opened for {pool['requests']} requests, {pool['idle']}/{pool['maxsize']} idle")
+            
+            renditions = get_rendition_pool().stats()
+            st.caption(f"📐 Renditions: {renditions['rendered']} rendered, {renditions['reused']} reused, {renditions['pending']} pending on {renditions['workers']} worker processes")
+            
+            if inventory:
+                stock = inventory.stats()
+                st.caption(f"📦 Warm inventory: {stock['entries']} campaigns ready for {stock['stocked_teams']} of {stock['teams']} teams, {stock['hits']} hits, {stock['misses']} misses, {stock['evicted']} evicted, {stock['failures']} failed fills")
+            
+            flights = campaign.inflight.stats()
+            st.caption(f"🤝 Single-flight: {flights['flights']} upstream calls, {flights['shared']} identical calls shared them")
+            
+            for key, limit in get_rate_limiter().stats().items():
+                st.caption(f"🚦 {key}: {limit['active']} active, {limit['waiting']} waiting, {limit['queued']} of {limit['admitted']} calls queued (avg {limit['avg_wait']:.1f}s)")
+            
+            for key, breaker in campaign.circuit_breakers.stats().items():
+                st.caption(f"🔌 {key}: circuit {breaker['state'].replace('_', '-')}, {breaker['error_rate']:.0%} of {breaker['calls']} recent calls failed, opened {breaker['opened']} times, {breaker['rejected']} calls rejected")
+            
+            # Where this campaign's time went, from the timing spans recorded by its engine tasks
+            for record in telemetry.spans(campaign=state.campaign_id):
+                st.caption(f"⏱️ {record['task']} › {record['span']}: {record['duration']:.2f}s ({record['outcome']})")
+            
+            if state_store:
+                store_stats = state_store.stats()
+                st.caption(f"💾 State store ({store_stats['backend']}): {store_stats['keys']} campaigns and result sets resumable from any replica")
+            
+            memory = memory_report()
+            st.caption(f"🧠 Session state: {state.nbytes() / 1024:.1f} KB here; {memory['sessions']} sessions hold {memory['total_bytes'] / 1024:.0f} KB (avg {memory['avg_bytes'] / 1024:.1f} KB, max {memory['max_bytes'] / 1024:.1f} KB)")
     
-    # Since we only generate one image now, display it and auto-proceed
-    if st.session_state.images and len(st.session_state.images) > 0:
-        col1, col2, col3 = st.columns([0.5, 3, 0.5])
-        with col2:
-            try:
-                image_url = st.session_state.images[0]["url"]
-                
-                # Debug: Show the URL we're trying to use
-                if st.session_state.debug_info:
-                    st.session_state.debug_info.append(f"🖼️ Attempting to display image URL: {image_url}")
-                
-                                 # Validate URL
-                if image_url and isinstance(image_url, str) and len(image_url.strip()) > 0:
-                    st.image(image_url, caption="Campaign Visual", use_column_width=True)
-                else:
-                    st.error("❌ Invalid image URL received from Leonardo AI")
-                    st.write(f"URL received: {repr(image_url)}")
-                    # Fallback to a sample image
-                    st.image(SAMPLE_IMAGES[0], caption="Campaign Visual (Sample)", use_column_width=True)
-                    
-            except Exception as e:
-                st.error(f"❌ Error displaying image: {str(e)}")
-                st.write(f"Image URL: {repr(st.session_state.images[0].get('url', 'No URL'))}")
-                # Fallback to a sample image
-                st.image(SAMPLE_IMAGES[0], caption="Campaign Visual (Sample)", use_column_width=True)
-        
-        # Automatically select the single image
-        st.session_state.selected_images = [st.session_state.images[0]]
-        
-        # Button columns for Continue and Regenerate
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            if st.button("🔄 Regenerate Image", use_container_width=True):
-                st.session_state.current_step = "generating_images"
-                st.rerun()
-        
-        with col2:
-            if st.button("✅ Continue with This Visual", use_container_width=True):
-                st.session_state.current_step = "genre_selection"
-                st.rerun()
+    if state.images or state.images_pending:
+        image_panel()
+        st.button("✅ Continue with This Visual", use_container_width=True, on_click=go_to, args=("genre_selection",), disabled=not state.selected_image)
     else:
         st.error("No images were generated. Please try again.")
-        if st.button("Go Back", use_container_width=True):
-            st.session_state.current_step = "brief_selection"
-            st.rerun()
+        st.button("Go Back", use_container_width=True, on_click=go_to, args=("brief_selection",))
+
+# The variants and their buttons rerun on their own; the page is redrawn once the last variant lands
+@st.fragment
+def image_panel():
+    if state.images_pending:
+        variant_progress()
+        return
+    if state.regenerating is not None:
+        task_progress(f"{state.selected_brief}-image-regenerate", IMAGE_STAGES, store_regenerated)
+        image_grid()
+        return
+    
+    image_grid()
+    st.button("🔄 Regenerate Image", use_container_width=True, on_click=regenerate_image)
+
+@st.fragment(run_every=POLL_INTERVAL)
+def variant_progress():
+    # Adding the task is a no-op unless this replica has never seen it (the session moved here mid-render)
+    task = campaign_engine.task(state.campaign_id, start_image_task())
+    ready_images(task)
+    percent, text = stage_progress(task, IMAGE_STAGES)
+    st.progress(percent)
+    st.text(f"{len(state.images)} of {campaign.IMAGE_VARIANTS} visuals ready - {text}" if state.images else text)
+    image_grid()
+    
+    if task is None or task["finished"]:
+        store_images(task)
+        st.rerun()
+
+def image_grid():
+    # A single visual is shown centred; variants are laid out two per row, each with its own pick button
+    if len(state.images) == 1:
+        col1, col2, col3 = st.columns([0.5, 3, 0.5])
+        with col2:
+            show_variant(state.images[0], "Campaign Visual")
+        return
+    
+    cols = st.columns(2)
+    for i, image_url in enumerate(state.images):
+        selected = image_url == state.selected_image
+        seed = state.image_seeds.get(image_url)
+        with cols[i % 2]:
+            show_variant(image_url, f"Variant {i+1}" + (f" · seed {seed}" if seed is not None else "") + (" (selected)" if selected else ""))
+            st.button("✅ Selected" if selected else "Use This Visual", key=f"variant_{i}", use_container_width=True,
+                      disabled=selected, on_click=select_image, args=(image_url,))
+
+def show_variant(image_url, caption):
+    try:
+        # Validate URL
+        if image_url and isinstance(image_url, str) and len(image_url.strip()) > 0:
+            show_image(image_url, caption=caption)
+        else:
+            st.error("❌ Invalid image URL received from Leonardo AI")
+            st.write(f"URL received: {repr(image_url)}")
+            # Fallback to a sample image
+            show_image(SAMPLE_IMAGES[0], caption="Campaign Visual (Sample)")
+            
+    except Exception as e:
+        st.error(f"❌ Error displaying image: {str(e)}")
+        st.write(f"Image URL: {repr(image_url)}")
+        # Fallback to a sample image
+        show_image(SAMPLE_IMAGES[0], caption="Campaign Visual (Sample)")
 
 # Genre Selection Page
 def genre_selection_page():
     st.markdown('<div class="main-header">🎵 Choose Your Anthem Style</div>', unsafe_allow_html=True)
-    st.markdown(f'<div class="sub-header">Select the perfect musical genre for <strong>{st.session_state.team_name}</strong>\'s victory anthem</div>', unsafe_allow_html=True)
+    st.markdown(f'<div class="sub-header">Select the perfect musical genre for <strong>{state.team_name}</strong>\'s victory anthem</div>', unsafe_allow_html=True)
     st.markdown('<div class="powered-by">Powered by Suno AI</div>', unsafe_allow_html=True)
     
+    # Pick each genre's track now and download them while the user chooses, so the anthem plays instantly
+    if song_library and not state.song_picks:
+        picks = {genre["id"]: song_library.pick(genre["id"]) for genre in SONG_GENRES}
+        state.song_picks = {genre_id: track["url"] for genre_id, track in picks.items() if track}
+        campaign_engine.add_task(state.campaign_id, "song-prefetch", song_library.prefetch, list(state.song_picks.values()), get_media_cache(), tags=task_tags())
+    # Social formats render in the background while the user chooses too
+    start_renditions()
+    
     cols = st.columns(2)
     
     for i, genre in enumerate(SONG_GENRES):
         with cols[i % 2]:
-            if st.button(f"{genre['emoji']} {genre['name']}", key=f"genre_{i}", use_container_width=True):
-                st.session_state.selected_genre = genre
-                st.session_state.current_step = "generating_song"
-                st.rerun()
+            st.button(f"{genre['emoji']} {genre['name']}", key=f"genre_{i}", use_container_width=True, on_click=select_genre, args=(genre,))
             st.write(genre["description"])
             st.write("---")
 
 # Song Generation Page
 def song_generation_page():
     st.markdown('<div class="main-header">🎵 Generating Victory Anthem...</div>', unsafe_allow_html=True)
-    st.markdown(f'<div class="sub-header">Creating {st.session_state.selected_genre["name"]} for {st.session_state.team_name}</div>', unsafe_allow_html=True)
+    st.markdown(f'<div class="sub-header">Creating {state.genre["name"]} for {state.team_name}</div>', unsafe_allow_html=True)
     st.markdown('<div class="powered-by">Powered by Suno AI</div>', unsafe_allow_html=True)
     
-    progress_bar = st.progress(0)
-    status_text = st.empty()
+    # Generate song on the engine - progress follows the real job status
+    genre = state.genre
+    campaign_engine.add_task(state.campaign_id, f"song-{genre['id']}", generate_song, genre, tags=task_tags(), track_url=state.song_picks.get(genre["id"]))
     
-    status_text.text("Generating your custom victory anthem...")
-    
-    # Simulate song generation with progress
-    for i in range(100):
-        progress_bar.progress(i + 1)
-        time.sleep(0.06)  # 6 second total delay
+    def on_complete(task):
+        if task and task["status"] == "done":
+            state.generated_song = task["result"]
+        else:
+            state.generated_song = {"url": state.song_picks.get(genre["id"]), "title": f"{genre['name']} Victory Anthem"}
+        # Everything the final page needs is in the session now, so free the engine's copy right away
+        campaign_engine.discard(state.campaign_id)
+        state.complete()
+        st.session_state.current_step = "complete"
     
-    song = generate_song(st.session_state.selected_genre)
-    st.session_state.generated_song = song
-    st.session_state.current_step = "complete"
-    st.rerun()
+    task_progress(f"song-{genre['id']}", SONG_STAGES, on_complete)
 
 # Final Campaign Page
 def final_campaign_page():
     st.markdown('<div class="main-header">🏆 Campaign Complete!</div>', unsafe_allow_html=True)
-    st.markdown(f'<div class="sub-header">Your AI-powered marketing campaign for <strong>{st.session_state.team_name}</strong> is ready</div>', unsafe_allow_html=True)
+    st.markdown(f'<div class="sub-header">Your AI-powered marketing campaign for <strong>{state.team_name}</strong> is ready</div>', unsafe_allow_html=True)
     
     # Brief Section
     st.markdown("## 📄 Strategic Brief")
     st.markdown('<div class="powered-by">Powered by OpenAI</div>', unsafe_allow_html=True)
-    st.markdown(st.session_state.selected_brief["content"])
+    st.markdown(render_brief(state.brief, state.selected_brief))
     
     # Themes
-    if st.session_state.selected_brief.get("themes"):
+    themes = brief_themes(state.brief)
+    if themes:
         st.write("**Campaign Themes:**")
-        theme_cols = st.columns(len(st.session_state.selected_brief["themes"]))
-        for i, theme in enumerate(st.session_state.selected_brief["themes"]):
+        theme_cols = st.columns(len(themes))
+        for i, theme in enumerate(themes):
             theme_cols[i].markdown(f"🏷️ **{theme}**")
     
     st.markdown("---")
@@ -697,43 +803,69 @@ def final_campaign_page():
     st.markdown('<div class="powered-by">Powered by Leonardo AI</div>', unsafe_allow_html=True)
     
     # Display single image centered
-    if st.session_state.selected_images and len(st.session_state.selected_images) > 0:
+    if state.selected_image:
         col1, col2, col3 = st.columns([0.5, 3, 0.5])
         with col2:
             try:
-                image_url = st.session_state.selected_images[0]["url"]
+                image_url = state.selected_image
                 if image_url and isinstance(image_url, str) and len(image_url.strip()) > 0:
-                    st.image(image_url, caption="Campaign Visual", use_column_width=True)
+                    show_image(image_url, caption="Campaign Visual")
                 else:
                     st.error("❌ Invalid image URL")
-                    st.image(SAMPLE_IMAGES[0], caption="Campaign Visual (Sample)", use_column_width=True)
+                    show_image(SAMPLE_IMAGES[0], caption="Campaign Visual (Sample)")
             except Exception as e:
                 st.error(f"❌ Error displaying image: {str(e)}")
-                st.image(SAMPLE_IMAGES[0], caption="Campaign Visual (Sample)", use_column_width=True)
+                show_image(SAMPLE_IMAGES[0], caption="Campaign Visual (Sample)")
     
     st.markdown("---")
     
+    # Social Formats Section
+    if state.selected_image:
+        st.markdown("## 📐 Social Formats")
+        start_renditions()
+        task = campaign_engine.task(state.campaign_id, "renditions")
+        paths = task["result"] if task and task["status"] == "done" else {}
+        if paths and not all(os.path.exists(path) for path in paths.values()):
+            # Rendered on another replica (the session moved here); render this replica's copies
+            start_renditions(replace=True)
+            task = campaign_engine.task(state.campaign_id, "renditions")
+        if task is None or not task["finished"]:
+            task_progress("renditions", RENDITION_STAGES, lambda task: None)
+        elif task["status"] == "done":
+            social_formats(task["result"])
+        else:
+            st.info("📐 Social formats are not available for this visual")
+        st.markdown("---")
+    
     # Song Section
     st.markdown("## 🎵 Victory Anthem")
     st.markdown('<div class="powered-by">Powered by Suno AI</div>', unsafe_allow_html=True)
-    if st.session_state.generated_song:
-        st.markdown(f"### 🎼 {st.session_state.generated_song['title']}")
-        st.markdown(f"**Genre:** {st.session_state.selected_genre['name']}")
-        st.markdown(f"**Style:** {st.session_state.selected_genre['description']}")
+    if state.generated_song:
+        st.markdown(f"### 🎼 {state.generated_song['title']}")
+        st.markdown(f"**Genre:** {state.genre['name']}")
+        st.markdown(f"**Style:** {state.genre['description']}")
+        if state.generated_song.get("duration"):
+            minutes, seconds = divmod(round(state.generated_song["duration"]), 60)
+            st.markdown(f"**Length:** {minutes}:{seconds:02d}")
         
         # Real audio player with S3 files
-        if st.session_state.generated_song.get("url"):
-            song_url = st.session_state.generated_song["url"]
+        if state.generated_song.get("url"):
+            song_url = state.generated_song["url"]
+            
+            # Play the copy prefetched while the genres were on screen; stream from S3 if it is not local
+            # A lookup only: a prefetch still in flight must not turn into a download on the script thread
+            if song_library and song_library.track(song_url):
+                song_url = get_media_cache().cached_path(song_url) or song_url
             
             # Try to load the audio file
             try:
                 st.audio(song_url, format="audio/mp3")
-                st.markdown(f"🎵 **Now Playing:** {st.session_state.generated_song['title']}")
+                st.markdown(f"🎵 **Now Playing:** {state.generated_song['title']}")
             except Exception as e:
                 # If S3 files aren't accessible, show a demo message
                 st.warning("🎵 Audio files are currently being configured for public access")
-                st.info(f"**Selected Track:** {st.session_state.generated_song['title']}")
-                st.markdown(f"**Genre:** {st.session_state.selected_genre['name']}")
+                st.info(f"**Selected Track:** {state.generated_song['title']}")
+                st.markdown(f"**Genre:** {state.genre['name']}")
                 st.markdown("*In the full production version, this would play the actual victory anthem*")
         else:
             st.info("🎵 Audio file not available")
@@ -743,17 +875,40 @@ def final_campaign_page():
     # Success message
     st.markdown('<div class="success-message">✅ Victory Anthem Generated! Your custom victory anthem is ready</div>', unsafe_allow_html=True)
     
+    # Download Campaign Button
+    export_server = get_export_server()
+    if export_server:
+        st.link_button("📦 Download Campaign (ZIP)", export_server.register(state.campaign_id, state.team_name, campaign_bundle()), use_container_width=True)
+    elif st.button("📦 Prepare Campaign Download", use_container_width=True):
+        # Without the export server Streamlit needs the whole archive in memory, so it is only built on request
+        st.download_button("⬇️ Download Campaign (ZIP)", b"".join(export.stream_zip(campaign_bundle())), file_name=f"{export.slugify(state.team_name)}.zip",
+                           mime="application/zip", use_container_width=True)
+    
     # New Campaign Button
-    if st.button("🔄 Create New Campaign", use_container_width=True):
-        # Reset campaign data but keep authentication
-        for key in ['team_name', 'briefs', 'selected_brief', 'images', 'selected_images', 'selected_genre', 'generated_song']:
-            if key in st.session_state:
-                del st.session_state[key]
-        
-        # Ensure we stay authenticated and go to team input page
-        st.session_state.authenticated = True
-        st.session_state.current_step = "input"
-        st.rerun()
+    st.button("🔄 Create New Campaign", use_container_width=True, on_click=new_campaign)
+
+def campaign_bundle():
+    # ZIP entries for the final page; each asset is read from the local caches (or upstream) only as it is downloaded
+    task = campaign_engine.task(state.campaign_id, "renditions")
+    renditions = task["result"] if task and task["status"] == "done" else {}
+    song = state.generated_song or {}
+    details = {"team": state.team_name, "brief": state.brief, "genre": state.genre["name"] if state.genre else None, "image_url": state.selected_image, "song": song}
+    return export.campaign_entries(
+        state.team_name, render_brief(state.brief, state.selected_brief), state.selected_image,
+        {name: path for name, path in renditions.items() if os.path.exists(path)}, song.get("url"), details,
+        media=get_media_cache(), http=get_http_client()
+    )
+
+def social_formats(paths):
+    # One tab per format, previewed at a common height, each with its own download
+    formats = get_rendition_pool().formats
+    for tab, (name, path) in zip(st.tabs(list(paths)), paths.items()):
+        width, height = formats.get(name, (1, 1))
+        with tab:
+            st.image(path, width=min(700, round(480 * width / height)))
+            with open(path, "rb") as f:
+                st.download_button(f"⬇️ Download {name}", f.read(), file_name=f"{state.team_name}-{name.replace(':', 'x')}.jpg",
+                                   mime="image/jpeg", key=f"rendition_{name}", use_container_width=True)
 
 # Main App Logic
 def main():
@@ -779,4 +934,5 @@ def main():
         final_campaign_page()
 
 if __name__ == "__main__":
+    persist_campaign()
     main() 
\ No newline at end of file
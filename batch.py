@@ -0,0 +1,244 @@
+"""Headless batch campaign generation for a whole league of teams.
+
+    python batch.py teams.csv --out campaigns.jsonl --concurrency 20 --openai-concurrency 8 --leonardo-concurrency 4
+
+Teams are read from a CSV (a "team" or "team_name" column, else the first column),
+a JSONL file (the same keys) or a plain list with one team per line. Each campaign
+is appended to the output JSONL as soon as it finishes, and teams already recorded
+there as complete are skipped, so an interrupted run resumes where it stopped.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import campaign
+import export
+import telemetry
+from engine import CampaignEngine
+
+TEAM_KEYS = ("team", "team_name")
+
+
+def read_teams(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            rows = [json.loads(line) for line in f if line.strip()]
+            teams = [next(row[key] for key in TEAM_KEYS if key in row) for row in rows]
+        elif path.endswith(".csv"):
+            reader = csv.reader(f)
+            header = next(reader, [])
+            columns = [name.strip().lower() for name in header]
+            column = next((columns.index(key) for key in TEAM_KEYS if key in columns), None)
+            if column is None:
+                # No recognised header, so the first row is a team too
+                teams = [header[0]] if header else []
+                column = 0
+            else:
+                teams = []
+            teams += [row[column] for row in reader if row]
+        else:
+            teams = list(f)
+    # Keep the first occurrence of each team, in input order
+    return list(dict.fromkeys(team.strip() for team in teams if team.strip()))
+
+
+def completed_teams(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # A line cut short by a crash; that team is simply run again
+            if record.get("status") == "complete":
+                done.add(record["team"])
+    return done
+
+
+class ResultWriter:
+    """Appends one JSON line per campaign and syncs it to disk before returning."""
+
+    def __init__(self, path):
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def slugify(text):
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-") or "team"
+
+
+def download_image(http, url, folder, team_name):
+    extension = os.path.splitext(urlparse(url).path)[1] or ".png"
+    path = os.path.join(folder, slugify(team_name) + extension)
+    response = http.get(url)
+    response.raise_for_status()
+    with open(path + ".part", "wb") as f:
+        f.write(response.content)
+    os.replace(path + ".part", path)
+    return path
+
+
+def campaign_image(brief, *prepared, count=1, on_status=None):
+    # Engine task: the brief comes first, then the optional prefetched prompt
+    return campaign.image_task(*prepared, brief=brief, count=count, on_status=on_status)
+
+
+def run_team(engine, team_name, brief_type, genre, http=None, images_dir=None, variants=1, renditions=None, export_dir=None):
+    started = time.time()
+    campaign_id = f"batch-{team_name}"
+    image_deps = [brief_type]
+    tags = {"team": team_name}
+    engine.add_task(campaign_id, brief_type, campaign.generate_brief, team_name, brief_type, tags=tags, lane="openai")
+    if campaign.APP_MODE != "test" and campaign.client is not None:
+        engine.add_task(campaign_id, "image-prompt", campaign.prefetch_image, deps=[brief_type], tags=tags, lane="openai")
+        image_deps.append("image-prompt")
+    engine.add_task(campaign_id, "image", campaign_image, deps=image_deps, tags=tags, lane="leonardo", count=variants)
+    engine.add_task(campaign_id, "song", campaign.generate_song, genre, tags=tags)
+
+    brief = engine.wait(campaign_id, brief_type)
+    image = engine.wait(campaign_id, "image")
+    song = engine.wait(campaign_id, "song")
+    engine.discard(campaign_id)
+
+    errors = {task["name"]: task["error"] for task in (brief, image, song) if task["status"] != "done"}
+    if campaign.APP_MODE != "test":
+        # The generators fall back to sample content rather than fail; recorded as failures, so a resumed run retries them
+        if brief["status"] == "done" and brief["result"] == campaign.sample_brief(team_name, brief_type):
+            errors[brief_type] = "Fell back to the sample brief"
+        if image["status"] == "done" and not image["result"].get("seeds"):
+            errors["image"] = "Fell back to a sample image"
+        if song["status"] == "done" and not song["result"]["url"]:
+            errors["song"] = "No anthem track available"
+    image_urls = image["result"]["images"] if image["status"] == "done" else []
+    image_url = image_urls[0] if image_urls else None
+    record = {
+        "team": team_name,
+        "status": "failed" if errors else "complete",
+        "brief_type": brief_type,
+        "brief": brief["result"],
+        "brief_markdown": campaign.render_brief(brief["result"], brief_type) if brief["status"] == "done" else None,
+        "image_url": image_url,
+        "image_urls": image_urls,
+        "image_path": None,
+        "renditions": {},
+        "export_path": None,
+        "song": song["result"],
+        "genre": genre["id"]
+    }
+    if image_url and images_dir:
+        try:
+            record["image_path"] = download_image(http, image_url, images_dir, team_name)
+        except Exception as e:
+            errors["image-download"] = str(e)
+            record["status"] = "failed"
+    if record["image_path"] and renditions:
+        try:
+            record["renditions"] = renditions.render(record["image_path"], team_name, images_dir)
+        except Exception as e:
+            errors["renditions"] = str(e)
+            record["status"] = "failed"
+    if export_dir and not errors:
+        # Streamed to disk a chunk at a time, so any number of teams export in bounded memory
+        try:
+            entries = export.campaign_entries(team_name, record["brief_markdown"], record["image_path"] or image_url, record["renditions"],
+                                              (record["song"] or {}).get("url"), details=record, http=http)
+            record["export_path"] = export.write_zip(os.path.join(export_dir, export.slugify(team_name) + ".zip"), entries)
+        except Exception as e:
+            errors["export"] = str(e)
+            record["status"] = "failed"
+    record["errors"] = errors
+    record["elapsed"] = round(time.time() - started, 3)
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("teams", help="CSV, JSONL or plain text file of team names")
+    parser.add_argument("--out", default="campaigns.jsonl", help="results are appended here; completed teams are skipped")
+    parser.add_argument("--secrets", default=".streamlit/secrets.toml", help="the app's settings file")
+    parser.add_argument("--concurrency", type=int, default=10, help="teams in flight at once")
+    parser.add_argument("--openai-concurrency", type=int, default=8, help="concurrent OpenAI requests per model")
+    parser.add_argument("--leonardo-concurrency", type=int, default=4, help="concurrent Leonardo jobs")
+    parser.add_argument("--brief", default="brief1", choices=sorted(campaign.BRIEF_THEMES))
+    parser.add_argument("--genre", choices=[genre["id"] for genre in campaign.SONG_GENRES], help="default: random per team")
+    parser.add_argument("--variants", type=int, default=1, help="image variants per team, each a parallel Leonardo job; image_url is the first")
+    parser.add_argument("--images-dir", help="also download each campaign image into this folder")
+    parser.add_argument("--renditions", action="store_true", help="also render branded social formats of each image into --images-dir")
+    parser.add_argument("--export-dir", help="also write each campaign's brief, images and anthem as a ZIP into this folder")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port while the batch runs")
+    args = parser.parse_args()
+
+    settings = campaign.load_settings(args.secrets)
+    logging.basicConfig(level=settings.get("LOG_LEVEL", "WARNING"), format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    if args.metrics_port:
+        telemetry.MetricsServer(port=args.metrics_port).start()
+    http = campaign.create_http_client(settings)
+    campaign.configure(
+        settings,
+        openai_client=campaign.create_openai_client(settings),
+        cache=campaign.create_generation_cache(settings),
+        tracker=campaign.create_leonardo_tracker(settings, http),
+        limiter=campaign.create_rate_limiter(settings, concurrency={"openai": args.openai_concurrency, "leonardo": args.leonardo_concurrency}),
+        songs=campaign.create_song_library(settings, http)
+    )
+    if args.images_dir:
+        os.makedirs(args.images_dir, exist_ok=True)
+    renditions = campaign.create_rendition_pool(settings) if args.renditions and args.images_dir else None
+
+    teams = read_teams(args.teams)
+    done = completed_teams(args.out)
+    pending = [team for team in teams if team not in done]
+    print(f"{len(teams)} teams, {len(teams) - len(pending)} already complete, {len(pending)} to run ({campaign.APP_MODE} mode)", file=sys.stderr)
+
+    # Each team holds up to three engine tasks at once, at most one per lane
+    engine = CampaignEngine(max_workers=args.concurrency, lanes={"openai": args.concurrency, "leonardo": args.concurrency}).start()
+    genres = {genre["id"]: genre for genre in campaign.SONG_GENRES}
+    writer = ResultWriter(args.out)
+    started = time.time()
+    failed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            futures = {
+                pool.submit(run_team, engine, team, args.brief,
+                            genres[args.genre] if args.genre else random.choice(campaign.SONG_GENRES),
+                            http, args.images_dir, args.variants, renditions, args.export_dir): team
+                for team in pending
+            }
+            for i, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                writer.write(record)
+                failed += record["status"] != "complete"
+                print(f"[{i}/{len(pending)}] {record['team']}: {record['status']} in {record['elapsed']:.1f}s", file=sys.stderr)
+    finally:
+        writer.close()
+        if renditions:
+            renditions.shutdown()
+
+    elapsed = time.time() - started
+    print(f"Finished {len(pending)} teams in {elapsed:.1f}s ({len(pending) / elapsed if elapsed else 0:.2f} teams/s), {failed} failed", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
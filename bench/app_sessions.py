@@ -0,0 +1,216 @@
+"""Drive the whole app headlessly with AppTest against local OpenAI and Leonardo stand-ins.
+
+    python -m bench.app_sessions --sessions 1,10,100 --openai-median 1.5 --leonardo-median 4
+
+Every session logs in, generates briefs, picks one, generates the image and
+the anthem, exactly like a user clicking through main(). Reports per-step
+p50/p95/p99 latency, script rerun latency, completed sessions per second and
+the campaign state each session holds at each concurrency level.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from unittest.mock import MagicMock
+
+import streamlit as st
+import streamlit.testing.v1.app_test as app_test
+from streamlit import config
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.secrets import Secrets
+from streamlit.testing.v1 import AppTest
+
+from bench.leonardo_latency import percentile
+from bench.mock_leonardo import MockLeonardo
+from bench.mock_openai import MockOpenAI
+from bench.mock_s3 import MockS3
+from campaign import DEFAULT_RATE_LIMITS
+from campaign_state import memory_report
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+STEPS = ("login", "briefs", "image", "song", "total", "rerun")
+
+
+def install_secrets(values):
+    # AppTest swaps st.secrets in and out around every run, which races between
+    # session threads; installing one shared Secrets object up front avoids that
+    secrets = Secrets()
+    secrets._secrets = values
+    st.secrets = secrets
+
+
+def install_runtime():
+    # Likewise AppTest creates and clears a global mock Runtime and flips the
+    # global.appTest option around every run, so one session finishing would pull
+    # them out from under the others (losing their clicks); pin both for the process
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+    config.set_option("global.appTest", True)
+    app_test.patch_config_options = lambda options: nullcontext()
+
+
+class Session:
+    """One simulated user clicking through the app."""
+
+    def __init__(self, team_name, poll_interval=0.1, timeout=120):
+        self.team_name = team_name
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.timings = {}
+        self.reruns = []
+        self.current = "start"
+        self.at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+
+    def run(self):
+        self._rerun()
+        started = time.perf_counter()
+        self.step("login", lambda: self._submit("KBS2025"), "input")
+        self.step("briefs", lambda: self._submit(self.team_name), "brief_selection")
+        self.step("image", lambda: self.at.button(key="brief_0").click(), "image_selection")
+        self.step("continue", lambda: self._click("✅ Continue"), "genre_selection")
+        self.step("song", lambda: self.at.button(key="genre_0").click(), "complete")
+        self.timings["total"] = time.perf_counter() - started
+        return self
+
+    def step(self, name, action, until):
+        self.current = name
+        started = time.perf_counter()
+        action()
+        self._rerun()
+        # Fragments poll the engine on a timer in the browser; here the whole script is rerun instead
+        while self.at.session_state.current_step != until:
+            if time.perf_counter() - started > self.timeout:
+                raise TimeoutError(f"{name} still at {self.at.session_state.current_step} after {self.timeout}s")
+            time.sleep(self.poll_interval)
+            self._rerun()
+        self.timings[name] = time.perf_counter() - started
+
+    def _rerun(self):
+        started = time.perf_counter()
+        self.at.run()
+        self.reruns.append(time.perf_counter() - started)
+        if self.at.exception:
+            raise RuntimeError(self.at.exception[0].message)
+
+    def _submit(self, text):
+        self.at.text_input[0].input(text)
+        self.at.button[0].click()
+
+    def _click(self, prefix):
+        next(button for button in self.at.button if button.label.startswith(prefix)).click()
+
+
+def run_level(level, args):
+    sessions = [Session(f"Bench {level}-{i}" if not args.same_team else "Bench United", args.poll_interval, args.timeout)
+                for i in range(level)]
+    errors = []
+
+    def run(session):
+        try:
+            return session.run()
+        except Exception as e:
+            errors.append(f"{session.team_name} during {session.current}: {e!r}")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=level) as pool:
+        finished = [session for session in pool.map(run, sessions) if session]
+    elapsed = time.perf_counter() - started
+
+    samples = {step: [session.timings[step] for session in finished if step in session.timings] for step in STEPS}
+    samples["rerun"] = [duration for session in sessions for duration in session.reruns]
+    return {
+        "sessions": level,
+        "completed": len(finished),
+        "errors": errors,
+        "elapsed": elapsed,
+        "throughput": len(finished) / elapsed if elapsed else 0.0,
+        "session_state": memory_report(),
+        "steps": {
+            step: {"p50": percentile(values, 50), "p95": percentile(values, 95), "p99": percentile(values, 99), "n": len(values)}
+            for step, values in samples.items()
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", default="1,10,100", help="comma-separated concurrency levels")
+    parser.add_argument("--mode", default="production", choices=("production", "test"))
+    parser.add_argument("--openai-median", type=float, default=1.5, help="median time to first token in seconds")
+    parser.add_argument("--openai-tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--openai-failure-rate", type=float, default=0.0)
+    parser.add_argument("--leonardo-median", type=float, default=4.0, help="median job latency in seconds")
+    parser.add_argument("--leonardo-failure-rate", type=float, default=0.0)
+    parser.add_argument("--song-missing", type=float, default=0.25, help="fraction of manifest tracks absent from the mock bucket")
+    parser.add_argument("--sigma", type=float, default=0.4, help="lognormal spread of both latency distributions")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="seconds between simulated reruns while waiting")
+    parser.add_argument("--timeout", type=float, default=180, help="per-step timeout in seconds")
+    parser.add_argument("--same-team", action="store_true", help="every session enters the same team name")
+    parser.add_argument("--speculative", action="store_true", help="enable SPECULATIVE_IMAGES")
+    parser.add_argument("--no-rate-limits", action="store_true", help="lift the provider rate limits")
+    parser.add_argument("--cache", action="store_true", help="keep the generation cache on (off by default so every session pays for its calls)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    openai = MockOpenAI(median=args.openai_median, sigma=args.sigma, tokens_per_second=args.openai_tokens_per_second,
+                        failure_rate=args.openai_failure_rate, seed=args.seed).start()
+    leonardo = MockLeonardo(median=args.leonardo_median, sigma=args.sigma, failure_rate=args.leonardo_failure_rate,
+                            seed=args.seed).start()
+    s3 = MockS3(missing=args.song_missing, seed=args.seed).start()
+    try:
+        workdir = tempfile.mkdtemp(prefix="bench-app-")
+        install_secrets({
+            "APP_MODE": args.mode,
+            "OPENAI_API_KEY": "bench",
+            "OPENAI_BASE_URL": openai.base_url,
+            "LEORNADO_API_KEY": "bench",
+            "LEONARDO_API_URL": leonardo.base_url,
+            "S3_BUCKET_URL": s3.bucket_url,
+            "SONG_MANIFEST": s3.manifest_url,
+            "GENERATION_CACHE_PATH": os.path.join(workdir, "generations.sqlite3") if args.cache else "",
+            "MEDIA_CACHE_DIR": os.path.join(workdir, "media"),
+            "STATE_STORE_URL": "sqlite:///" + os.path.join(workdir, "campaigns.sqlite3"),
+            "SPECULATIVE_IMAGES": args.speculative,
+            "RATE_LIMITS": {key: {"rpm": None, "tpm": None, "concurrent": None} for key in DEFAULT_RATE_LIMITS} if args.no_rate_limits else {}
+        })
+
+        install_runtime()
+
+        results = []
+        print(f"{'sessions':>8} {'step':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'n':>5}")
+        for level in [int(value) for value in args.sessions.split(",")]:
+            result = run_level(level, args)
+            results.append(result)
+            for step, stats in result["steps"].items():
+                print(f"{level:>8} {step:>7} {stats['p50']:>7.2f}s {stats['p95']:>7.2f}s {stats['p99']:>7.2f}s {stats['n']:>5}")
+            print(f"{level:>8} {result['completed']} completed in {result['elapsed']:.1f}s "
+                  f"({result['throughput']:.2f} sessions/s), {len(result['errors'])} errors")
+            memory = result["session_state"]
+            print(f"{level:>8} session state: {memory['sessions']} sessions hold {memory['total_bytes'] / 1024:.0f} KB "
+                  f"(avg {memory['avg_bytes'] / 1024:.1f} KB, max {memory['max_bytes'] / 1024:.1f} KB)")
+            for error in result["errors"][:5]:
+                print(f"{'':>8} ! {error}")
+        print(f"Mock OpenAI served {openai.request_count} requests; mock Leonardo ran {len(leonardo.jobs)} jobs and answered {leonardo.poll_count} polls; "
+              f"mock S3 answered {s3.request_count['HEAD']} HEADs and {s3.request_count['GET']} GETs")
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"args": vars(args), "results": results}, f, indent=2)
+    finally:
+        openai.stop()
+        leonardo.stop()
+        s3.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Compare Leonardo job completion strategies against the local stand-in server.
+
+    python -m bench.leonardo_latency --jobs 40 --concurrency 20 --median 6
+
+Reports end-to-end latency and the wasted wait after the job was actually
+ready (overhead) as p50/p95/p99, plus how many polls each strategy made.
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.mock_leonardo import MockLeonardo
+from http_pool import PooledHTTPClient
+from leonardo import LeonardoError, LeonardoJobTracker, WebhookReceiver
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def fixed_poll(tracker, data):
+    # The original loop: six polls, five seconds apart, then give up
+    generation_id = tracker.submit(data)
+    for _ in range(6):
+        time.sleep(5)
+        status, urls = tracker.poll(generation_id)
+        if urls:
+            return generation_id, urls
+    raise LeonardoError("Reached maximum polling attempts")
+
+
+def adaptive_poll(tracker, data):
+    generation_id = tracker.submit(data)
+    return generation_id, tracker.wait(generation_id)
+
+
+def run_strategy(name, args):
+    receiver = None
+    mock = MockLeonardo(median=args.median, sigma=args.sigma, failure_rate=args.failure_rate, seed=args.seed)
+    mock.start()
+    tracker = LeonardoJobTracker("mock-key", base_url=mock.base_url, http=PooledHTTPClient(pool_maxsize=args.concurrency), timeout=args.timeout)
+    if name == "webhook":
+        receiver = WebhookReceiver(tracker, host="127.0.0.1", port=0).start()
+        mock.webhook_url = f"http://127.0.0.1:{receiver.port}/"
+
+    strategy = fixed_poll if name == "fixed" else adaptive_poll
+    latencies, overheads, failures = [], [], 0
+
+    def one_job(i):
+        started = time.monotonic()
+        try:
+            generation_id, _ = strategy(tracker, {"prompt": f"job {i}", "num_images": 1})
+        except LeonardoError:
+            return None
+        elapsed = time.monotonic() - started
+        return elapsed, elapsed - mock.jobs[generation_id]["latency"]
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for result in executor.map(one_job, range(args.jobs)):
+            if result is None:
+                failures += 1
+            else:
+                latencies.append(result[0])
+                overheads.append(result[1])
+
+    if receiver:
+        receiver.stop()
+    mock.stop()
+    return latencies, overheads, failures, mock.poll_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--median", type=float, default=6.0)
+    parser.add_argument("--sigma", type=float, default=0.5)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--strategies", default="fixed,adaptive,webhook")
+    args = parser.parse_args()
+
+    print(f"{'strategy':<10} {'p50':>7} {'p95':>7} {'p99':>7} {'ovh p50':>8} {'ovh p95':>8} {'polls':>6} {'failed':>6}")
+    for name in args.strategies.split(","):
+        latencies, overheads, failures, polls = run_strategy(name, args)
+        print(f"{name:<10} {percentile(latencies, 50):7.2f} {percentile(latencies, 95):7.2f} "
+              f"{percentile(latencies, 99):7.2f} {percentile(overheads, 50):8.2f} "
+              f"{percentile(overheads, 95):8.2f} {polls:6d} {failures:6d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Local stand-in for the Leonardo AI generations API, for offline latency measurements.
+
+    python -m bench.mock_leonardo --port 8700 --median 6
+
+Point the app at it with LEONARDO_API_URL = "http://127.0.0.1:8700/api/rest/v1" in secrets.toml.
+"""
+import argparse
+import base64
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+# 1x1 PNG served for every generated image
+PLACEHOLDER_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+
+class MockLeonardo:
+    """Generations API whose jobs finish after a lognormally distributed delay."""
+
+    def __init__(self, host="127.0.0.1", port=0, median=6.0, sigma=0.5, failure_rate=0.0,
+                 webhook_url=None, seed=None):
+        self.host = host
+        self.port = port
+        self.median = median
+        self.sigma = sigma
+        self.failure_rate = failure_rate
+        self.webhook_url = webhook_url
+        self.random = random.Random(seed)
+        self.jobs = {}
+        self.poll_count = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/api/rest/v1"
+
+    def create_job(self, data):
+        generation_id = str(uuid.uuid4())
+        with self._lock:
+            latency = self.median * self.random.lognormvariate(0, self.sigma)
+            failed = self.random.random() < self.failure_rate
+        job = {
+            "id": generation_id,
+            "created": time.monotonic(),
+            "latency": latency,
+            "failed": failed,
+            "num_images": data.get("num_images", 1),
+            "seed": data.get("seed")
+        }
+        with self._lock:
+            self.jobs[generation_id] = job
+        if self.webhook_url:
+            threading.Timer(latency, self._send_webhook, args=(job,)).start()
+        return generation_id
+
+    def job_view(self, job):
+        if time.monotonic() - job["created"] < job["latency"]:
+            return {"id": job["id"], "status": "PENDING", "generated_images": []}
+        if job["failed"]:
+            return {"id": job["id"], "status": "FAILED", "generated_images": []}
+        images = [
+            {"id": f"{job['id']}-{i}", "url": f"http://{self.host}:{self.port}/images/{job['id']}-{i}.png"}
+            for i in range(job["num_images"])
+        ]
+        return {"id": job["id"], "status": "COMPLETE", "seed": job["seed"], "generated_images": images}
+
+    def _send_webhook(self, job):
+        view = self.job_view(job)
+        payload = {
+            "type": "image_generation.complete",
+            "object": "generation",
+            "data": {"object": {"id": view["id"], "status": view["status"], "images": view["generated_images"]}}
+        }
+        try:
+            requests.post(self.webhook_url, json=payload, timeout=5)
+        except requests.RequestException:
+            pass
+
+    def start(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send_json(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                if self.path.rstrip("/") != "/api/rest/v1/generations":
+                    return self._send_json(404, {"error": "not found"})
+                length = int(self.headers.get("content-length", 0))
+                data = json.loads(self.rfile.read(length) or b"{}")
+                generation_id = mock.create_job(data)
+                self._send_json(200, {"sdGenerationJob": {"generationId": generation_id, "apiCreditCost": 0}})
+
+            def do_GET(self):
+                if self.path.startswith("/images/"):
+                    self.send_response(200)
+                    self.send_header("content-type", "image/png")
+                    self.send_header("content-length", str(len(PLACEHOLDER_PNG)))
+                    self.end_headers()
+                    self.wfile.write(PLACEHOLDER_PNG)
+                    return
+                prefix = "/api/rest/v1/generations/"
+                job = mock.jobs.get(self.path[len(prefix):]) if self.path.startswith(prefix) else None
+                if job is None:
+                    return self._send_json(404, {"error": "not found"})
+                with mock._lock:
+                    mock.poll_count += 1
+                self._send_json(200, {"generations_by_pk": mock.job_view(job)})
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--median", type=float, default=6.0, help="median job latency in seconds")
+    parser.add_argument("--sigma", type=float, default=0.5, help="lognormal spread of job latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--webhook-url", help="POST completion callbacks here, like Leonardo's API key webhook")
+    args = parser.parse_args()
+
+    mock = MockLeonardo(args.host, args.port, args.median, args.sigma, args.failure_rate, args.webhook_url).start()
+    print(f"Mock Leonardo listening on {mock.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
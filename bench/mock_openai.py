@@ -0,0 +1,160 @@
+"""Local stand-in for the OpenAI chat completions API, for offline benchmarks.
+
+    python -m bench.mock_openai --port 8701 --median 1.5 --tokens-per-second 80
+
+Point the app at it with OPENAI_BASE_URL = "http://127.0.0.1:8701/v1" in secrets.toml.
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Structured-output brief, as returned for requests with a json_schema response_format
+BRIEF_TEMPLATE = {
+    "narrative": "{team} is more than a team - it is a city's heartbeat. Campaign {tag} turns every fixture into a homecoming.",
+    "themes": [
+        {"name": "Legacy", "description": "Decades of grit, passed from one generation of fans to the next"},
+        {"name": "Community", "description": "The stadium as the town square on match day"},
+        {"name": "Momentum", "description": "Every win is the start of the next chapter"}
+    ],
+    "vision": "Matchday takeovers, player-led community visits and a season-long fan story series for lifelong supporters, young families and lapsed fans."
+}
+
+IMAGE_PROMPT_TEMPLATE = "A roaring floodlit stadium at dusk, fans in team colours raising scarves, confetti in the air, cinematic wide shot, campaign {tag}"
+
+
+class MockOpenAI:
+    """Chat completions endpoint with lognormal time-to-first-token and a fixed token rate.
+
+    Replies are deterministic for a given request, so the generation cache and
+    single-flight behave as they would against the real API.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, median=1.5, sigma=0.4, tokens_per_second=80.0,
+                 failure_rate=0.0, seed=None):
+        self.host = host
+        self.port = port
+        self.median = median
+        self.sigma = sigma
+        self.tokens_per_second = tokens_per_second
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/v1"
+
+    def reply(self, body):
+        prompt = body["messages"][-1]["content"]
+        tag = hashlib.sha256(prompt.encode()).hexdigest()[:8]
+        if "response_format" not in body:
+            return IMAGE_PROMPT_TEMPLATE.format(tag=tag)
+        # Brief prompts name the team as 'sports team "<name>"'
+        team = prompt.split('"')[1] if prompt.count('"') >= 2 else "Team"
+        brief = dict(BRIEF_TEMPLATE, narrative=BRIEF_TEMPLATE["narrative"].format(team=team, tag=tag))
+        return json.dumps(brief)
+
+    def start(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send_json(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_POST(self):
+                length = int(self.headers.get("content-length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if self.path.rstrip("/") != "/v1/chat/completions":
+                    return self._send_json(404, {"error": {"message": "not found"}})
+                with mock._lock:
+                    mock.request_count += 1
+                    delay = mock.median * mock.random.lognormvariate(0, mock.sigma)
+                    failed = mock.random.random() < mock.failure_rate
+                time.sleep(delay)
+                if failed:
+                    return self._send_json(500, {"error": {"message": "mock failure", "type": "server_error"}})
+
+                words = mock.reply(body).split(" ")
+                words = [word + " " for word in words[:-1]] + words[-1:]
+                base = {"id": "chatcmpl-mock", "created": int(time.time()), "model": body["model"]}
+                if not body.get("stream"):
+                    # Non-streaming replies still take as long as generating every token
+                    time.sleep(len(words) / mock.tokens_per_second)
+                    return self._send_json(200, dict(
+                        base, object="chat.completion",
+                        choices=[{"index": 0, "message": {"role": "assistant", "content": "".join(words)}, "finish_reason": "stop"}],
+                        usage={"prompt_tokens": length // 4, "completion_tokens": len(words), "total_tokens": length // 4 + len(words)}
+                    ))
+
+                self.send_response(200)
+                self.send_header("content-type", "text/event-stream")
+                self.send_header("transfer-encoding", "chunked")
+                self.end_headers()
+                for word in words:
+                    time.sleep(1 / mock.tokens_per_second)
+                    chunk = dict(base, object="chat.completion.chunk",
+                                 choices=[{"index": 0, "delta": {"content": word}, "finish_reason": None}])
+                    self._send_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+                self._send_chunk(b"data: [DONE]\n\n")
+                self._send_chunk(b"")
+
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionResetError:
+                    pass  # Keep-alive clients drop idle connections whenever they like
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8701)
+    parser.add_argument("--median", type=float, default=1.5, help="median time to first token in seconds")
+    parser.add_argument("--sigma", type=float, default=0.4, help="lognormal spread of time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    mock = MockOpenAI(args.host, args.port, args.median, args.sigma, args.tokens_per_second, args.failure_rate).start()
+    print(f"Mock OpenAI listening on {mock.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Local stand-in for the public S3 bucket holding the anthem tracks.
+
+    python -m bench.mock_s3 --port 8702 --tracks-per-genre 10 --missing 0.25
+
+Point the app at it with S3_BUCKET_URL = "http://127.0.0.1:8702/anthems" in secrets.toml.
+The bucket answers ListObjectsV2 listings, HEAD and GET for every track, and serves
+a manifest.json naming every track of the historical <genre>-<n>.mp3 scheme,
+including the --missing fraction that was never uploaded, like the real bucket.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from campaign import SONG_GENRES
+
+# One silent MPEG-1 Layer III frame: 128 kbps, 44.1 kHz, 1152 samples
+SILENT_FRAME = b"\xff\xfb\x90\x64" + bytes(413)
+FRAME_SECONDS = 1152 / 44100
+
+
+class MockS3:
+    """A public bucket of silent MP3 anthems, some of which the manifest names but the bucket lacks."""
+
+    def __init__(self, host="127.0.0.1", port=0, bucket="anthems", tracks_per_genre=10, missing=0.0,
+                 duration=30.0, latency=0.0, page_size=1000, seed=None):
+        self.host = host
+        self.port = port
+        self.bucket = bucket
+        self.latency = latency
+        self.page_size = page_size
+        rng = random.Random(seed)
+        self.manifest = []
+        self.objects = {}  # key -> (bytes, duration)
+        for genre in SONG_GENRES:
+            for i in range(1, tracks_per_genre + 1):
+                key = f"{genre['id']}-{i}.mp3"
+                self.manifest.append({"genre": genre["id"], "key": key, "title": f"{genre['name']} Anthem #{i}"})
+                if rng.random() >= missing:
+                    seconds = duration * rng.uniform(0.8, 1.2)
+                    self.objects[key] = (SILENT_FRAME * int(seconds / FRAME_SECONDS), round(seconds, 1))
+        self.request_count = {"LIST": 0, "HEAD": 0, "GET": 0}
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def bucket_url(self):
+        return f"http://{self.host}:{self.port}/{self.bucket}"
+
+    @property
+    def manifest_url(self):
+        return f"{self.bucket_url}/manifest.json"
+
+    def listing(self, token=None):
+        keys = sorted(self.objects)
+        start = int(token) if token else 0
+        page = keys[start:start + self.page_size]
+        truncated = start + self.page_size < len(keys)
+        contents = "".join(f"<Contents><Key>{key}</Key><Size>{len(self.objects[key][0])}</Size></Contents>" for key in page)
+        next_token = f"<NextContinuationToken>{start + self.page_size}</NextContinuationToken>" if truncated else ""
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            f"<Name>{self.bucket}</Name><KeyCount>{len(page)}</KeyCount>"
+            f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>{next_token}{contents}"
+            "</ListBucketResult>"
+        ).encode()
+
+    def start(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, status, body=b"", content_type="application/xml", headers=None, head=False):
+                self.send_response(status)
+                self.send_header("content-type", content_type)
+                self.send_header("content-length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if not head:
+                    self.wfile.write(body)
+
+            def _object(self, head):
+                url = urlsplit(self.path)
+                prefix = f"/{mock.bucket}/"
+                if not url.path.startswith(prefix):
+                    return self._send(404, b"<Error><Code>NoSuchBucket</Code></Error>", head=head)
+                key = url.path[len(prefix):]
+                if mock.latency:
+                    time.sleep(mock.latency)
+
+                if not key:
+                    with mock._lock:
+                        mock.request_count["LIST"] += 1
+                    return self._send(200, mock.listing(parse_qs(url.query).get("continuation-token", [None])[0]), head=head)
+                with mock._lock:
+                    mock.request_count["HEAD" if head else "GET"] += 1
+                if key == "manifest.json":
+                    return self._send(200, json.dumps({"tracks": mock.manifest}).encode(), "application/json", head=head)
+                if key not in mock.objects:
+                    return self._send(404, b"<Error><Code>NoSuchKey</Code></Error>", head=head)
+                data, duration = mock.objects[key]
+                self._send(200, data, "audio/mpeg", {"x-amz-meta-duration": str(duration)}, head=head)
+
+            def do_GET(self):
+                self._object(head=False)
+
+            def do_HEAD(self):
+                self._object(head=True)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8702)
+    parser.add_argument("--bucket", default="anthems")
+    parser.add_argument("--tracks-per-genre", type=int, default=10)
+    parser.add_argument("--missing", type=float, default=0.0, help="fraction of manifest tracks absent from the bucket")
+    parser.add_argument("--duration", type=float, default=30.0, help="average track length in seconds")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before every response")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    mock = MockS3(args.host, args.port, args.bucket, args.tracks_per_genre, args.missing, args.duration, args.latency, seed=args.seed).start()
+    print(f"Mock S3 serving {len(mock.objects)} of {len(mock.manifest)} tracks at {mock.bucket_url} (manifest: {mock.manifest_url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
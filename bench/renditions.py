@@ -0,0 +1,116 @@
+"""Throughput of the branded rendition pipeline per worker process.
+
+    python -m bench.renditions --images 16 --workers 0,1,2,4 --callers 4
+
+Renders every social format of --images synthetic 1792x1024 visuals (the size
+Leonardo returns) with each worker count, from --callers threads at once like
+concurrent sessions; 0 workers renders in the calling threads. Reports
+renditions and source images per second, both per core used, and how late a
+10 ms timer in another thread of this process fires meanwhile - the delay a
+Streamlit script thread would see while the renditions run.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageDraw
+
+from bench.leonardo_latency import percentile
+from campaign import DEFAULT_RENDITION_FORMATS
+from renditions import RenditionPool
+
+TICK = 0.01
+
+
+def make_sources(folder, count, seed):
+    # Noise over a colour gradient with a few shapes, so encoders and resamplers do realistic work
+    rng = random.Random(seed)
+    paths = []
+    for i in range(count):
+        image = Image.merge("RGB", [Image.linear_gradient("L").rotate(rng.choice((0, 90, 180, 270))).resize((1792, 1024)) for _ in range(3)])
+        image = Image.blend(image, Image.effect_noise((1792, 1024), 40).convert("RGB"), 0.3)
+        draw = ImageDraw.Draw(image)
+        for _ in range(12):
+            x, y = rng.randrange(1792), rng.randrange(1024)
+            draw.ellipse((x, y, x + rng.randrange(50, 400), y + rng.randrange(50, 400)), fill=tuple(rng.randrange(256) for _ in range(3)))
+        path = os.path.join(folder, f"source-{i}.png")
+        image.save(path)
+        paths.append(path)
+    return paths
+
+
+def run_level(workers, sources, folder, args):
+    pool = RenditionPool(DEFAULT_RENDITION_FORMATS, workers=workers).start()
+    # Spawn and warm every worker before the clock starts
+    pool.render(sources[0], "Warm Up", os.path.join(folder, "warm-up"))
+
+    lateness = []
+    running = threading.Event()
+    running.set()
+
+    def ticker():
+        while running.is_set():
+            started = time.perf_counter()
+            time.sleep(TICK)
+            lateness.append(time.perf_counter() - started - TICK)
+
+    out = os.path.join(folder, f"workers-{workers}")
+    tick = threading.Thread(target=ticker, daemon=True)
+    tick.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.callers) as callers:
+        list(callers.map(lambda source: pool.render(source, args.team, out), sources))
+    elapsed = time.perf_counter() - started
+    running.clear()
+    tick.join()
+    pool.shutdown()
+
+    cores = min(max(workers, 1), os.cpu_count() or 1)
+    renditions = len(sources) * len(DEFAULT_RENDITION_FORMATS)
+    return {
+        "workers": workers,
+        "cores": cores,
+        "images": len(sources),
+        "renditions": renditions,
+        "elapsed": elapsed,
+        "renditions_per_second": renditions / elapsed,
+        "images_per_second_per_core": len(sources) / elapsed / cores,
+        "renditions_per_second_per_core": renditions / elapsed / cores,
+        "tick_lateness": {"p50": percentile(lateness, 50), "p95": percentile(lateness, 95), "p99": percentile(lateness, 99)}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=16, help="source visuals, each rendered in every format")
+    parser.add_argument("--workers", default=f"0,1,{os.cpu_count() or 1}", help="comma-separated worker process counts")
+    parser.add_argument("--callers", type=int, default=4, help="threads asking for renditions at once")
+    parser.add_argument("--team", default="Western Bulldogs Football Club", help="name set over every rendition")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="bench-renditions-")
+    sources = make_sources(folder, args.images, args.seed)
+    print(f"{len(sources)} sources x {len(DEFAULT_RENDITION_FORMATS)} formats on {os.cpu_count()} cores")
+    print(f"{'workers':>7} {'elapsed':>8} {'rend/s':>7} {'img/s/core':>10} {'rend/s/core':>11} {'tick p50':>9} {'tick p95':>9}")
+    results = []
+    for workers in sorted({int(value) for value in args.workers.split(",")}):
+        result = run_level(workers, sources, folder, args)
+        results.append(result)
+        late = result["tick_lateness"]
+        print(f"{workers:>7} {result['elapsed']:>7.2f}s {result['renditions_per_second']:>7.1f} {result['images_per_second_per_core']:>10.2f} "
+              f"{result['renditions_per_second_per_core']:>11.2f} {late['p50'] * 1000:>7.1f}ms {late['p95'] * 1000:>7.1f}ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,933 @@
+"""Campaign generation: briefs, image prompts, Leonardo images and anthem selection.
+
+Nothing in here imports Streamlit, so the app, the batch CLI and the benchmarks
+share one implementation. Call configure() with the settings (st.secrets or a
+parsed secrets.toml) and the shared resources before generating anything.
+"""
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from openai import OpenAI
+
+from generation_cache import GenerationCache, cache_key
+from http_pool import PooledHTTPClient
+from inventory import CampaignInventory
+from leonardo import LEONARDO_API_URL, LeonardoError, LeonardoJobTracker, WebhookReceiver
+from rate_limit import ProviderLimits, Withdrawn
+from renditions import RenditionPool
+from resilience import HedgeLeg, ProviderBreakers, hedged, hedged_stream
+from singleflight import SingleFlight
+from song_library import SongLibrary
+from state_store import open_state_store
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+# Configuration - set by configure()
+APP_MODE = "test"
+LEONARDO_API_KEY = ""
+S3_BUCKET_URL = "https://your-s3-bucket.s3.amazonaws.com"
+SPECULATIVE_IMAGES = False
+IMAGE_VARIANTS = 4
+IMAGE_VARIANTS_PER_JOB = 1
+HEDGE_MODELS = {}
+HEDGE_AFTER = 10.0
+HEDGE_TOKENS_PER_SECOND = 40
+client = None
+generation_cache = None
+leonardo_tracker = None
+song_library = None
+rate_limiter = ProviderLimits({})
+circuit_breakers = ProviderBreakers({})
+inflight = SingleFlight()  # Process-wide, so identical requests from different sessions share one upstream call
+
+# Provider limits per "provider" or "provider:model" key; override any of them with a RATE_LIMITS table in secrets.toml
+DEFAULT_RATE_LIMITS = {
+    "openai:gpt-4.1": {"rpm": 500, "tpm": 30000},
+    "openai:gpt-4o-mini": {"rpm": 500, "tpm": 200000},
+    "openai:gpt-4.1-mini": {"rpm": 500, "tpm": 200000},
+    "leonardo": {"rpm": 60, "concurrent": 10}  # Concurrent generation jobs allowed on the API plan
+}
+
+# Circuit breakers per "provider" or "provider:model" key; override any setting with a CIRCUIT_BREAKERS table
+DEFAULT_CIRCUIT_BREAKERS = {
+    "openai": {"error_rate": 0.5, "slow_call": 30, "window": 60, "min_calls": 5, "cooldown": 30},
+    "leonardo": {"error_rate": 0.5, "slow_call": 90, "window": 300, "min_calls": 3, "cooldown": 60}
+}
+
+# A request still unanswered at its model's p95 latency is raced against the same request to the alternate model
+DEFAULT_HEDGE_MODELS = {
+    "gpt-4.1": "gpt-4.1-mini",
+    "gpt-4o-mini": "gpt-4.1-mini"
+}
+
+# Branded social renditions of the final visual, as width x height; override or add formats with a RENDITION_FORMATS table
+DEFAULT_RENDITION_FORMATS = {
+    "1:1": (1080, 1080),
+    "4:5": (1080, 1350),
+    "9:16": (1080, 1920),
+    "16:9": (1920, 1080)
+}
+
+def load_settings(path=".streamlit/secrets.toml"):
+    # Headless entry points read the same secrets.toml the Streamlit app uses
+    # Only they need a TOML parser: tomllib from Python 3.11, else the tomli backport
+    try:
+        import tomllib
+    except ImportError:
+        import tomli as tomllib
+    if not os.path.exists(path):
+        return {}
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+def create_openai_client(settings):
+    if settings.get("OPENAI_API_KEY") and settings.get("APP_MODE", "test") == "production":
+        try:
+            return OpenAI(api_key=settings["OPENAI_API_KEY"], base_url=settings.get("OPENAI_BASE_URL") or None)  # Point at bench.mock_openai for offline runs
+        except Exception as e:
+            logger.warning("Failed to initialize OpenAI client: %s", e)
+            # App will fall back to test mode if client initialization fails
+    return None
+
+def create_http_client(settings):
+    return PooledHTTPClient(
+        pool_maxsize=settings.get("HTTP_POOL_SIZE", 10),  # Max concurrent keep-alive connections per host
+        connect_timeout=settings.get("HTTP_CONNECT_TIMEOUT", 5),  # Seconds, for all outbound HTTP calls
+        read_timeout=settings.get("HTTP_READ_TIMEOUT", 30),
+        retries=settings.get("HTTP_RETRIES", 3)  # Retries with backoff on 429/5xx and connection errors
+    )
+
+def create_generation_cache(settings):
+    path = settings.get("GENERATION_CACHE_PATH", ".cache/generations.sqlite3")  # Empty string disables the cache
+    if not path:
+        return None
+    return GenerationCache(
+        path,
+        ttl=settings.get("GENERATION_CACHE_TTL", 7 * 24 * 3600),  # Seconds
+        max_bytes=settings.get("GENERATION_CACHE_MAX_MB", 100) * 1024 * 1024,
+        replay=settings.get("GENERATION_CACHE_REPLAY", False)  # Deterministic demo replay: never expire or evict
+    )
+
+def create_leonardo_tracker(settings, http):
+    tracker = LeonardoJobTracker(
+        settings.get("LEORNADO_API_KEY", ""),  # Note: keeping the misspelled key name as it exists in secrets.toml
+        base_url=settings.get("LEONARDO_API_URL", LEONARDO_API_URL),  # Point at bench.mock_leonardo for offline runs
+        http=http,
+        timeout=settings.get("LEONARDO_TIMEOUT", 120)  # Seconds before giving up on a generation job
+    )
+    if settings.get("LEONARDO_WEBHOOK_PORT"):
+        # Listen for Leonardo webhook callbacks
+        WebhookReceiver(tracker, port=settings["LEONARDO_WEBHOOK_PORT"], token=settings.get("LEONARDO_WEBHOOK_TOKEN") or None).start()
+    return tracker
+
+def create_rate_limiter(settings, concurrency=None):
+    # concurrency optionally caps in-flight calls for every key of a provider, e.g. {"openai": 8} for batch runs
+    limits = {key: dict(value) for key, value in DEFAULT_RATE_LIMITS.items()}
+    for key, value in settings.get("RATE_LIMITS", {}).items():
+        limits.setdefault(key, {}).update(value)
+    for provider, limit in (concurrency or {}).items():
+        for key in limits:
+            if key.split(":")[0] == provider:
+                limits[key]["concurrent"] = limit
+    return ProviderLimits(limits)
+
+def create_circuit_breakers(settings):
+    breakers = {key: dict(value) for key, value in DEFAULT_CIRCUIT_BREAKERS.items()}
+    for key, value in settings.get("CIRCUIT_BREAKERS", {}).items():
+        breakers.setdefault(key, {}).update(value)
+    return ProviderBreakers(breakers)
+
+def create_state_store(settings):
+    url = settings.get("STATE_STORE_URL", "sqlite:///.cache/campaigns.sqlite3")  # Empty string keeps campaigns in the session only
+    if not url:
+        return None
+    return open_state_store(url, ttl=settings.get("STATE_STORE_TTL", 24 * 3600))  # Seconds an idle campaign can still be resumed
+
+def create_song_library(settings, http):
+    if settings.get("APP_MODE", "test") != "production":
+        return None  # Test mode plays a placeholder track
+    library = SongLibrary(
+        settings.get("S3_BUCKET_URL", "https://your-s3-bucket.s3.amazonaws.com"),
+        [genre["id"] for genre in SONG_GENRES],
+        http=http,
+        manifest=settings.get("SONG_MANIFEST") or None  # JSON manifest path or URL; by default the bucket is listed
+    )
+    # Indexed now, HEAD-validated in the background
+    return library.load().start()
+
+def create_rendition_pool(settings):
+    return RenditionPool(
+        {**DEFAULT_RENDITION_FORMATS, **settings.get("RENDITION_FORMATS", {})},
+        workers=settings.get("RENDITION_WORKERS", os.cpu_count()),  # Worker processes; 0 renders in the calling thread
+        font=settings.get("RENDITION_FONT") or None,  # TrueType font for the team name; defaults to DejaVu Sans Bold
+        quality=settings.get("RENDITION_QUALITY", 88)  # JPEG quality
+    ).start()
+
+def create_inventory(settings):
+    teams = settings.get("INVENTORY_TEAMS", [])  # Teams to keep campaigns ready for: a list, or a file with one name per line
+    if isinstance(teams, str):
+        with open(teams) as f:
+            teams = f.read().splitlines()
+    if settings.get("APP_MODE", "test") != "production" or not teams:
+        return None  # Test mode generates instantly anyway
+    return CampaignInventory(
+        teams,
+        stock_campaign,
+        depth=settings.get("INVENTORY_DEPTH", 1),  # Ready campaigns per team
+        capacity=settings.get("INVENTORY_CAPACITY", 50),  # Ready campaigns across all teams
+        max_age=settings.get("INVENTORY_MAX_AGE", 6 * 3600),  # Seconds before a ready campaign is thrown away
+        idle=providers_idle,
+        window=inventory_window(settings.get("INVENTORY_WINDOW"))  # [start, end] of the event, when stale campaigns are always refreshed
+    ).start()
+
+def inventory_window(window):
+    # TOML datetimes or ISO strings (local time unless they carry an offset), as epoch seconds
+    if not window:
+        return None
+    start, end = (datetime.fromisoformat(value) if isinstance(value, str) else value for value in window)
+    return start.timestamp(), end.timestamp()
+
+def configure(settings, openai_client=None, cache=None, tracker=None, limiter=None, songs=None, breakers=None):
+    global APP_MODE, LEONARDO_API_KEY, S3_BUCKET_URL, SPECULATIVE_IMAGES, IMAGE_VARIANTS, IMAGE_VARIANTS_PER_JOB
+    global HEDGE_MODELS, HEDGE_AFTER, HEDGE_TOKENS_PER_SECOND
+    global client, generation_cache, leonardo_tracker, rate_limiter, song_library, circuit_breakers
+    APP_MODE = settings.get("APP_MODE", "test")
+    LEONARDO_API_KEY = settings.get("LEORNADO_API_KEY", "")
+    S3_BUCKET_URL = settings.get("S3_BUCKET_URL", "https://your-s3-bucket.s3.amazonaws.com")
+    SPECULATIVE_IMAGES = settings.get("SPECULATIVE_IMAGES", False)  # Also submit Leonardo jobs for every brief before one is picked (costs credits)
+    IMAGE_VARIANTS = settings.get("IMAGE_VARIANTS", 4)  # Visuals to choose from per campaign; each one costs Leonardo credits
+    IMAGE_VARIANTS_PER_JOB = settings.get("IMAGE_VARIANTS_PER_JOB", 1)  # 1 runs a parallel job per variant so each shows up as soon as it is ready
+    HEDGE_MODELS = dict(DEFAULT_HEDGE_MODELS, **settings.get("HEDGE_MODELS", {}))  # Map a model to "" to never hedge it
+    HEDGE_AFTER = settings.get("HEDGE_AFTER", 10.0)  # Seconds to wait for a first token before hedging until a model's p95 has been observed
+    HEDGE_TOKENS_PER_SECOND = settings.get("HEDGE_TOKENS_PER_SECOND", 40)  # A slow output rate; whole replies also get max_tokens at this rate
+    client = openai_client
+    generation_cache = cache
+    leonardo_tracker = tracker
+    song_library = songs
+    rate_limiter = limiter or ProviderLimits({})
+    circuit_breakers = breakers or create_circuit_breakers(settings)
+
+def rate_limited(key, tokens=0, on_status=None, stage=None, cancelled=None):
+    # Waits in the provider's FIFO queue; a task reports stage "waiting" with its position, then stage once admitted
+    # Setting cancelled (a threading.Event) withdraws a caller that is still waiting, raising Withdrawn
+    def on_queue(position):
+        if position:
+            on_status("waiting", position=position, provider=key.split(":")[0])
+        elif stage:
+            on_status(stage)
+    return rate_limiter.acquire(key, tokens, on_queue if on_status else None, cancelled)
+
+def alternate_request(request):
+    # The same request to the model's hedge model, or None when it has none
+    model = HEDGE_MODELS.get(request["model"])
+    return dict(request, model=model) if model else None
+
+def hedge_delay(request, kind="call"):
+    # The model's observed p95, so only the slowest 5% of requests are hedged. Until there are enough samples, a
+    # whole reply gets time to generate all of max_tokens slowly on top of HEDGE_AFTER, so a cold start does not
+    # hedge every long brief (a 1000-token gpt-4.1 brief waits 35s, a 150-token summary 13.75s)
+    p95 = circuit_breakers.breaker(f"openai:{request['model']}").p95(kind)
+    if p95 is not None:
+        return p95
+    if kind == "call":
+        return HEDGE_AFTER + request.get("max_tokens", 1000) / HEDGE_TOKENS_PER_SECOND
+    return HEDGE_AFTER
+
+def estimate_tokens(request):
+    # Roughly four characters per token for the prompt, plus the completion budget
+    prompt = sum(len(message["content"]) for message in request["messages"])
+    return prompt // 4 + request.get("max_tokens", 1000)
+
+# Sample data for test mode
+SAMPLE_IMAGES = [
+    "https://images.pexels.com/photos/358042/pexels-photo-358042.jpeg",
+    "https://images.pexels.com/photos/1752757/pexels-photo-1752757.jpeg",
+    "https://images.pexels.com/photos/1884574/pexels-photo-1884574.jpeg",
+    "https://images.pexels.com/photos/262524/pexels-photo-262524.jpeg",
+    "https://images.pexels.com/photos/1884576/pexels-photo-1884576.jpeg"
+]
+
+SONG_GENRES = [
+    {
+        "id": "rock-anthem",
+        "name": "Rock Anthem",
+        "description": "High-energy rock with powerful vocals and driving guitar riffs perfect for victory celebrations",
+        "emoji": "⚡"
+    },
+    {
+        "id": "electronic-hype", 
+        "name": "Electronic Hype",
+        "description": "Modern electronic beats with synthetic energy to pump up crowds and create excitement",
+        "emoji": "🎵"
+    },
+    {
+        "id": "orchestral-epic",
+        "name": "Orchestral Epic", 
+        "description": "Cinematic orchestral composition with dramatic crescendos for triumphant moments",
+        "emoji": "🎼"
+    },
+    {
+        "id": "inspirational-pop",
+        "name": "Inspirational Pop",
+        "description": "Uplifting pop melody with emotional lyrics that resonates with fans of all ages", 
+        "emoji": "❤️"
+    }
+]
+
+# Brief variants generated for every campaign and the themes each one is steered towards
+BRIEF_THEMES = {
+    "brief1": ["Legacy", "Community", "Excellence", "Passion"],
+    "brief2": ["Innovation", "Unity", "Resilience", "Championship"]
+}
+
+# Markdown headings each variant's narrative, themes and vision are rendered under
+BRIEF_SECTIONS = {
+    "brief1": ("Core Narrative", "Key Themes", "Campaign Vision"),
+    "brief2": ("Strategic Narrative", "Core Pillars", "Creative Direction")
+}
+
+# Briefs come back as JSON in this shape (OpenAI structured outputs) and are rendered to markdown locally
+BRIEF_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "narrative": {"type": "string"},
+        "themes": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"name": {"type": "string"}, "description": {"type": "string"}},
+                "required": ["name", "description"],
+                "additionalProperties": False
+            }
+        },
+        "vision": {"type": "string"}
+    },
+    "required": ["narrative", "themes", "vision"],
+    "additionalProperties": False
+}
+
+def sample_brief(team_name, brief_type="brief1"):
+    if brief_type == "brief1":
+        return {
+            "team": team_name,
+            "narrative": f"{team_name} represents the pinnacle of athletic excellence, community unity, and unwavering determination. This campaign celebrates not just the team's prowess on the field, but their role as hometown heroes who inspire greatness in every fan.",
+            "themes": [
+                {"name": "Legacy & Tradition", "description": "Honoring decades of championship spirit"},
+                {"name": "Community Pride", "description": "Bringing the city together under one banner"},
+                {"name": "Unstoppable Force", "description": "Showcasing athletic dominance and teamwork"},
+                {"name": "Fan Devotion", "description": "Celebrating the passionate fanbase that fuels victory"}
+            ],
+            "vision": f"Create an emotional connection that transforms casual viewers into lifelong supporters, emphasizing how {team_name} embodies the fighting spirit of their community."
+        }
+    else:
+        return {
+            "team": team_name,
+            "narrative": f"{team_name} stands as a beacon of excellence, representing more than just athletic achievement – they embody the dreams, aspirations, and collective spirit of an entire community.",
+            "themes": [
+                {"name": "Innovation & Excellence", "description": "Pushing boundaries in every game"},
+                {"name": "Unity in Diversity", "description": "Bringing together fans from all walks of life"},
+                {"name": "Resilience & Grit", "description": "Overcoming challenges with determination"},
+                {"name": "Championship Mentality", "description": "Setting the standard for success"}
+            ],
+            "vision": f"Develop a campaign that showcases {team_name} as both fierce competitors and community champions, creating an aspirational brand that resonates with fans' personal values and ambitions."
+        }
+
+def render_brief(brief, brief_type="brief1"):
+    # Also renders a partly received brief, so streamed briefs are painted as they arrive
+    narrative, themes, vision = BRIEF_SECTIONS.get(brief_type, BRIEF_SECTIONS["brief1"])
+    parts = [f"# {brief['team']}"]
+    if brief.get("narrative"):
+        parts.append(f"## {narrative}\n{brief['narrative']}")
+    if brief.get("themes"):
+        items = [f"- **{theme['name']}:** {theme.get('description', '')}" for theme in brief["themes"] if isinstance(theme, dict) and theme.get("name")]
+        parts.append("\n".join([f"## {themes}"] + items))
+    if brief.get("vision"):
+        parts.append(f"## {vision}\n{brief['vision']}")
+    return "\n\n".join(parts)
+
+def brief_fields(brief):
+    # The brief as the model writes it, without the team it was written for
+    return {field: brief[field] for field in BRIEF_SCHEMA["required"]}
+
+def brief_themes(brief):
+    return [theme["name"] for theme in brief["themes"]]
+
+def parse_brief(text, team_name):
+    # Raises ValueError unless the reply is a complete brief
+    data = json.loads(text)
+    if not isinstance(data, dict) or not all(isinstance(data.get(field), str) for field in ("narrative", "vision")) \
+            or not isinstance(data.get("themes"), list):
+        raise ValueError("Brief is missing its narrative, themes or vision")
+    themes = [
+        {"name": str(theme["name"]), "description": str(theme.get("description", ""))}
+        for theme in data["themes"] if isinstance(theme, dict) and theme.get("name")
+    ]
+    return {"team": team_name, "narrative": data["narrative"], "themes": themes, "vision": data["vision"]}
+
+def valid_brief(text, team_name):
+    try:
+        parse_brief(text, team_name)
+        return True
+    except ValueError:
+        return False
+
+def parse_partial_json(text):
+    # A JSON document cut off mid-stream: keep every complete value plus the string being received,
+    # close whatever is still open and parse that. None until there is anything to show
+    closers = []
+    in_string = escape = False
+    string_is_value = False
+    safe = (0, "")  # Longest prefix that parses once its open containers are closed
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+                if string_is_value:
+                    safe = (i + 1, "".join(reversed(closers)))
+        elif ch == '"':
+            before = text[:i].rstrip()[-1:]
+            in_string = True
+            string_is_value = before == ":" or (closers[-1:] == ["]"] and before in ("[", ","))
+        elif ch in "{[":
+            closers.append("}" if ch == "{" else "]")
+            safe = (i + 1, "".join(reversed(closers)))
+        elif ch in "}]" and closers:
+            closers.pop()
+            safe = (i + 1, "".join(reversed(closers)))
+    
+    candidates = []
+    if in_string and string_is_value:
+        body = text[:-1] if escape else text
+        candidates.append(body + '"' + "".join(reversed(closers)))
+    candidates.append(text[:safe[0]] + safe[1])
+    for candidate in candidates:
+        try:
+            return json.loads(candidate)
+        except ValueError:
+            continue
+    return None
+
+def brief_messages(team_name, brief_type="brief1"):
+    focus = ", ".join(theme.lower() for theme in BRIEF_THEMES.get(brief_type, BRIEF_THEMES["brief1"]))
+    if brief_type == "brief1":
+        prompt = f"""Create a marketing campaign brief for the sports team "{team_name}".
+
+narrative: a compelling narrative about the team's identity and values
+themes: four key themes, each a short name and a one-line description
+vision: the overall vision and goals for the marketing campaign
+
+Focus on themes like {focus}. Make it inspiring and emotionally engaging."""
+    else:
+        prompt = f"""Create a marketing campaign brief for the sports team "{team_name}".
+
+narrative: the team's role in the community and their broader impact
+themes: four core pillars, each a short name and a one-line description
+vision: the creative approach and messaging strategy
+
+Focus on themes like {focus}. Make it aspirational and community-focused."""
+    
+    return [
+        {"role": "system", "content": "You are a professional marketing strategist creating campaign briefs for sports teams. Write compelling, emotionally engaging content."},
+        {"role": "user", "content": prompt}
+    ]
+
+def brief_request(team_name, brief_type="brief1"):
+    return {
+        "model": "gpt-4.1",
+        "messages": brief_messages(team_name, brief_type),
+        "max_tokens": 1000,  # Room for the JSON keys and quoting as well as the prose; a cut-off reply is unusable
+        "temperature": 0.7,
+        "response_format": {"type": "json_schema", "json_schema": {"name": "campaign_brief", "strict": True, "schema": BRIEF_SCHEMA}}
+    }
+
+def chat(request, on_status=None, stage=None, hedge=False, leg=None):
+    # One completion call; an open breaker rejects it before it queues for the rate limit
+    # leg is its HedgeLeg when it races another request: it reports its admission, and withdraws if the other one wins first
+    leg = leg or HedgeLeg()
+    breaker = circuit_breakers.breaker(f"openai:{request['model']}")
+    breaker.check(f"OpenAI {request['model']}")
+    try:
+        with rate_limited(f"openai:{request['model']}", estimate_tokens(request), on_status, stage, leg.cancelled) as lease:
+            leg.admitted()
+            with breaker.timed(), telemetry.span("openai.chat", model=request["model"], hedge=hedge):
+                response = client.chat.completions.create(**request)
+    except Withdrawn:
+        breaker.release()  # Never sent, so it counts neither way
+        raise
+    if response.usage:
+        lease.settle(response.usage.total_tokens)
+    if "response_format" in request and response.choices[0].finish_reason == "length":
+        raise ValueError(f"OpenAI {request['model']} reply was cut off at {request['max_tokens']} tokens")
+    return response.choices[0].message.content
+
+def complete_chat(request, on_status=None, stage=None, parse=None, use_cache=True):
+    # Cached on a hash of the whole request, so a repeat request costs no API call; use_cache=False asks afresh
+    # A request slower than its model's p95 (or failing) is raced against the alternate model
+    # parse (e.g. parse_brief) must accept a reply before it is cached, so a bad reply is never served again
+    # A reply from the alternate is cached under the alternate request, never as the requested model's answer
+    parse = parse or (lambda text: text)
+    key = cache_key("openai", request)
+    
+    def create():
+        # The request that answered, and its reply
+        alternate = alternate_request(request)
+        return hedged(
+            lambda leg: (request, chat(request, on_status, stage, leg=leg)),
+            alternate and (lambda leg: (alternate, chat(alternate, hedge=True, leg=leg))),
+            hedge_delay(request)
+        )
+    
+    def cached():
+        text = generation_cache.get(key) if generation_cache and use_cache else None
+        if text is not None:
+            try:
+                parse(text)
+                return text
+            except ValueError:
+                pass  # Cached before replies were checked; request it again
+        answered, text = create()
+        parse(text)
+        if generation_cache:
+            generation_cache.put(cache_key("openai", answered), text)
+        return text
+    return parse(inflight.do(key, cached))
+
+def generate_brief(team_name, brief_type="brief1", on_status=None):
+    if APP_MODE == "test":
+        time.sleep(2)  # Simulate API delay
+        return sample_brief(team_name, brief_type)
+    
+    # Production mode - use OpenAI
+    with telemetry.span("brief", brief_type=brief_type):
+        try:
+            return complete_chat(brief_request(team_name, brief_type), on_status, stage="generating", parse=lambda text: parse_brief(text, team_name))
+        except Exception as e:
+            telemetry.fallback("brief", e)
+            return sample_brief(team_name, brief_type)
+
+def stream_brief(team_name, brief_type="brief1", on_status=None):
+    """Yield the brief's JSON text chunk by chunk as the model generates it."""
+    if APP_MODE == "test":
+        # Simulate token streaming over the same 2 second API delay
+        words = json.dumps(brief_fields(sample_brief(team_name, brief_type))).split(" ")
+        for i, word in enumerate(words):
+            time.sleep(2 / len(words))
+            yield word if i == len(words) - 1 else word + " "
+        return
+    
+    # Production mode - stream from OpenAI, sharing cache entries with generate_brief
+    request = brief_request(team_name, brief_type)
+    key = cache_key("openai", request)
+    cached = generation_cache.get(key) if generation_cache else None
+    if cached is not None and valid_brief(cached, team_name):
+        yield cached
+        return
+    
+    def stream_completion(request, leg, hedge=False):
+        # The breaker sees the time to first token; a stream closed (or withdrawn) because the other hedge won counts neither way
+        breaker = circuit_breakers.breaker(f"openai:{request['model']}")
+        breaker.check(f"OpenAI {request['model']}")
+        estimate = estimate_tokens(request)
+        received = 0
+        try:
+            with rate_limited(f"openai:{request['model']}", estimate, None if hedge else on_status, "generating", leg.cancelled) as lease, \
+                    telemetry.span("openai.chat", model=request["model"], streaming=True, hedge=hedge):
+                leg.admitted()
+                started = time.monotonic()
+                try:
+                    for chunk in client.chat.completions.create(**request, stream=True):
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            if not received:
+                                breaker.record(True, time.monotonic() - started, "first_token")
+                            received += len(chunk.choices[0].delta.content)
+                            yield chunk.choices[0].delta.content
+                except GeneratorExit:
+                    if not received:
+                        breaker.release()
+                    raise
+                except Exception:
+                    breaker.record(False)
+                    raise
+                if not received:
+                    breaker.record(True, time.monotonic() - started, "first_token")
+                lease.settle(estimate - request["max_tokens"] + received // 4)
+        except Withdrawn:
+            breaker.release()  # Never sent
+            raise
+    
+    answered = []  # The request whose stream won, once this session leads the flight
+    
+    def hedged_completion():
+        alternate = alternate_request(request)
+        return hedged_stream(
+            lambda leg: stream_completion(request, leg),
+            alternate and (lambda leg: stream_completion(alternate, leg, hedge=True)),
+            hedge_delay(request, "first_token"),
+            on_win=lambda index: answered.append(alternate if index else request)
+        )
+    
+    # Identical briefs already streaming for another session are followed rather than requested again
+    chunks = []
+    try:
+        for chunk in inflight.stream(key, hedged_completion):
+            chunks.append(chunk)
+            yield chunk
+        # A reply cut off at max_tokens, or otherwise malformed, is not cached: the next request tries again
+        # The leader caches under the request that answered; sessions following its flight leave that to it
+        if generation_cache and answered and valid_brief("".join(chunks), team_name):
+            generation_cache.put(cache_key("openai", answered[0]), "".join(chunks))
+    except Exception as e:
+        telemetry.fallback("brief", e)
+        if not chunks:
+            yield json.dumps(brief_fields(sample_brief(team_name, brief_type)))  # Fallback to test mode
+
+def stream_brief_task(team_name, brief_type="brief1", on_status=None):
+    # Publishes the brief received so far, rendered to markdown, as the task's "partial" progress
+    chunks = []
+    with telemetry.span("brief", brief_type=brief_type, streaming=True):
+        for chunk in stream_brief(team_name, brief_type, on_status):
+            chunks.append(chunk)
+            partial = parse_partial_json("".join(chunks)) if on_status else None
+            if isinstance(partial, dict):
+                on_status("streaming", partial=render_brief(dict(partial, team=team_name), brief_type))
+        try:
+            return parse_brief("".join(chunks), team_name)
+        except ValueError as e:
+            # A stream cut off part way through
+            telemetry.fallback("brief", e)
+            return sample_brief(team_name, brief_type)
+
+def image_prompt_messages(brief):
+    # Only the fields that shape the visual go to the summariser, not the whole brief
+    summary = f"Team: {brief['team']}\nThemes: {', '.join(brief_themes(brief))}\nVision: {brief['vision']}"
+    return [
+        {"role": "system", "content": "You are an expert at creating concise, visual image prompts for marketing campaigns. Convert the campaign brief into one powerful, detailed image prompt that captures the essence of the campaign."},
+        {"role": "user", "content": f"Convert this campaign brief into ONE powerful image prompt for a marketing visual:\n\n{summary}\n\nThe prompt should be 1-2 sentences, highly visual and descriptive, perfect for generating a stunning marketing campaign image."}
+    ]
+
+def leonardo_request(prompt, num_images=1, seed=None):
+    data = {
+        "modelId": "de7d3faf-762f-48e0-b3b7-9d0ac3a3fcf3",
+        "contrast": 3.5,
+        "prompt": prompt,
+        "num_images": num_images,
+        "width": 1792,
+        "height": 1024,
+        "alchemy": True,
+        "styleUUID": "111dc692-d470-4eec-b791-3475abac4c46",
+        "enhancePrompt": False
+    }
+    if seed is not None:
+        data["seed"] = seed
+    return data
+
+def variant_requests(prompt, count=None, per_job=None, fresh=False, seed=None):
+    # One Leonardo payload per job, each with its own seed. Seeds derive from the prompt so the
+    # same prompt maps to the same payloads (and cache entries); fresh=True draws new ones
+    # and seed pins the first job's seed
+    count = count or IMAGE_VARIANTS
+    per_job = max(1, min(per_job or IMAGE_VARIANTS_PER_JOB, count))
+    if seed is not None:
+        base = seed
+    else:
+        base = random.randrange(2**31) if fresh else int(hashlib.sha256(prompt.encode()).hexdigest()[:8], 16)
+    return [
+        leonardo_request(prompt, min(per_job, count - start), (base + start) % 2**31)
+        for start in range(0, count, per_job)
+    ]
+
+def prepare_image(brief, on_status=None):
+    # No Streamlit calls in here - this also runs as a background prefetch between reruns
+    team_name = brief["team"]
+    with telemetry.span("image.summary") as summary_span:
+        summary = complete_chat({
+            "model": "gpt-4o-mini",
+            "messages": image_prompt_messages(brief),
+            "max_tokens": 150,
+            "temperature": 0.7
+        }, on_status, stage="summarising")
+        
+        # Get the prompt from the response
+        summary = summary.strip()
+        
+        # If the prompt is empty or too short, use a fallback
+        fallback = not summary or len(summary) < 20
+        if fallback:
+            summary_span.outcome = "fallback_prompt"
+    prompt = summary
+    if fallback:
+        prompt = f"Professional sports marketing poster featuring {team_name}, dynamic action shot with team colors, championship trophy, energetic crowd in background, high-quality stadium lighting, inspirational and powerful composition"
+    
+    # Add marketing campaign prefix to the prompt
+    return {"summary": summary, "fallback": fallback, "prompt": f"Create a marketing campaign for {prompt}"}
+
+def prefetch_image(brief):
+    # Speculative summary for one brief while the user is still reading them; failures just mean no prefetch
+    try:
+        return prepare_image(brief)
+    except Exception as e:
+        logger.warning("Image prompt prefetch failed: %s", e)
+        return None
+
+def speculate_image(prepared):
+    # Engine task after a brief's prefetch when SPECULATIVE_IMAGES is on: renders the first variant's job before
+    # a brief is picked and caches its images under the job's payload, so the picked brief's image task shares
+    # this flight (or finds the cache) and the other brief still pays off if it is picked later. The Leonardo
+    # slot is held from submit until the job settles, like any other job; failures just mean no speculation
+    if not prepared or circuit_breakers.breaker("leonardo").state != "closed":
+        return None
+    data = variant_requests(prepared["prompt"])[0]
+    key = cache_key("leonardo", data)
+    if generation_cache and generation_cache.get(key):
+        return None
+    
+    def run_job():
+        breaker = circuit_breakers.breaker("leonardo")
+        with rate_limited("leonardo"), breaker.timed():
+            with telemetry.span("leonardo.submit", speculative=True):
+                generation_id = leonardo_tracker.submit(data)
+            with telemetry.span("leonardo.wait", speculative=True):
+                image_urls = leonardo_tracker.wait(generation_id)
+        if generation_cache:
+            generation_cache.put(key, image_urls)
+        return image_urls
+    
+    try:
+        return inflight.do(key, run_job)
+    except Exception as e:
+        logger.warning("Speculative Leonardo job failed: %s", e)
+        return None
+
+def generate_images(brief, count=None, on_status=None, prepared=None, use_cache=True, debug_info=None, seed=None, image_info=None):
+    # on_status(stage, attempt=0, images=[...]) reports real progress: summarising, queued, polling, fetched,
+    # with the variants that are ready so far in images
+    # prepared is an optional prefetch_image result holding the summarised prompt
+    # use_cache=False skips cached and speculative results and draws new seeds (or uses seed) for fresh visuals
+    # debug_info collects the debug log for the caller to display
+    # image_info receives the final prompt and each image's seed, so a regenerate can skip straight to Leonardo
+    report = on_status or (lambda stage, attempt=0, **info: None)
+    count = count or IMAGE_VARIANTS
+    
+    # Clear previous debug info
+    if debug_info is None:
+        debug_info = []
+    if image_info is None:
+        image_info = {}
+    image_info.update(prompt=None, seeds={})
+    
+    if APP_MODE == "test":
+        debug_info.append("🧪 Running in TEST mode - using sample images")
+        report("summarising")
+        time.sleep(1)  # Simulate API delay
+        report("queued")
+        images = random.sample(SAMPLE_IMAGES, min(count, len(SAMPLE_IMAGES)))
+        for attempt in range(1, 3):
+            time.sleep(1)
+            report("polling", attempt)
+        for i in range(len(images)):
+            time.sleep(random.uniform(0.2, 0.8))  # Variants finish one by one
+            report("polling", 3, images=images[:i + 1])
+        report("fetched")
+        return images
+    
+    # Debug: Check configuration
+    debug_info.append(f"📊 APP_MODE = {APP_MODE}")
+    debug_info.append(f"🔑 Leonardo API Key Present: {'Yes' if LEONARDO_API_KEY else 'No'}")
+    debug_info.append(f"📏 Leonardo API Key Length: {len(LEONARDO_API_KEY) if LEONARDO_API_KEY else 0}")
+    
+    # Production mode - use GPT-4o-mini for prompt and Leonardo AI for image generation
+    try:
+        # Reuse the speculative prompt summarised while the user was reading the briefs
+        if prepared is not None:
+            debug_info.append("⚡ Using prefetched image prompt")
+        else:
+            # First, use GPT-4o-mini to summarize the brief into a single concise image prompt
+            debug_info.append("🤖 Generating image prompt with GPT-4o-mini...")
+            report("summarising")
+            prepared = prepare_image(brief, on_status=on_status)
+        
+        debug_info.append(f"✅ Generated prompt: {prepared['summary']}")
+        if prepared["fallback"]:
+            debug_info.append("⚠️ Using fallback prompt")
+        debug_info.append(f"🎯 Final prompt: {prepared['prompt']}")
+        image_info["prompt"] = prepared["prompt"]
+        
+        # Variants render as parallel Leonardo jobs with different seeds, so trying alternatives costs
+        # one generation latency; each job's images are reported the moment that job lands
+        jobs = variant_requests(prepared["prompt"], count, fresh=not use_cache, seed=seed)
+        debug_info.append(f"🎲 Rendering {count} variants in {len(jobs)} Leonardo jobs (seeds {', '.join(str(data['seed']) for data in jobs)})")
+        landed = []  # In the order jobs finish, so a variant never moves once it is on screen
+        attempts = [0] * len(jobs)
+        lock = threading.Lock()
+        tracker = leonardo_tracker
+        
+        def render(i, data):
+            # Identical payloads reuse the cached result unless the user asked for fresh images
+            leonardo_key = cache_key("leonardo", data)
+            image_urls = generation_cache.get(leonardo_key) if use_cache and generation_cache else None
+            if image_urls:
+                debug_info.append(f"🗄️ Variant {i + 1}: using cached Leonardo AI image")
+                return image_urls
+            
+            # Submit the job, then wait on adaptive backoff polling (or the webhook, when configured)
+            # The Leonardo slot is held for the whole job, since Leonardo limits concurrent jobs
+            # While Leonardo's breaker is open, new jobs fail at once instead of after the job timeout
+            def run_job():
+                breaker = circuit_breakers.breaker("leonardo")
+                breaker.check("Leonardo AI")
+                with rate_limited("leonardo", on_status=on_status), breaker.timed():
+                    debug_info.append(f"🎨 Variant {i + 1}: sending request to Leonardo AI...")
+                    with telemetry.span("leonardo.submit", variant=i):
+                        generation_id = tracker.submit(data)
+                    debug_info.append(f"🔗 Variant {i + 1}: generation ID {generation_id}")
+                    report("queued")
+                    
+                    def on_poll(attempt, status):
+                        debug_info.append(f"⏳ Variant {i + 1}: polling attempt {attempt}: {status}")
+                        with lock:
+                            attempts[i] = attempt
+                            report("polling", max(attempts))
+                    
+                    with telemetry.span("leonardo.wait", variant=i):
+                        return tracker.wait(generation_id, on_poll=on_poll)
+            
+            def on_join():
+                debug_info.append(f"🤝 Variant {i + 1}: sharing an identical Leonardo AI job already in flight")
+                report("queued")
+            
+            # Concurrent identical requests share one job; "Regenerate Image" always starts its own
+            image_urls = inflight.do(leonardo_key, run_job, on_join) if use_cache else run_job()
+            if generation_cache:
+                generation_cache.put(leonardo_key, image_urls)
+            return image_urls
+        
+        errors = []
+        with ThreadPoolExecutor(max_workers=len(jobs), thread_name_prefix="leonardo-variant") as pool:
+            # Each job runs in a copy of this task's context, so its spans keep the campaign tags
+            futures = {pool.submit(contextvars.copy_context().run, render, i, data): i for i, data in enumerate(jobs)}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    urls = future.result()
+                except Exception as e:
+                    debug_info.append(f"❌ Variant {i + 1}: {e}")
+                    errors.append(e)
+                    continue
+                with lock:
+                    landed.extend(urls)
+                    image_info["seeds"].update((url, jobs[i]["seed"]) for url in urls)
+                    report("polling", max(attempts), images=list(landed))
+        
+        image_urls = landed
+        if not image_urls:
+            raise errors[0]
+        report("fetched")
+        debug_info.append(f"🎉 SUCCESS! Returning {len(image_urls)} Leonardo AI images")
+        for image_url in image_urls:
+            debug_info.append(f"📎 Image URL: {image_url}")
+        return image_urls
+        
+    except LeonardoError as e:
+        # If Leonardo AI fails, return a sample image
+        debug_info.append(f"❌ {e}")
+        debug_info.append("🔄 Leonardo AI failed - using sample image as fallback")
+        telemetry.fallback("image", e)
+        return [SAMPLE_IMAGES[0]]
+        
+    except Exception as e:
+        # Fallback to test mode
+        debug_info.append(f"💥 Exception occurred: {str(e)}")
+        telemetry.fallback("image", e)
+        return [random.choice(SAMPLE_IMAGES)]
+
+def generate_song(genre, on_status=None, track_url=None):
+    with telemetry.span("song.select", genre=genre["id"]):
+        return select_song(genre, on_status, track_url)
+
+def select_song(genre, on_status=None, track_url=None):
+    # track_url is the track picked (and prefetched) for this genre while the genres were on screen
+    report = on_status or (lambda stage, attempt=0: None)
+    report("selecting")
+    
+    if APP_MODE == "test":
+        time.sleep(6)  # Simulate generation delay
+        report("complete")
+        return {
+            "url": "https://example.com/generated-song.mp3",
+            "title": f"{genre['name']} Anthem"
+        }
+    
+    # Production mode - a track from the validated S3 library; none at all means no player rather than a broken one
+    track = None
+    if song_library:
+        track = song_library.track(track_url) if track_url else None
+        if not track or track["available"] is False:
+            track = song_library.pick(genre["id"])
+    report("complete")
+    
+    return {
+        "url": track["url"] if track else None,
+        "title": (track and track["title"]) or f"{genre['name']} Victory Anthem",
+        "duration": track["duration"] if track else None
+    }
+
+def image_task(*prepared, brief, count=None, use_cache=True, on_status=None):
+    # Engine task: the optional dependency result is the prefetched prompt for this brief
+    debug_info = []
+    image_info = {}
+    with telemetry.span("image", use_cache=use_cache, prefetched=bool(prepared and prepared[0])):
+        images = generate_images(brief, count, on_status=on_status, prepared=prepared[0] if prepared else None,
+                                 use_cache=use_cache, debug_info=debug_info, image_info=image_info)
+    return {"images": images, "debug_info": debug_info, **image_info}
+
+def vary_image(prompt, brief=None, seed=None, on_status=None):
+    # Engine task for "Regenerate Image": exactly one new Leonardo job from the prompt the first run
+    # already summarised, with a new seed (or the one given) - no LLM call and no simulated delay
+    # Only without a saved prompt (the first run fell back to a sample) is the brief summarised again
+    if APP_MODE == "test":
+        return {"images": [random.choice(SAMPLE_IMAGES)], "seeds": {}, "prompt": None,
+                "debug_info": ["🧪 Running in TEST mode - using sample images"]}
+    
+    debug_info = ["🔁 Regenerating from the saved image prompt" if prompt else "🔁 No saved image prompt - summarising the brief again"]
+    image_info = {}
+    prepared = {"summary": prompt, "fallback": False, "prompt": prompt} if prompt else None
+    with telemetry.span("image.regenerate", saved_prompt=bool(prompt)):
+        images = generate_images(brief, 1, on_status=on_status, prepared=prepared, use_cache=False,
+                                 debug_info=debug_info, seed=seed, image_info=image_info)
+    if not image_info["seeds"]:
+        # generate_images fell back to a sample; keep the visual the user already has instead
+        raise RuntimeError(next((line for line in reversed(debug_info) if line.startswith(("❌", "💥"))), "No image generated"))
+    return {"images": images, "debug_info": debug_info, **image_info}
+
+def providers_idle():
+    # No live request holds or waits for a provider slot
+    return all(not stats["active"] and not stats["waiting"] for stats in rate_limiter.stats().values())
+
+def stock_campaign(team_name, pause=None, use_cache=True):
+    """Inventory generator: every brief for team_name, or None once pause() says stop.
+
+    Only the briefs are stocked, as they are all the first page shows; the visitor's
+    pick then prefetches and renders its images like any live campaign, so no Leonardo
+    credits go on images nobody chose. Raises instead of falling back to samples, so
+    only real briefs are stocked. use_cache=False asks afresh, for replacing a stale one.
+    """
+    pause = pause or (lambda: True)
+    briefs = {}
+    for brief_type in BRIEF_THEMES:
+        if not pause():
+            return None
+        briefs[brief_type] = complete_chat(brief_request(team_name, brief_type), parse=lambda text: parse_brief(text, team_name), use_cache=use_cache)
+    return {"briefs": briefs}
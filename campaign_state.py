@@ -0,0 +1,115 @@
+"""Compact per-session campaign state with a bounded diagnostics log.
+
+Each Streamlit session keeps one CampaignState in st.session_state instead of a
+dozen loose keys. Briefs are stored as their structured fields keyed by brief type, images
+as URLs and the genre as its id; everything derivable from the shared
+BRIEF_THEMES and SONG_GENRES tables is looked up rather than copied. to_dict()
+and restore() round-trip it through JSON for the shared state store.
+"""
+import sys
+import threading
+import weakref
+from collections import deque
+
+from campaign import SONG_GENRES
+
+DEBUG_LOG_SIZE = 50
+
+_live = weakref.WeakSet()
+_live_lock = threading.Lock()
+
+
+class CampaignState:
+    """One session's campaign: what the pages need between reruns and nothing else."""
+
+    __slots__ = ("campaign_id", "team_name", "briefs", "selected_brief", "images", "selected_image",
+                 "images_pending", "image_prompt", "image_seeds", "regenerating", "song_picks", "genre_id", "generated_song",
+                 "debug", "__weakref__")
+
+    def __init__(self, debug_size=DEBUG_LOG_SIZE):
+        self.debug = deque(maxlen=debug_size)
+        self.reset()
+        with _live_lock:
+            _live.add(self)
+
+    def reset(self):
+        self.campaign_id = None
+        self.team_name = ""
+        self.briefs = {}  # brief type -> {"team", "narrative", "themes", "vision"}
+        self.selected_brief = None  # brief type
+        self.images = ()  # image URLs
+        self.selected_image = None
+        self.images_pending = False  # More variants are still rendering
+        self.image_prompt = None  # Summarised Leonardo prompt, reused by "Regenerate Image"
+        self.image_seeds = {}  # image URL -> Leonardo seed
+        self.regenerating = None  # Index of the variant being regenerated
+        self.song_picks = {}  # genre id -> track URL being prefetched for it
+        self.genre_id = None
+        self.generated_song = None
+        self.debug.clear()
+
+    @property
+    def brief(self):
+        return self.briefs.get(self.selected_brief)
+
+    @property
+    def genre(self):
+        return next((genre for genre in SONG_GENRES if genre["id"] == self.genre_id), None)
+
+    def log(self, *lines):
+        # Oldest lines fall off the ring; a line repeated on every rerun is only kept once
+        for line in lines:
+            if not self.debug or self.debug[-1] != line:
+                self.debug.append(line)
+
+    def complete(self):
+        # A finished campaign only ever shows its chosen brief again
+        self.briefs = {self.selected_brief: self.brief}
+        self.song_picks = {}
+
+    def to_dict(self):
+        return {name: list(value) if isinstance(value, (tuple, deque)) else value
+                for name, value in ((name, getattr(self, name)) for name in self.__slots__ if name != "__weakref__")}
+
+    def restore(self, data):
+        self.reset()
+        for name, value in data.items():
+            if name == "debug":
+                self.debug.extend(value)
+            elif name == "briefs" and not all(isinstance(brief, dict) for brief in value.values()):
+                # Saved before briefs became structured
+                raise ValueError("Campaign holds plain-text briefs")
+            elif name == "images":
+                self.images = tuple(value)
+            elif name in self.__slots__:
+                setattr(self, name, value)
+
+    def nbytes(self):
+        """Approximate deep size in bytes of everything this state holds."""
+        seen = set()
+
+        def size(obj):
+            if id(obj) in seen:
+                return 0
+            seen.add(id(obj))
+            total = sys.getsizeof(obj)
+            if isinstance(obj, dict):
+                total += sum(size(key) + size(value) for key, value in obj.items())
+            elif isinstance(obj, (list, tuple, deque, set)):
+                total += sum(size(item) for item in obj)
+            return total
+
+        return sys.getsizeof(self) + sum(size(getattr(self, name)) for name in self.__slots__ if name != "__weakref__")
+
+
+def memory_report():
+    """Campaign state held by every live session in this process."""
+    with _live_lock:
+        states = list(_live)
+    sizes = [state.nbytes() for state in states]
+    return {
+        "sessions": len(sizes),
+        "total_bytes": sum(sizes),
+        "max_bytes": max(sizes, default=0),
+        "avg_bytes": sum(sizes) / len(sizes) if sizes else 0
+    }
@@ -0,0 +1,221 @@
+"""Background asyncio engine that runs each campaign as a DAG of generation tasks.
+
+The engine owns one event loop on a daemon thread per process. Streamlit pages
+only add tasks and read snapshots of their state, so no script thread is held
+while a generation is in flight. With a state store attached, finished results
+are also written there, so a session that moves to another replica (or survives
+a restart) picks them up instead of generating them again.
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+class TaskState:
+    def __init__(self, name, deps, tags=None, lane=None):
+        self.name = name
+        self.deps = tuple(deps)
+        self.tags = dict(tags or {})
+        self.lane = lane
+        self.status = "pending"  # pending -> running -> done | failed | cancelled
+        self.stage = None
+        self.info = {}
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.future = None
+
+    def snapshot(self):
+        return {
+            "name": self.name,
+            "status": self.status,
+            "stage": self.stage,
+            "info": dict(self.info),
+            "result": self.result,
+            "error": self.error,
+            "started": self.started,
+            "finished": self.finished
+        }
+
+
+class CampaignEngine:
+    """Runs tasks keyed by (campaign_id, name); a task starts once all of its deps are done.
+
+    Task functions are ordinary blocking callables run on the engine's thread pool.
+    Dependency results are passed as leading positional arguments, and functions
+    that accept an on_status parameter receive a callback for live progress.
+    Telemetry spans inside a task are tagged with its campaign, name and tags.
+
+    A task added with a lane ("openai", "leonardo") runs on that lane's own
+    threads. Tasks queued behind one provider's rate limit, or holding a
+    long-running job, then never take the threads other providers' tasks need.
+    """
+
+    def __init__(self, max_workers=32, retention=3600, store=None, lanes=None):
+        self.max_workers = max_workers
+        self.retention = retention
+        self.store = store
+        self.lanes = dict(lanes or {})  # lane -> worker threads; tasks without a (known) lane use the shared pool
+        self._executors = {}
+        self._campaigns = {}
+        self._lock = threading.Lock()
+        self.loop = None
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="campaign-engine"))
+        self._executors = {
+            lane: concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"campaign-engine-{lane}")
+            for lane, workers in self.lanes.items()
+        }
+        threading.Thread(target=self.loop.run_forever, name="campaign-engine-loop", daemon=True).start()
+        return self
+
+    def add_task(self, campaign_id, name, fn, *args, deps=(), replace=False, tags=None, lane=None, **kwargs):
+        """Schedule a task. Adding an existing task is a no-op unless replace=True, so reruns are safe."""
+        with self._lock:
+            self._sweep()
+            campaign = self._campaigns.setdefault(campaign_id, {})
+            existing = campaign.get(name)
+            if existing is not None and not replace:
+                return existing.snapshot()
+            if existing is not None:
+                self._cancel(existing)
+
+            # Pick up results that already finished on another replica (or before a restart)
+            for dep in deps:
+                if dep not in campaign:
+                    self._restore(campaign, campaign_id, dep)
+            if existing is None and not replace:
+                restored = self._restore(campaign, campaign_id, name)
+                if restored is not None:
+                    return restored.snapshot()
+
+            state = TaskState(name, deps, tags, lane)
+            campaign[name] = state
+            state.future = asyncio.run_coroutine_threadsafe(self._run(campaign_id, campaign, state, fn, args, kwargs), self.loop)
+            return state.snapshot()
+
+    async def _run(self, campaign_id, campaign, state, fn, args, kwargs):
+        try:
+            dep_results = []
+            for dep in state.deps:
+                dep_state = campaign[dep]
+                # asyncio.wait never raises for the dependency's own failure or cancellation
+                await asyncio.wait([asyncio.wrap_future(dep_state.future)])
+                if dep_state.status != "done":
+                    raise RuntimeError(f"Dependency {dep} {dep_state.status}")
+                dep_results.append(dep_state.result)
+
+            def on_status(stage, attempt=0, **info):
+                state.stage = stage
+                state.info.update(info, attempt=attempt)
+
+            if "on_status" in inspect.signature(fn).parameters:
+                kwargs = dict(kwargs, on_status=on_status)
+            state.status = "running"
+            state.started = time.time()
+            # The call runs in a copy of this task's context, so the tags reach spans in the worker thread
+            with telemetry.tagged(campaign=campaign_id, task=state.name, **state.tags):
+                call = functools.partial(contextvars.copy_context().run, fn, *dep_results, *args, **kwargs)
+                state.result = await asyncio.get_running_loop().run_in_executor(self._executors.get(state.lane), call)
+            if self.store is not None:
+                await asyncio.to_thread(self._persist, campaign_id, state)
+            state.status = "done"
+        except asyncio.CancelledError:
+            state.status = "cancelled"
+        except Exception as e:
+            state.status = "failed"
+            state.error = str(e)
+        finally:
+            state.finished = time.time()
+
+    def task(self, campaign_id, name):
+        with self._lock:
+            state = self._campaigns.get(campaign_id, {}).get(name)
+            if state:
+                return state.snapshot()
+        stored = self._stored(campaign_id, name)
+        if stored is None:
+            return None
+        return {"name": name, "status": "done", "stage": None, "info": {}, "result": stored["result"],
+                "error": None, "started": None, "finished": stored["finished"]}
+
+    def _restore(self, campaign, campaign_id, name):
+        stored = self._stored(campaign_id, name)
+        if stored is None:
+            return None
+        state = TaskState(name, ())
+        state.status = "done"
+        state.result = stored["result"]
+        state.finished = stored["finished"]
+        state.future = concurrent.futures.Future()
+        state.future.set_result(None)
+        campaign[name] = state
+        return state
+
+    def _persist(self, campaign_id, state):
+        try:
+            self.store.put(f"artifacts:{campaign_id}", state.name, {"result": state.result, "finished": time.time()})
+        except Exception as e:
+            logger.warning("Could not store result of %s/%s: %s", campaign_id, state.name, e)
+
+    def _stored(self, campaign_id, name):
+        if self.store is None:
+            return None
+        try:
+            return self.store.get(f"artifacts:{campaign_id}", name)
+        except Exception as e:
+            logger.warning("Could not read stored result of %s/%s: %s", campaign_id, name, e)
+            return None
+
+    def wait(self, campaign_id, name, timeout=None):
+        """Block until the task finishes (or timeout) and return its snapshot. For headless callers only."""
+        with self._lock:
+            state = self._campaigns[campaign_id][name]
+        concurrent.futures.wait([state.future], timeout=timeout)
+        return state.snapshot()
+
+    def discard(self, campaign_id, stored=True):
+        """Cancel and forget a campaign's tasks; stored=False keeps its results in the store."""
+        with self._lock:
+            campaign = self._campaigns.pop(campaign_id, {})
+        for state in campaign.values():
+            self._cancel(state)
+        if stored and self.store is not None:
+            try:
+                self.store.delete(f"artifacts:{campaign_id}")
+            except Exception as e:
+                logger.warning("Could not delete stored results of %s: %s", campaign_id, e)
+
+    def _cancel(self, state):
+        state.future.cancel()
+        if state.status == "pending":
+            # A task cancelled before it started never enters _run, so record the outcome here
+            state.status = "cancelled"
+            state.finished = time.time()
+
+    def _sweep(self):
+        # Forget campaigns whose tasks all finished longer ago than the retention window
+        cutoff = time.time() - self.retention
+        for campaign_id, campaign in list(self._campaigns.items()):
+            if all(state.finished and state.finished < cutoff for state in campaign.values()):
+                del self._campaigns[campaign_id]
+
+    def stats(self):
+        with self._lock:
+            states = [state for campaign in self._campaigns.values() for state in campaign.values()]
+        counts = {}
+        for state in states:
+            counts[state.status] = counts.get(state.status, 0) + 1
+        return {"campaigns": len(self._campaigns), "tasks": counts}
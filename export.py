@@ -0,0 +1,269 @@
+"""Campaign bundles as ZIP archives that are streamed rather than built in memory.
+
+stream_zip() yields the archive piece by piece while it pulls every asset in
+CHUNK_SIZE chunks, from a local file or straight from upstream, so a download
+holds a few chunks in memory whatever the size of the bundle. ExportServer
+serves bundles over HTTP with chunked transfer encoding; write_zip() streams
+one to disk for batch runs.
+
+    team-name/brief.md, visual.png, social/team-name-1x1.jpg, anthem.mp3, campaign.json
+"""
+import json
+import logging
+import os
+import re
+import secrets
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import closing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import requests
+
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+# Already compressed, so deflating them again would cost CPU for nothing
+STORED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".mp3", ".m4a", ".aac", ".ogg")
+
+
+def slugify(name):
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-") or "campaign"
+
+
+def text_source(text):
+    def chunks():
+        yield text.encode()
+    return chunks
+
+
+def _read_chunks(f):
+    with f:
+        while chunk := f.read(CHUNK_SIZE):
+            yield chunk
+
+
+def file_source(path):
+    def open_chunks():
+        # Opened before the entry is started, so a missing file is left out rather than breaking the archive
+        return _read_chunks(open(path, "rb"))
+    return open_chunks
+
+
+def url_source(url, http=requests):
+    def open_chunks():
+        response = http.get(url, stream=True)
+        try:
+            response.raise_for_status()
+        except Exception:
+            response.close()
+            raise
+
+        def chunks():
+            try:
+                yield from response.iter_content(CHUNK_SIZE)
+            finally:
+                response.close()
+        return chunks()
+    return open_chunks
+
+
+def asset_source(location, media=None, http=requests):
+    # A local path, the media cache's copy of a URL when it has one, else the URL itself; exports never fill the cache
+    def open_chunks():
+        if not location.startswith(("http://", "https://")):
+            return file_source(location)()
+        path = media.cached_path(location) if media else None
+        return file_source(path)() if path else url_source(location, http)()
+    return open_chunks
+
+
+def extension(location, default):
+    return os.path.splitext(urlparse(location).path)[1].lower() or default
+
+
+def campaign_entries(team_name, brief_markdown=None, image=None, renditions=None, song=None, details=None, media=None, http=requests):
+    """The (name, source) entries of one campaign's bundle, all under a folder named after the team."""
+    folder = slugify(team_name)
+    entries = []
+    if brief_markdown:
+        entries.append((f"{folder}/brief.md", text_source(brief_markdown)))
+    if image:
+        entries.append((f"{folder}/visual{extension(image, '.png')}", asset_source(image, media, http)))
+    for name, path in (renditions or {}).items():
+        entries.append((f"{folder}/social/{folder}-{name.replace(':', 'x')}.jpg", file_source(path)))
+    if song:
+        entries.append((f"{folder}/anthem{extension(song, '.mp3')}", asset_source(song, media, http)))
+    if details:
+        entries.append((f"{folder}/campaign.json", text_source(json.dumps(details, indent=2, default=str))))
+    return entries
+
+
+class _Sink:
+    """Write-only file for ZipFile; what has been written is handed on by drain()."""
+
+    def __init__(self):
+        self.pieces = []
+        self.offset = 0
+
+    def write(self, data):
+        # Never hand on an empty piece: as an HTTP chunk it would end the response
+        if data:
+            self.pieces.append(bytes(data))
+            self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        pieces, self.pieces = self.pieces, []
+        return pieces
+
+
+def stream_zip(entries):
+    """Yield a ZIP archive of (name, source) entries piece by piece.
+
+    The sink cannot seek, so ZipFile writes each entry's sizes and CRC after its
+    data. An asset that cannot be opened is left out and listed in MISSING.txt, in
+    the top folder of the first one left out (the team folder of campaign_entries);
+    one that fails part way through raises, as what was sent cannot be taken back.
+    """
+    sink = _Sink()
+    missing = []
+    folder = ""
+    with zipfile.ZipFile(sink, "w") as archive:
+        for name, source in entries:
+            try:
+                chunks = source()
+            except Exception as e:
+                logger.warning("Leaving %s out of the export: %s", name, e)
+                if not missing and "/" in name:
+                    folder = name.split("/", 1)[0] + "/"
+                missing.append(f"{name}: {e}")
+                continue
+            info = zipfile.ZipInfo(name, time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_STORED if name.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            with closing(chunks), archive.open(info, "w") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield from sink.drain()
+            yield from sink.drain()
+        if missing:
+            archive.writestr(f"{folder}MISSING.txt", "\n".join(missing) + "\n")
+    yield from sink.drain()
+
+
+def write_zip(path, entries):
+    """Stream the archive of entries to path and return the path."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for piece in stream_zip(entries):
+                f.write(piece)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+
+class ExportServer:
+    """Streams registered bundles as ZIP downloads at /exports/<token>/<name>.zip.
+
+    register() hands out one unguessable token per key (a campaign id), valid for
+    ttl seconds after it was last registered. The archive is built afresh, from
+    the entries' sources, by every download.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8766, public_url=None, ttl=3600):
+        self.host = host
+        self.port = port
+        self.public_url = public_url  # Base URL browsers reach this server at, e.g. behind the app's proxy
+        self.ttl = ttl
+        self.downloads = 0
+        self._exports = {}  # token -> (filename, entries, expires)
+        self._tokens = {}  # key -> token
+        self._lock = threading.Lock()
+        self._server = None
+
+    def register(self, key, name, entries):
+        """Make entries downloadable as <name>.zip and return the URL to fetch them from."""
+        now = time.time()
+        filename = slugify(name) + ".zip"
+        with self._lock:
+            for token, (_, _, expires) in list(self._exports.items()):
+                if expires < now:
+                    del self._exports[token]
+            token = self._tokens.get(key)
+            if token not in self._exports:
+                token = self._tokens[key] = secrets.token_urlsafe(16)
+            self._exports[token] = (filename, entries, now + self.ttl)
+        base = (self.public_url or f"http://localhost:{self.port}").rstrip("/")
+        return f"{base}/exports/{token}/{filename}"
+
+    def _lookup(self, token):
+        with self._lock:
+            export = self._exports.get(token)
+        return export if export and export[2] >= time.time() else None
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                parts = self.path.split("?")[0].strip("/").split("/")
+                export = server._lookup(parts[1]) if len(parts) == 3 and parts[0] == "exports" else None
+                if export is None:
+                    self.send_response(404)
+                    self.send_header("content-length", "0")
+                    self.end_headers()
+                    return
+                filename, entries, _ = export
+                self.send_response(200)
+                self.send_header("content-type", "application/zip")
+                self.send_header("content-disposition", f'attachment; filename="{filename}"')
+                self.send_header("transfer-encoding", "chunked")
+                self.end_headers()
+
+                sent = 0
+                try:
+                    with telemetry.span("export", files=len(entries)):
+                        for piece in stream_zip(entries):
+                            self.wfile.write(f"{len(piece):x}\r\n".encode() + piece + b"\r\n")
+                            sent += len(piece)
+                        self.wfile.write(b"0\r\n\r\n")
+                    server.downloads += 1
+                except (BrokenPipeError, ConnectionResetError):
+                    logger.debug("Export %s abandoned by the client after %d bytes", filename, sent)
+                    self.close_connection = True
+                except Exception as e:
+                    # No terminating chunk, so the browser reports the download as failed instead of saving a broken file
+                    logger.warning("Export %s failed after %d bytes: %s", filename, sent, e)
+                    self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
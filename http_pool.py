@@ -0,0 +1,93 @@
+"""Shared HTTP client: pooled keep-alive connections, timeouts and retry with backoff."""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class SafeRetry(Retry):
+    """Retry idempotent requests on 429/5xx, but POSTs only on 429 (the request was not processed)."""
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method and method.upper() == "POST" and status_code != 429:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+class PooledHTTPClient:
+    """A requests.Session with per-host connection pools, default timeouts and usage metrics.
+
+    Exposes get/post/head like the requests module, so it can be passed anywhere
+    that expects it (e.g. LeonardoJobTracker's http argument).
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, connect_timeout=5, read_timeout=30,
+                 retries=3, backoff_factor=0.5):
+        self.timeout = (connect_timeout, read_timeout)
+        retry = SafeRetry(
+            total=retries,
+            connect=retries,
+            read=0,  # A read timeout may mean the server acted on the request; let callers decide
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset({"GET", "HEAD", "POST"}),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        # pool_block caps concurrent connections per host at pool_maxsize instead of opening extras
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                   max_retries=retry, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+        try:
+            return self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def stats(self):
+        pools = []
+        manager = self.adapter.poolmanager
+        for key in list(manager.pools.keys()):
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            pools.append({
+                "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                "connections_opened": pool.num_connections,
+                "requests": pool.num_requests,
+                # The queue is padded with None placeholders; only real connections are idle ones
+                "idle": sum(1 for conn in pool.pool.queue if conn is not None) if pool.pool else 0,
+                "maxsize": pool.pool.maxsize if pool.pool else 0
+            })
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors, "in_flight": self.in_flight, "pools": pools}
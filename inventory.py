@@ -0,0 +1,183 @@
+"""Warm inventory of ready-made campaigns for the teams expected at an event.
+
+A background thread works through a watchlist of team names and keeps `depth`
+pre-generated campaigns (what the first page shows: every brief) per team, up to
+`capacity` in all. It only starts a provider call while idle() says no live
+campaign is generating, so it fills the gaps between audience requests instead
+of queueing in front of them. take() hands out the oldest campaign for a team
+and wakes the thread to replace it. Campaigns older than max_age are evicted,
+and regenerated only while the event window is open or once the team is asked
+for again, so nobody pays to keep a quiet watchlist fresh.
+"""
+import logging
+import threading
+import time
+
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+
+def _key(team_name):
+    return " ".join(team_name.lower().split())
+
+
+def stocked(result):
+    # Engine task for a result taken from the inventory: it finishes at once
+    return result
+
+
+class CampaignInventory:
+    """Pre-generated campaigns per watchlisted team, kept fresh in the background.
+
+    generate(team_name, pause, use_cache) returns one campaign and raises rather
+    than fall back to samples; it calls pause() before each provider call so the
+    fill yields to live campaigns between steps, not only between teams. A first
+    fill, or a refill after a take, may reuse cached results (use_cache=True),
+    as a live visitor would; replacing an evicted stale campaign asks afresh.
+    Teams are filled evenly, and one whose fills keep failing backs off on its own.
+    window is an optional (start, end) in epoch seconds during which stale
+    campaigns are always refreshed.
+    """
+
+    def __init__(self, watchlist, generate, depth=1, capacity=50, max_age=6 * 3600, idle=None, poll=1.0, retry=60.0, window=None):
+        self.watchlist = list({_key(team): team.strip() for team in watchlist if team.strip()}.values())
+        self._watched = {_key(team) for team in self.watchlist}
+        self.generate = generate
+        self.depth = depth
+        self.capacity = capacity
+        self.max_age = max_age
+        self.idle = idle or (lambda: True)
+        self.poll = poll  # Seconds between idle checks
+        self.retry = retry  # Seconds a team backs off after a failed fill, doubling with each failure in a row
+        self.window = window
+        self.hits = 0
+        self.misses = 0
+        self.filled = 0
+        self.failures = 0
+        self.evicted = 0
+        self._entries = {}  # team key -> [entry, ...], oldest first
+        self._backoff = {}  # team key -> (failures in a row, time of the next attempt)
+        self._stale = set()  # Team keys with a campaign evicted for age since their last fill
+        self._demand = set()  # Team keys asked for since their last fill
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="campaign-inventory", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def take(self, team_name):
+        """The oldest ready campaign for team_name, or None; its replacement is generated in the background."""
+        with self._lock:
+            self._evict()
+            if _key(team_name) in self._watched:
+                self._demand.add(_key(team_name))
+            entries = self._entries.get(_key(team_name))
+            if not entries:
+                self.misses += 1
+                entry = None
+            else:
+                entry = entries.pop(0)
+                self.hits += 1
+        if entry or _key(team_name) in self._watched:
+            self._wake.set()
+        return entry
+
+    def _evict(self):
+        cutoff = time.time() - self.max_age
+        for key, entries in self._entries.items():
+            fresh = [entry for entry in entries if entry["created"] >= cutoff]
+            if len(fresh) < len(entries):
+                self.evicted += len(entries) - len(fresh)
+                self._stale.add(key)
+            self._entries[key] = fresh
+
+    def _in_window(self, now):
+        return bool(self.window) and self.window[0] <= now < self.window[1]
+
+    def _wanted(self, key, now):
+        # A team short only because its campaigns went stale is refilled in the event window or once it is asked for
+        return key not in self._stale or key in self._demand or self._in_window(now)
+
+    def _next_team(self):
+        # The team with the fewest ready campaigns (watchlist order breaks ties) that is short of depth
+        # and not backing off, while the inventory is under capacity; else None and seconds to sleep
+        now = time.time()
+        with self._lock:
+            self._evict()
+            if sum(len(entries) for entries in self._entries.values()) >= self.capacity:
+                return None, 60
+            short = [team for team in self.watchlist
+                     if len(self._entries.get(_key(team), ())) < self.depth and self._wanted(_key(team), now)]
+            ready = [team for team in short if self._backoff.get(_key(team), (0, 0))[1] <= now]
+            if ready:
+                return min(ready, key=lambda team: len(self._entries.get(_key(team), ()))), 0
+            if short:
+                return None, min(self._backoff[_key(team)][1] for team in short) - now
+            if self.window and now < self.window[0]:
+                return None, self.window[0] - now
+            return None, 60
+
+    def _pause(self):
+        # Blocks until the providers are idle; False once the inventory is stopped
+        while not self.idle():
+            if self._stop.wait(self.poll):
+                return False
+        return not self._stop.is_set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            team, delay = self._next_team()
+            if team is None:
+                # Full or backing off: sleep until a campaign is taken, one could have gone stale or a team may retry
+                self._wake.wait(min(self.max_age, delay))
+                self._wake.clear()
+                continue
+            if not self._pause():
+                return
+            with self._lock:
+                use_cache = _key(team) not in self._stale
+            try:
+                with telemetry.span("inventory.fill", team=team, use_cache=use_cache):
+                    entry = self.generate(team, self._pause, use_cache)
+            except Exception as e:
+                with self._lock:
+                    self.failures += 1
+                    failures = self._backoff.get(_key(team), (0, 0))[0] + 1
+                    delay = min(self.retry * 2 ** (failures - 1), 3600)
+                    self._backoff[_key(team)] = (failures, time.time() + delay)
+                logger.warning("Could not pre-generate a campaign for %s, retrying in %.0fs: %s", team, delay, e)
+                continue
+            if entry is None:
+                return  # Stopped part way through
+            entry["created"] = time.time()
+            with self._lock:
+                self._entries.setdefault(_key(team), []).append(entry)
+                self._backoff.pop(_key(team), None)
+                self._stale.discard(_key(team))
+                self._demand.discard(_key(team))
+                self.filled += 1
+
+    def stats(self):
+        with self._lock:
+            self._evict()
+            entries = sum(len(entries) for entries in self._entries.values())
+            stocked_teams = sum(bool(entries) for entries in self._entries.values())
+        return {
+            "teams": len(self.watchlist),
+            "stocked_teams": stocked_teams,
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "filled": self.filled,
+            "failures": self.failures,
+            "evicted": self.evicted
+        }
@@ -0,0 +1,189 @@
+"""Leonardo AI generation jobs: submission, adaptive polling and webhook completion."""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import telemetry
+
+LEONARDO_API_URL = "https://cloud.leonardo.ai/api/rest/v1"
+
+
+class LeonardoError(Exception):
+    pass
+
+
+def backoff_intervals(initial=1.0, factor=1.5, maximum=8.0, jitter=0.2):
+    """Yield poll intervals that start short and grow geometrically, each with +/- jitter."""
+    interval = initial
+    while True:
+        yield interval * random.uniform(1 - jitter, 1 + jitter)
+        interval = min(interval * factor, maximum)
+
+
+def extract_generation(generation_data):
+    """Return (status, image_urls) from any of the response shapes Leonardo has used."""
+    job = generation_data
+    if "generations_by_pk" in generation_data:
+        job = generation_data["generations_by_pk"] or {}
+
+    images = job.get("generated_images") or job.get("images") or []
+    urls = []
+    for image in images:
+        url = image.get("url") or image.get("image_url") or image.get("imageUrl")
+        if url:
+            urls.append(url)
+
+    status = job.get("status") or ("COMPLETE" if urls else "PENDING")
+    return status, urls
+
+
+class LeonardoJobTracker:
+    """Submits generation jobs and waits for them with deadline-driven backoff polling.
+
+    When a WebhookReceiver is attached, a callback from Leonardo wakes the waiting
+    thread immediately; polling keeps running underneath as a fallback.
+    """
+
+    def __init__(self, api_key, base_url=LEONARDO_API_URL, http=requests,
+                 initial_interval=1.0, max_interval=8.0, timeout=120):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.http = http
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._events = {}
+        self._results = {}
+
+    @property
+    def headers(self):
+        return {
+            "accept": "application/json",
+            "authorization": f"Bearer {self.api_key}",
+            "content-type": "application/json"
+        }
+
+    def submit(self, data):
+        response = self.http.post(f"{self.base_url}/generations", headers=self.headers, json=data)
+        if response.status_code != 200:
+            raise LeonardoError(f"Leonardo AI API Error {response.status_code}: {response.text[:200]}")
+
+        generation_id = response.json().get("sdGenerationJob", {}).get("generationId")
+        if not generation_id:
+            raise LeonardoError("No generation ID received from Leonardo AI")
+
+        with self._lock:
+            self._events[generation_id] = threading.Event()
+        return generation_id
+
+    def poll(self, generation_id):
+        with telemetry.span("leonardo.poll") as poll_span:
+            response = self.http.get(f"{self.base_url}/generations/{generation_id}", headers=self.headers)
+            if response.status_code != 200:
+                # Treat transient poll errors as "not ready yet"; the deadline bounds the wait
+                status, urls = "PENDING", []
+                poll_span.outcome = f"http_{response.status_code}"
+            else:
+                status, urls = extract_generation(response.json())
+            telemetry.LEONARDO_POLLS.inc(status=status)
+            return status, urls
+
+    def wait(self, generation_id, timeout=None, on_poll=None):
+        """Block until the job has images and return their URLs.
+
+        on_poll(attempt, status) is called after every poll. Raises LeonardoError if
+        the job fails or the deadline passes first.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        with self._lock:
+            event = self._events.setdefault(generation_id, threading.Event())
+
+        try:
+            intervals = backoff_intervals(self.initial_interval, maximum=self.max_interval)
+            for attempt, interval in enumerate(intervals, start=1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise LeonardoError(f"Timed out waiting for generation {generation_id}")
+
+                status, urls = "PENDING", []
+                if event.wait(min(interval, remaining)):
+                    with self._lock:
+                        status, urls = self._results.pop(generation_id, ("PENDING", []))
+                    event.clear()
+                if not urls and status != "FAILED":
+                    status, urls = self.poll(generation_id)
+                    if on_poll:
+                        on_poll(attempt, status)
+
+                if status == "FAILED":
+                    raise LeonardoError(f"Leonardo AI reported generation {generation_id} as failed")
+                if urls:
+                    return urls
+        finally:
+            with self._lock:
+                self._events.pop(generation_id, None)
+                self._results.pop(generation_id, None)
+
+    def notify(self, generation_id, generation_data):
+        """Record a completion pushed by Leonardo and wake whoever is waiting on it."""
+        with self._lock:
+            event = self._events.get(generation_id)
+            if event is None:
+                return False
+            self._results[generation_id] = extract_generation(generation_data)
+        event.set()
+        return True
+
+
+class WebhookReceiver:
+    """HTTP endpoint for Leonardo's generation webhook callbacks.
+
+    Leonardo posts to the callback URL configured on the API key, e.g.
+    {"type": "image_generation.complete", "data": {"object": {"id": ..., "images": [...]}}}.
+    """
+
+    def __init__(self, tracker, host="0.0.0.0", port=8765, token=None):
+        self.tracker = tracker
+        self.host = host
+        self.port = port
+        self.token = token
+        self._server = None
+
+    def start(self):
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if receiver.token and self.headers.get("authorization") != f"Bearer {receiver.token}":
+                    self.send_response(401)
+                    self.end_headers()
+                    return
+                try:
+                    length = int(self.headers.get("content-length", 0))
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                    generation = payload.get("data", {}).get("object", {})
+                    if generation.get("id"):
+                        receiver.tracker.notify(generation["id"], generation)
+                    self.send_response(200)
+                except ValueError:
+                    self.send_response(400)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
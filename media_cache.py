@@ -0,0 +1,120 @@
+"""Local, content-addressed cache of remote campaign media and their display-sized renditions."""
+import hashlib
+import io
+import os
+import tempfile
+import threading
+
+import requests
+from PIL import Image, features
+
+import telemetry
+
+CHUNK_SIZE = 64 * 1024
+URL_LOCKS = 64  # Downloads of URLs that hash to the same stripe wait for each other
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class MediaCache:
+    """Downloads each remote asset once and stores it under the hash of its content.
+
+    root/
+        urls/<sha256(url)>            -> content hash of what that URL returned
+        originals/<content hash>      -> the downloaded bytes
+        renditions/<hash>-<width>.ext -> resized WebP (or JPEG) versions for display
+    """
+
+    def __init__(self, root=".cache/media", http=requests, quality=82):
+        self.root = root
+        self.http = http
+        self.quality = quality
+        self.format = "WEBP" if features.check("webp") else "JPEG"
+        self.hits = 0
+        self.misses = 0
+        self._url_locks = [threading.Lock() for _ in range(URL_LOCKS)]
+        for folder in ("urls", "originals", "renditions"):
+            os.makedirs(os.path.join(root, folder), exist_ok=True)
+
+    def _url_lock(self, url):
+        # A fixed set of locks striped by the URL's hash, so memory does not grow with every URL ever fetched
+        return self._url_locks[int(_sha256(url)[:8], 16) % len(self._url_locks)]
+
+    def _write_atomic(self, path, chunks):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def cached_path(self, url):
+        """Return the local path of the asset behind url if it has been downloaded, else None."""
+        index_path = os.path.join(self.root, "urls", _sha256(url))
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                path = os.path.join(self.root, "originals", f.read().strip())
+            if os.path.exists(path):
+                return path
+        return None
+
+    def original_path(self, url):
+        """Return the local path of the asset behind url, downloading it on first use."""
+        with self._url_lock(url):
+            path = self.cached_path(url)
+            if path:
+                self.hits += 1
+                return path
+
+            self.misses += 1
+            with telemetry.span("media.fetch"):
+                return self._download(url, os.path.join(self.root, "urls", _sha256(url)))
+
+    def _download(self, url, index_path):
+        response = self.http.get(url, stream=True)
+        response.raise_for_status()
+
+        # Stream to a temp file while hashing, then move it to its content address
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, "originals"))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    digest.update(chunk)
+                    f.write(chunk)
+            path = os.path.join(self.root, "originals", digest.hexdigest())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        finally:
+            response.close()
+
+        self._write_atomic(index_path, [digest.hexdigest().encode()])
+        return path
+
+    def rendition_path(self, url, width):
+        """Return the path of a rendition at most width pixels wide (never upscaled)."""
+        original = self.original_path(url)
+        extension = "webp" if self.format == "WEBP" else "jpg"
+        path = os.path.join(self.root, "renditions", f"{os.path.basename(original)}-{width}.{extension}")
+        if os.path.exists(path):
+            return path
+
+        with Image.open(original) as image:
+            image.thumbnail((width, width * 4), Image.LANCZOS)
+            if self.format == "JPEG" or image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGB")
+            buffer = io.BytesIO()
+            image.save(buffer, self.format, quality=self.quality)
+        self._write_atomic(path, [buffer.getvalue()])
+        return path
+
+    def rendition(self, url, width):
+        with open(self.rendition_path(url, width), "rb") as f:
+            return f.read()
@@ -0,0 +1,156 @@
+"""Process-wide provider rate limiting: token buckets behind a fair FIFO admission queue."""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class Withdrawn(Exception):
+    """Raised by acquire() when its caller withdraws from the queue before being admitted."""
+
+
+class RateLimiter:
+    """Admits callers in arrival order within requests/minute, tokens/minute and concurrency limits.
+
+    Both buckets start full and refill continuously, so sustained throughput sits
+    at the limit while short bursts are absorbed. Only the head of the queue may
+    take from the buckets, so a large request is never starved by smaller ones.
+    """
+
+    def __init__(self, rpm=None, tpm=None, concurrent=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.concurrent = concurrent
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._requests = float(rpm or 0)
+        self._tokens = float(tpm or 0)
+        self._active = 0
+        self._updated = time.monotonic()
+        self.admitted = 0
+        self.queued = 0
+        self.wait_seconds = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed, self._updated = now - self._updated, now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def _delay(self, tokens):
+        # Seconds until the head of the queue fits in both buckets; None while blocked on concurrency
+        if self.concurrent and self._active >= self.concurrent:
+            return None
+        delay = 0.0
+        if self.rpm and self._requests < 1:
+            delay = max(delay, (1 - self._requests) * 60 / self.rpm)
+        if self.tpm:
+            cost = min(tokens, self.tpm)  # A request larger than the whole bucket waits for a full one
+            if self._tokens < cost:
+                delay = max(delay, (cost - self._tokens) * 60 / self.tpm)
+        return delay
+
+    @contextmanager
+    def acquire(self, tokens=0, on_queue=None, cancelled=None):
+        """Wait for admission, then hold a concurrency slot for the block.
+
+        on_queue(position) is called whenever this caller's 1-based queue position
+        changes while it waits, and once with 0 when it is admitted after waiting.
+        Setting the cancelled event (a threading.Event) while the caller still waits
+        takes it out of the queue and raises Withdrawn.
+        Yields a Lease; call lease.settle(actual_tokens) once the real usage is known.
+        """
+        ticket = object()
+        started = time.monotonic()
+        position = 0
+        with self._cond:
+            self._queue.append(ticket)
+            try:
+                while True:
+                    self._refill()
+                    delay = self._delay(tokens) if self._queue[0] is ticket else None
+                    if delay == 0:
+                        break
+                    if cancelled is not None and cancelled.is_set():
+                        raise Withdrawn("Withdrawn from the rate limit queue")
+                    current = self._queue.index(ticket) + 1
+                    if on_queue and current != position:
+                        on_queue(current)
+                    position = current
+                    if cancelled is not None:
+                        delay = min(delay, 0.25) if delay is not None else 0.25  # Nothing notifies us of a cancel, so check often
+                    self._cond.wait(delay)
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+            self._requests -= 1 if self.rpm else 0
+            self._tokens -= tokens if self.tpm else 0
+            self._active += 1
+            self.admitted += 1
+            if position:
+                self.queued += 1
+                self.wait_seconds += time.monotonic() - started
+        if position and on_queue:
+            on_queue(0)
+
+        try:
+            yield Lease(self, tokens)
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def _settle(self, difference):
+        if not self.tpm:
+            return
+        with self._cond:
+            self._tokens -= difference
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            self._refill()
+            return {
+                "waiting": len(self._queue),
+                "active": self._active,
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "avg_wait": self.wait_seconds / self.queued if self.queued else 0.0,
+                "requests_available": round(self._requests, 1) if self.rpm else None,
+                "tokens_available": round(self._tokens) if self.tpm else None
+            }
+
+
+class Lease:
+    def __init__(self, limiter, tokens):
+        self.limiter = limiter
+        self.tokens = tokens
+
+    def settle(self, actual_tokens):
+        # Correct the up-front estimate with the provider's reported usage (refunds or charges the difference)
+        self.limiter._settle(actual_tokens - self.tokens)
+        self.tokens = actual_tokens
+
+
+class ProviderLimits:
+    """One RateLimiter per provider or provider:model key.
+
+    A key like "openai:gpt-4.1" falls back to the provider-wide "openai" entry,
+    and keys with no configured limit are admitted straight away.
+    """
+
+    def __init__(self, limits):
+        self.limiters = {key: RateLimiter(**settings) for key, settings in limits.items()}
+        self._unlimited = RateLimiter()
+
+    def limiter(self, key):
+        return self.limiters.get(key) or self.limiters.get(key.split(":")[0]) or self._unlimited
+
+    def acquire(self, key, tokens=0, on_queue=None, cancelled=None):
+        return self.limiter(key).acquire(tokens, on_queue, cancelled)
+
+    def stats(self):
+        return {key: limiter.stats() for key, limiter in self.limiters.items()}
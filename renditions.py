@@ -0,0 +1,229 @@
+"""Branded social-format renditions of a campaign visual, rendered in worker processes.
+
+Each format is a centre crop of the original resized to the format's pixel size,
+with the team name set over a dark gradient along the bottom edge. Resampling and
+text drawing are CPU-bound and hold the GIL for much of their run, so they happen
+in a process pool instead of in Streamlit's script threads or the engine's.
+
+    folder/<source>-<format>-<team hash>.jpg
+"""
+import functools
+import hashlib
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import popen_spawn_posix, reduction, resource_tracker, spawn, util
+
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+import telemetry
+
+# Share of the height covered by the bottom gradient, and the tallest the team name may be
+OVERLAY_HEIGHT = 0.28
+TEXT_HEIGHT = 0.07
+
+
+@functools.lru_cache(maxsize=32)
+def _font(path, size):
+    try:
+        return ImageFont.truetype(path or "DejaVuSans-Bold.ttf", size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+def _warm_up(font_path):
+    _font(font_path, 64)
+
+
+def _overlay(image, team_name, font_path):
+    width, height = image.size
+    band = round(height * OVERLAY_HEIGHT)
+    shade = Image.linear_gradient("L").resize((width, band)).point(lambda value: value * 180 // 255)
+    image.paste((0, 0, 0), (0, height - band, width, height), shade)
+
+    # TEXT_HEIGHT of the image tall, shrunk until the name fits across it
+    size = round(height * TEXT_HEIGHT)
+    text = team_name.upper()
+    draw = ImageDraw.Draw(image)
+    while size > 12 and draw.textlength(text, font=_font(font_path, size)) > width * 0.88:
+        size = round(size * 0.9)
+    font = _font(font_path, size)
+    draw.text((width / 2, height - band * 0.3), text, font=font, fill="white", anchor="ms",
+              stroke_width=max(1, size // 24), stroke_fill="black")
+
+
+class _WorkerPopen(popen_spawn_posix.Popen):
+    # Streamlit (and AppTest) install the app script as __main__, and the spawn bootstrap re-runs
+    # __main__ in every child - secrets, engine, inventory, servers and all. Workers are launched
+    # as spawn_posix launches any child, except that the preparation data leaves __main__ out, so
+    # they import only what render_rendition needs; nothing process-wide is touched to do it.
+    def _launch(self, process_obj):
+        tracker_fd = resource_tracker.getfd()
+        self._fds.append(tracker_fd)
+        prep_data = spawn.get_preparation_data(process_obj._name)
+        prep_data.pop("init_main_from_name", None)
+        prep_data.pop("init_main_from_path", None)
+        fp = io.BytesIO()
+        popen_spawn_posix.set_spawning_popen(self)
+        try:
+            reduction.dump(prep_data, fp)
+            reduction.dump(process_obj, fp)
+        finally:
+            popen_spawn_posix.set_spawning_popen(None)
+
+        parent_r = child_w = child_r = parent_w = None
+        try:
+            parent_r, child_w = os.pipe()
+            child_r, parent_w = os.pipe()
+            cmd = spawn.get_command_line(tracker_fd=tracker_fd, pipe_handle=child_r)
+            self._fds.extend([child_r, child_w])
+            self.pid = util.spawnv_passfds(spawn.get_executable(), cmd, self._fds)
+            self.sentinel = parent_r
+            with open(parent_w, "wb", closefd=False) as f:
+                f.write(fp.getbuffer())
+        finally:
+            self.finalizer = util.Finalize(self, util.close_fds, [fd for fd in (parent_r, parent_w) if fd is not None])
+            for fd in (child_r, child_w):
+                if fd is not None:
+                    os.close(fd)
+
+
+class _WorkerProcess(multiprocessing.get_context("spawn").Process):
+    @staticmethod
+    def _Popen(process_obj):
+        return _WorkerPopen(process_obj)
+
+
+class _WorkerContext(multiprocessing.context.SpawnContext):
+    Process = _WorkerProcess
+
+
+def render_rendition(source, path, size, team_name, font_path=None, quality=88):
+    """Worker process entry point: write one branded rendition of source to path."""
+    with Image.open(source) as original:
+        original.draft("RGB", size)  # JPEG sources decode at reduced scale when that is still big enough
+        image = ImageOps.fit(original.convert("RGB"), tuple(size), Image.LANCZOS, centering=(0.5, 0.4))
+    if team_name:
+        _overlay(image, team_name, font_path)
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            image.save(f, "JPEG", quality=quality, optimize=True, progressive=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+
+class RenditionPool:
+    """Renders formats ({"1:1": (1080, 1080), ...}) of an image in worker processes.
+
+    A rendition already on disk is reused, and one still being rendered is shared
+    with every caller that asks for it, so a prefetch and the page showing the
+    result cost one render. workers=0 renders in the calling thread.
+    """
+
+    def __init__(self, formats, workers=None, font=None, quality=88):
+        self.formats = {name: tuple(size) for name, size in formats.items()}
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.font = font
+        self.quality = quality
+        self.rendered = 0
+        self.reused = 0
+        self._executor = None
+        self._pending = {}  # path -> Future
+        self._lock = threading.RLock()  # A future that is already done runs its callback in submit()
+
+    def _pool(self):
+        # Created on first use; workers are spawned, as forking the threaded server process is unsafe
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=_WorkerContext())
+        return self._executor
+
+    def start(self):
+        """Spawn the workers in the background, so the first campaign does not wait for them to start."""
+        if self.workers:
+            for _ in range(self.workers):
+                self._pool().submit(_warm_up, self.font)
+        return self
+
+    def path(self, source, team_name, folder, name):
+        base = os.path.splitext(os.path.basename(source))[0]
+        team = hashlib.sha256(team_name.encode()).hexdigest()[:10]
+        return os.path.join(folder, f"{base}-{name.replace(':', 'x')}-{team}.jpg")
+
+    def submit(self, source, team_name, folder, formats=None):
+        """Start rendering; returns format -> Future of the rendition's path."""
+        os.makedirs(folder, exist_ok=True)
+        futures = {}
+        inline = []
+        with self._lock:
+            for name in formats or self.formats:
+                path = self.path(source, team_name, folder, name)
+                if path in self._pending:
+                    futures[name] = self._pending[path]
+                    continue
+                if os.path.exists(path):
+                    self.reused += 1
+                    futures[name] = Future()
+                    futures[name].set_result(path)
+                    continue
+
+                args = (source, path, self.formats[name], team_name, self.font, self.quality)
+                if self.workers:
+                    future = self._pool().submit(render_rendition, *args)
+                else:
+                    future = Future()
+                    inline.append((future, args))
+                self.rendered += 1
+                self._pending[path] = future
+                future.add_done_callback(lambda _, path=path: self._done(path))
+                futures[name] = future
+        for future, args in inline:
+            try:
+                future.set_result(render_rendition(*args))
+            except Exception as e:
+                future.set_exception(e)
+        return futures
+
+    def _done(self, path):
+        with self._lock:
+            self._pending.pop(path, None)
+
+    def render(self, source, team_name, folder, formats=None, on_status=None):
+        """Render every format of source and return format -> path."""
+        with telemetry.span("renditions", formats=len(formats or self.formats), workers=self.workers):
+            futures = self.submit(source, team_name, folder, formats)
+            paths = {}
+            for name, future in futures.items():
+                try:
+                    paths[name] = future.result()
+                except BrokenProcessPool:
+                    # A worker died (killed for memory, say); the next render starts a fresh pool
+                    with self._lock:
+                        self._executor = None
+                    raise
+                if on_status:
+                    on_status("rendering", done=len(paths), total=len(futures))
+        return paths
+
+    def render_url(self, media, url, team_name, formats=None, on_status=None):
+        """Engine task: fetch url through the media cache and render its formats alongside it."""
+        if on_status:
+            on_status("starting")
+        return self.render(media.original_path(url), team_name, os.path.join(media.root, "branded"), formats, on_status)
+
+    def stats(self):
+        with self._lock:
+            return {"workers": self.workers, "rendered": self.rendered, "reused": self.reused, "pending": len(self._pending)}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -0,0 +1,323 @@
+"""Process-wide circuit breakers per provider, and hedged calls that race a slow request against an alternate."""
+import contextvars
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from contextlib import contextmanager
+
+# Losing hedges still running after their race was decided; while MAX_ABANDONED of them are, calls are not hedged,
+# so requests stuck upstream cannot pile up behind new ones
+MAX_ABANDONED = 16
+_abandoned = 0
+_abandoned_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Opens when too many recent calls failed or ran slower than slow_call seconds.
+
+    The error rate is taken over the calls of the last window seconds, once there
+    are at least min_calls of them. An open breaker rejects calls outright for
+    cooldown seconds, then lets a single probe through (half-open); the probe
+    closes it again or re-opens it. Latencies of successful calls are kept per
+    kind ("call", "first_token") so hedging can wait for the observed p95.
+    """
+
+    def __init__(self, error_rate=0.5, slow_call=30.0, window=60.0, min_calls=5, cooldown=30.0):
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.window = window
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.opened = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._calls = deque()  # (finished, ok)
+        self._latencies = {}  # kind -> deque of seconds
+        self._opened_at = 0.0
+        self._probing = False
+
+    def allow(self):
+        """True if a call may go ahead now; an open breaker past its cooldown admits one probe."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, ok, duration=None, kind="call"):
+        now = time.monotonic()
+        failed = not ok or (duration is not None and self.slow_call and duration > self.slow_call)
+        with self._lock:
+            if ok and duration is not None:
+                self._latencies.setdefault(kind, deque(maxlen=200)).append(duration)
+            if self.state == "half_open" and self._probing:
+                self._probing = False
+                if failed:
+                    self._open(now)
+                else:
+                    self.state = "closed"
+                    self._calls.clear()
+                return
+            self._calls.append((now, not failed))
+            while self._calls and now - self._calls[0][0] > self.window:
+                self._calls.popleft()
+            failures = sum(not ok for _, ok in self._calls)
+            if self.state == "closed" and len(self._calls) >= self.min_calls and failures / len(self._calls) >= self.error_rate:
+                self._open(now)
+
+    def _open(self, now):
+        self.state = "open"
+        self.opened += 1
+        self._opened_at = now
+        self._calls.clear()
+
+    def check(self, name="provider"):
+        """Raise CircuitOpenError straight away if the breaker is not admitting calls."""
+        if not self.allow():
+            raise CircuitOpenError(f"{name} circuit open - recent calls failed or were too slow")
+
+    def release(self):
+        # A call abandoned before it finished (a losing hedge) counts neither way
+        with self._lock:
+            if self.state == "half_open":
+                self._probing = False
+
+    @contextmanager
+    def timed(self, kind="call"):
+        """Time a call admitted by check() and record how it ended."""
+        started = time.monotonic()
+        try:
+            yield
+        except GeneratorExit:
+            self.release()
+            raise
+        except BaseException:
+            self.record(False)
+            raise
+        self.record(True, time.monotonic() - started, kind)
+
+    def p95(self, kind="call", min_samples=20):
+        """95th percentile latency of recent successful calls, or None until there are enough of them."""
+        with self._lock:
+            samples = sorted(self._latencies.get(kind, ()))
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def stats(self):
+        with self._lock:
+            calls = len(self._calls)
+            failures = sum(not ok for _, ok in self._calls)
+            return {
+                "state": self.state,
+                "calls": calls,
+                "error_rate": failures / calls if calls else 0.0,
+                "opened": self.opened,
+                "rejected": self.rejected
+            }
+
+
+class ProviderBreakers:
+    """One CircuitBreaker per provider or provider:model key.
+
+    Every key gets its own breaker, configured from its own entry or, failing
+    that, the provider-wide one, so one degraded model does not trip the others.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, key):
+        with self._lock:
+            if key not in self.breakers:
+                settings = self.settings.get(key) or self.settings.get(key.split(":")[0]) or {}
+                self.breakers[key] = CircuitBreaker(**settings)
+            return self.breakers[key]
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self.breakers)
+        return {key: breaker.stats() for key, breaker in breakers.items()}
+
+
+class HedgeLeg:
+    """Handed to each side of a hedged call.
+
+    A side calls admitted() once it is past any rate limit queue, so the hedge
+    delay counts from its admission rather than from when it joined the queue.
+    cancelled is set once the race is decided; pass it to the rate limiter so a
+    side still queued withdraws instead of running a request nobody will read.
+    """
+
+    def __init__(self, on_admitted=None):
+        self.cancelled = threading.Event()
+        self._on_admitted = on_admitted
+
+    def admitted(self):
+        if self._on_admitted:
+            self._on_admitted()
+
+
+def _start(fn, *args):
+    # Each side runs on its own thread in a copy of the caller's context, so the caller can wait on whichever
+    # answers first and losers still finishing never hold up another call's requests
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=contextvars.copy_context().run, args=(run,), name="hedge", daemon=True).start()
+    return future
+
+
+def _abandon(futures):
+    # Count the sides still running once a race is over until they finish
+    global _abandoned
+    for future in futures:
+        if not future.done():
+            with _abandoned_lock:
+                _abandoned += 1
+            future.add_done_callback(_finished)
+
+
+def _finished(future):
+    global _abandoned
+    with _abandoned_lock:
+        _abandoned -= 1
+
+
+def _can_hedge():
+    with _abandoned_lock:
+        return _abandoned < MAX_ABANDONED
+
+
+def hedged(primary, alternate, delay):
+    """Return primary(leg)'s result, but if it has not answered within delay seconds of its admission (or has
+    already failed) also start alternate(leg) and return whichever succeeds first. Only when both fail is the
+    error raised. The loser's leg is cancelled, so it withdraws if still queued; one already running is left
+    to finish in the background and its result is dropped, and while MAX_ABANDONED such losers are still
+    running, calls are not hedged at all."""
+    if alternate is None or delay is None or not _can_hedge():
+        return primary(HedgeLeg())
+    admitted = threading.Event()
+    legs = [HedgeLeg(admitted.set), HedgeLeg()]
+    futures = [_start(primary, legs[0])]
+    futures[0].add_done_callback(lambda future: admitted.set())
+    try:
+        # Time spent queued for the primary's rate limit never triggers a hedge
+        admitted.wait()
+        done, _ = wait(futures, timeout=delay)
+        if not done or futures[0].exception() is not None:
+            futures.append(_start(alternate, legs[1]))
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = error or future.exception()
+        raise error
+    finally:
+        for leg in legs:
+            leg.cancelled.set()
+        _abandon(futures)
+
+
+def hedged_stream(primary, alternate, delay, on_win=None):
+    """Yield the chunks of whichever stream produces its first chunk first. alternate(leg) is only started
+    if primary(leg) has produced nothing within delay seconds of its admission, or has failed before its first
+    chunk; the losing stream is cancelled and closed as soon as the other one wins. on_win(index) is called
+    with 0 (primary) or 1 (alternate) before the first chunk is yielded. Like hedged(), it does not hedge
+    while MAX_ABANDONED losers are still running."""
+    if alternate is None or delay is None or not _can_hedge():
+        if on_win:
+            on_win(0)
+        yield from primary(HedgeLeg())
+        return
+
+    chunks = queue.Queue()
+    winner = []  # Index of the stream being yielded, once one has produced a chunk
+    lock = threading.Lock()
+    done = object()
+    admitted = object()
+    legs = [HedgeLeg(lambda: chunks.put((0, admitted, None))), HedgeLeg()]
+
+    def pump(index, fn):
+        stream = None
+        try:
+            stream = fn(legs[index])
+            for chunk in stream:
+                with lock:
+                    if not winner:
+                        winner.append(index)
+                        legs[1 - index].cancelled.set()
+                    if winner[0] != index or legs[index].cancelled.is_set():
+                        return
+                chunks.put((index, chunk, None))
+            chunks.put((index, done, None))
+        except Exception as e:
+            chunks.put((index, None, e))
+        finally:
+            if stream is not None:
+                stream.close()
+
+    pumps = [_start(pump, 0, primary)]
+    running = 1
+    started = False  # Whether the alternate has been started
+    deadline = None  # Set once the primary is admitted
+    error = None
+    announced = False  # Whether on_win has been called
+    try:
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if deadline is not None and not started and not winner else None
+            try:
+                index, chunk, e = chunks.get(timeout=timeout)
+            except queue.Empty:
+                index, chunk, e = None, None, None
+            if chunk is admitted:
+                deadline = time.monotonic() + delay
+                continue
+            if index is None or (e is not None and not winner and not started):
+                # The primary is slow (or failed before its first chunk): race the alternate
+                if e is not None:
+                    error, running = e, running - 1
+                started = True
+                pumps.append(_start(pump, 1, alternate))
+                running += 1
+                continue
+            if e is not None:
+                if winner and winner[0] == index:
+                    raise e
+                error, running = error or e, running - 1
+                if not running:
+                    raise error
+                continue
+            if chunk is done:
+                return
+            if on_win and not announced:
+                on_win(index)
+                announced = True
+            yield chunk
+    finally:
+        # Also stops the winner if the caller stops reading
+        for leg in legs:
+            leg.cancelled.set()
+        _abandon(pumps)
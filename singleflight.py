@@ -0,0 +1,103 @@
+"""Single-flight: concurrent identical calls share one upstream execution and its result."""
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.done = False
+        self.result = None
+        self.error = None
+        self.chunks = []
+
+
+class SingleFlight:
+    """Deduplicates in-flight work by key; the first caller runs it, later callers wait for its outcome.
+
+    Only calls that overlap are shared. Once a flight lands its key is forgotten,
+    so repeat requests after that go to the generation cache or upstream again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.flights = 0
+        self.shared = 0
+
+    def _join(self, key):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.shared += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self.flights += 1
+            return call, True
+
+    def _land(self, key, call, result=None, error=None):
+        with self._lock:
+            del self._calls[key]
+        with call.cond:
+            call.result = result
+            call.error = error
+            call.done = True
+            call.cond.notify_all()
+
+    def do(self, key, fn, on_join=None):
+        """Return fn()'s result, or that of an identical call already in flight (on_join is then called)."""
+        call, leader = self._join(key)
+        if not leader:
+            if on_join:
+                on_join()
+            with call.cond:
+                call.cond.wait_for(lambda: call.done)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self._land(key, call, error=e)
+            raise
+        self._land(key, call, result=result)
+        return result
+
+    def stream(self, key, fn, on_join=None):
+        """Like do() for a generator: joiners replay the chunks received so far, then follow it live."""
+        call, leader = self._join(key)
+        if not leader:
+            if on_join:
+                on_join()
+            index = 0
+            while True:
+                with call.cond:
+                    call.cond.wait_for(lambda: call.done or len(call.chunks) > index)
+                    chunks = call.chunks[index:]
+                    done = call.done
+                index += len(chunks)
+                yield from chunks
+                if done and index == len(call.chunks):
+                    break
+            if call.error is not None:
+                raise call.error
+            return
+
+        try:
+            for chunk in fn():
+                with call.cond:
+                    call.chunks.append(chunk)
+                    call.cond.notify_all()
+                yield chunk
+        except GeneratorExit:
+            # The leader's consumer stopped reading, so nobody is driving the upstream stream any more
+            self._land(key, call, error=RuntimeError("Shared stream was abandoned"))
+            raise
+        except BaseException as e:
+            self._land(key, call, error=e)
+            raise
+        self._land(key, call)
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._calls), "flights": self.flights, "shared": self.shared}
@@ -0,0 +1,191 @@
+"""Anthem catalogue: every track indexed once per process and checked before it is offered.
+
+The index comes from a JSON manifest (a local path or URL) or, without one, from
+listing the S3 bucket; if the bucket cannot be listed either, the historical
+<genre>-<n>.mp3 names are assumed. Every track is then checked with a HEAD request
+in the background, recording whether it exists, its size and, when the manifest
+does not give one, its duration from the x-amz-meta-duration header. pick() only
+offers tracks that passed (or have not been checked yet).
+
+    {"tracks": [{"genre": "rock-anthem", "key": "rock-anthem-1.mp3", "title": "Thunder Road", "duration": 184}]}
+"""
+import json
+import logging
+import random
+import threading
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = (".mp3", ".m4a", ".aac", ".ogg", ".wav")
+DEFAULT_TRACKS_PER_GENRE = 10
+
+
+class SongLibrary:
+    """Tracks by genre with their HEAD-checked availability, size and duration."""
+
+    def __init__(self, bucket_url, genres, http=requests, manifest=None, validators=8):
+        self.bucket_url = bucket_url.rstrip("/")
+        # Longest id first, so a key is matched to the most specific genre prefix
+        self.genres = sorted(genres, key=len, reverse=True)
+        self.http = http
+        self.manifest = manifest
+        self.validators = validators
+        self.source = None
+        self.validated = threading.Event()
+        self._tracks = {}  # url -> track
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Build the index from the manifest, the bucket listing or the default names."""
+        with telemetry.span("songs.index"):
+            entries = None
+            if self.manifest:
+                try:
+                    entries, self.source = self._read_manifest(), "manifest"
+                except Exception as e:
+                    logger.warning("Could not read song manifest %s: %s", self.manifest, e)
+            if entries is None:
+                try:
+                    entries, self.source = self._list_bucket(), "bucket listing"
+                except Exception as e:
+                    logger.warning("Could not list %s: %s", self.bucket_url, e)
+                    entries, self.source = self._default_entries(), "default names"
+
+        tracks = {}
+        for entry in entries:
+            genre = entry.get("genre") or self._genre_of(entry.get("key") or entry["url"])
+            if genre not in self.genres:
+                continue
+            url = entry.get("url") or f"{self.bucket_url}/{quote(entry['key'])}"
+            tracks[url] = {
+                "url": url,
+                "genre": genre,
+                "title": entry.get("title"),
+                "duration": entry.get("duration"),  # Seconds
+                "bytes": entry.get("size"),
+                "available": None  # Unchecked
+            }
+        with self._lock:
+            self._tracks = tracks
+        return self
+
+    def _read_manifest(self):
+        if self.manifest.startswith(("http://", "https://")):
+            response = self.http.get(self.manifest)
+            response.raise_for_status()
+            data = response.json()
+        else:
+            with open(self.manifest, encoding="utf-8") as f:
+                data = json.load(f)
+        return data["tracks"] if isinstance(data, dict) else data
+
+    def _list_bucket(self):
+        # S3 ListObjectsV2, following continuation tokens; namespaces are ignored so stand-ins need not send them
+        entries = []
+        params = {"list-type": "2"}
+        while True:
+            response = self.http.get(self.bucket_url + "/", params=params)
+            response.raise_for_status()
+            root = ElementTree.fromstring(response.content)
+            fields = {}
+            for element in root.iter():
+                tag = element.tag.rsplit("}", 1)[-1]
+                if tag == "Contents":
+                    item = {child.tag.rsplit("}", 1)[-1]: child.text for child in element}
+                    if item.get("Key", "").lower().endswith(AUDIO_EXTENSIONS):
+                        entries.append({"key": item["Key"], "size": int(item.get("Size") or 0) or None})
+                elif tag in ("IsTruncated", "NextContinuationToken"):
+                    fields[tag] = element.text
+            if fields.get("IsTruncated") != "true" or not fields.get("NextContinuationToken"):
+                return entries
+            params["continuation-token"] = fields["NextContinuationToken"]
+
+    def _default_entries(self):
+        return [{"genre": genre, "key": f"{genre}-{i}.mp3"} for genre in self.genres for i in range(1, DEFAULT_TRACKS_PER_GENRE + 1)]
+
+    def _genre_of(self, key):
+        name = key.rsplit("/", 1)[-1]
+        return next((genre for genre in self.genres if name.startswith(genre)), None)
+
+    def start(self):
+        """Validate every track on a background thread so startup does not wait for the HEAD requests."""
+        threading.Thread(target=self.validate, name="song-library-validate", daemon=True).start()
+        return self
+
+    def validate(self):
+        with self._lock:
+            tracks = list(self._tracks.values())
+        with telemetry.span("songs.validate", tracks=len(tracks)):
+            with ThreadPoolExecutor(self.validators) as pool:
+                list(pool.map(self._check, tracks))
+        self.validated.set()
+        stats = self.stats()
+        logger.log(logging.WARNING if stats["missing"] else logging.INFO, "Song library (%s): %d of %d tracks available",
+                   stats["source"], stats["available"], stats["tracks"])
+        return stats
+
+    def _check(self, track):
+        try:
+            response = self.http.head(track["url"], allow_redirects=True)
+            found = response.status_code == 200
+        except requests.RequestException as e:
+            logger.debug("Song %s unreachable: %s", track["url"], e)
+            found, response = False, None
+        with self._lock:
+            track["available"] = found
+            if found:
+                size = response.headers.get("content-length")
+                duration = response.headers.get("x-amz-meta-duration")
+                track["bytes"] = int(size) if size else track["bytes"]
+                if track["duration"] is None and duration:
+                    track["duration"] = float(duration)
+
+    def track(self, url):
+        with self._lock:
+            track = self._tracks.get(url)
+            return dict(track) if track else None
+
+    def pick(self, genre, rng=random):
+        """A random playable track of the genre, or None when it has none."""
+        with self._lock:
+            candidates = [dict(track) for track in self._tracks.values() if track["genre"] == genre and track["available"] is not False]
+        return rng.choice(candidates) if candidates else None
+
+    def prefetch(self, urls, media):
+        """Download tracks into the media cache ahead of playback; returns url -> local path for those that arrived."""
+        def fetch(url):
+            try:
+                return media.original_path(url)
+            except Exception as e:
+                logger.warning("Could not prefetch song %s: %s", url, e)
+                with self._lock:
+                    if url in self._tracks:
+                        self._tracks[url]["available"] = False
+                return None
+
+        urls = list(urls)
+        with telemetry.span("songs.prefetch", tracks=len(urls)):
+            with ThreadPoolExecutor(max(1, min(self.validators, len(urls)))) as pool:
+                paths = dict(zip(urls, pool.map(fetch, urls)))
+        return {url: path for url, path in paths.items() if path}
+
+    def stats(self):
+        with self._lock:
+            tracks = list(self._tracks.values())
+        available = [track for track in tracks if track["available"]]
+        return {
+            "source": self.source,
+            "tracks": len(tracks),
+            "available": len(available),
+            "missing": sum(track["available"] is False for track in tracks),
+            "bytes": sum(track["bytes"] or 0 for track in available),
+            "duration": sum(track["duration"] or 0 for track in available),
+            "validated": self.validated.is_set()
+        }
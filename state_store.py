@@ -0,0 +1,136 @@
+"""Campaign state stores shared between app replicas.
+
+Every store holds JSON values under (key, field) pairs and forgets a key once it
+has gone ttl seconds without a write. The app keeps each session's campaign
+under "session:<campaign id>" and the engine keeps finished task results under
+"artifacts:<campaign id>", so a campaign resumes on whichever replica the user
+lands on. Pick one with STATE_STORE_URL:
+
+    sqlite:///.cache/campaigns.sqlite3   replicas sharing a host or volume
+    redis://host:6379/0                  replicas anywhere (needs the redis package)
+    memory://                            single process stand-in; nothing survives a restart
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class MemoryStateStore:
+    """In-process stand-in with the same interface and expiry as the shared stores."""
+
+    def __init__(self, ttl=24 * 3600):
+        self.ttl = ttl
+        self._keys = {}  # key -> (fields, updated)
+        self._lock = threading.Lock()
+
+    def get(self, key, field):
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is None or time.time() - entry[1] > self.ttl:
+                return None
+            value = entry[0].get(field)
+        return None if value is None else json.loads(value)
+
+    def put(self, key, field, value):
+        data = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            fields = self._keys[key][0] if key in self._keys else {}
+            fields[field] = data
+            self._keys[key] = (fields, now)
+            for stale in [k for k, (_, updated) in self._keys.items() if now - updated > self.ttl]:
+                del self._keys[stale]
+
+    def delete(self, key):
+        with self._lock:
+            self._keys.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "memory", "keys": len(self._keys)}
+
+
+class SQLiteStateStore:
+    """SQLite file in WAL mode, so replicas on one host (or a shared volume) see each other's writes."""
+
+    def __init__(self, path, ttl=24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            " key TEXT NOT NULL, field TEXT NOT NULL, value TEXT NOT NULL, updated REAL NOT NULL,"
+            " PRIMARY KEY (key, field))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS state_updated ON state (updated)")
+
+    def get(self, key, field):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM state WHERE key = ? AND field = ? AND updated > ?",
+                (key, field, time.time() - self.ttl)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, field, value):
+        data = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO state (key, field, value, updated) VALUES (?, ?, ?, ?)", (key, field, data, now))
+            # A key's fields expire together, from its latest write
+            self._db.execute("UPDATE state SET updated = ? WHERE key = ?", (now, key))
+            self._db.execute("DELETE FROM state WHERE updated < ?", (now - self.ttl,))
+
+    def delete(self, key):
+        with self._lock:
+            self._db.execute("DELETE FROM state WHERE key = ?", (key,))
+
+    def stats(self):
+        with self._lock:
+            keys, size = self._db.execute("SELECT COUNT(DISTINCT key), COALESCE(SUM(LENGTH(value)), 0) FROM state").fetchone()
+        return {"backend": "sqlite", "keys": keys, "bytes": size}
+
+
+class RedisStateStore:
+    """Redis (or any server speaking its protocol) hashes, one per key, expiring ttl seconds after the last write."""
+
+    def __init__(self, url, ttl=24 * 3600):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("STATE_STORE_URL points at Redis but the redis package is not installed (pip install redis)")
+        self.ttl = ttl
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key, field):
+        value = self._redis.hget(key, field)
+        return None if value is None else json.loads(value)
+
+    def put(self, key, field, value):
+        pipe = self._redis.pipeline()
+        pipe.hset(key, field, json.dumps(value))
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def delete(self, key):
+        self._redis.delete(key)
+
+    def stats(self):
+        return {"backend": "redis", "keys": self._redis.dbsize()}
+
+
+def open_state_store(url, ttl=24 * 3600):
+    if url.startswith("sqlite:///"):
+        return SQLiteStateStore(url[len("sqlite:///"):], ttl)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStateStore(url, ttl)
+    if url.startswith("memory://"):
+        return MemoryStateStore(ttl)
+    raise ValueError(f"Unsupported state store URL: {url}")
@@ -0,0 +1,242 @@
+"""Timing spans and Prometheus-style metrics for the campaign generation pipeline.
+
+Spans carry the tags bound with tagged() (the engine binds campaign, task, session
+and team for every task), are logged as JSON lines on the "telemetry" logger at
+DEBUG level, feed the span latency histogram and are kept in a small in-memory
+ring so a page can show where its own campaign's time went.
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans range from cache lookups to multi-minute Leonardo jobs
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120)
+
+_tags = contextvars.ContextVar("telemetry_tags", default={})
+_current = contextvars.ContextVar("telemetry_span", default=None)
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets + ("+Inf",), series[:len(self.buckets)] + [series[-1]]):
+                    lines.append(f"{self.name}_bucket{_label_text(self.labels + ('le',), key + (bound,))} {count}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, key)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """Reads its value(s) at scrape time: fn returns a number, or a dict of label-value tuples to numbers."""
+
+    def __init__(self, name, help, fn, labels=()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labels = tuple(labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.fn()
+        except Exception as e:
+            logger.warning("Gauge %s failed: %s", self.name, e)
+            return lines
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_label_text(self.labels, key)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        # Re-registering a name replaces it, so Streamlit reruns can register gauges safely
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, fn, labels=()):
+        return self._add(Gauge(name, help, fn, labels))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+SPAN_SECONDS = registry.histogram("campaign_span_seconds", "Duration of each generation pipeline step", ("span", "outcome"))
+FALLBACKS = registry.counter("campaign_fallbacks_total", "Results replaced by sample content after a failure", ("stage",))
+LEONARDO_POLLS = registry.counter("leonardo_polls_total", "Status polls made for Leonardo jobs", ("status",))
+
+recent_spans = deque(maxlen=5000)
+_spans_lock = threading.Lock()
+
+
+class Span:
+    def __init__(self, name, tags):
+        self.name = name
+        self.tags = tags
+        self.outcome = "ok"
+
+    def tag(self, **tags):
+        self.tags.update(tags)
+
+
+@contextmanager
+def span(name, **tags):
+    """Time a block. Set .outcome (e.g. "cached", "fallback") to label how it ended; exceptions mark it "error"."""
+    current = Span(name, dict(_tags.get(), **tags))
+    token = _current.set(current)
+    started = time.time()
+    clock = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        if current.outcome == "ok":
+            current.outcome = "error"
+            current.tags["error"] = str(e)[:200]
+        raise
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            pass  # A generator's span closed from another context (e.g. garbage collected)
+        duration = time.perf_counter() - clock
+        SPAN_SECONDS.observe(duration, span=name, outcome=current.outcome)
+        record = dict(current.tags, span=name, outcome=current.outcome, start=round(started, 3), duration=round(duration, 4))
+        with _spans_lock:
+            recent_spans.append(record)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps(record, default=str))
+
+
+@contextmanager
+def tagged(**tags):
+    """Attach tags to every span started inside the block (including threads started with a copied context)."""
+    token = _tags.set(dict(_tags.get(), **tags))
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+def fallback(stage, reason):
+    """Count a fallback to sample content and mark the innermost open span with it."""
+    FALLBACKS.inc(stage=stage)
+    if _current.get() is not None:
+        _current.get().outcome = "fallback"
+    logger.warning("%s fell back to sample content: %s %s", stage, reason, json.dumps(_tags.get(), default=str))
+
+
+def spans(**match):
+    """Recent spans whose tags match, oldest first."""
+    with _spans_lock:
+        records = list(recent_spans)
+    return [record for record in records if all(record.get(key) == value for key, value in match.items())]
+
+
+class MetricsServer:
+    """Serves the registry in the Prometheus text format at /metrics."""
+
+    def __init__(self, host="0.0.0.0", port=9100, registry=registry):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._server = None
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = server.registry.render().encode()
+                self.send_response(200)
+                self.send_header("content-type", "text/plain; version=0.0.4")
+                self.send_header("content-length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None